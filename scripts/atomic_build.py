@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Reader-safe rebuilds of the knowledge-base database.
+
+create_cacao_db.py normally deletes the database and builds it in place, so
+anything reading it meanwhile sees a missing or half-built file. With
+--atomic the build goes to a temporary file next to the target
+(<db>.building-<pid>), is checked, and is renamed over the target with
+os.replace(), which is atomic within one filesystem:
+
+- PRAGMA integrity_check must report ok;
+- the row counts read back from the closed file must match the build's;
+- manual_fts must pass the FTS5 integrity-check against manual_sections,
+  index exactly one row per section, and have its sync triggers (unless
+  the text is compressed, see text_compression.py: the index then cannot be
+  compared with the stored bytes and has no triggers by design).
+
+A failed build or check leaves the live database untouched and removes the
+temporary file. Readers that already have the old file open keep reading
+it; new connections see the new file.
+
+Embedding updates change the live file in place; generate_embeddings.py
+--wal switches it to WAL journaling, so readers keep reading the last
+committed state while the update runs, checkpoints the log at the end and
+switches back to rollback journaling, so the shipped asset the app copies
+is a single file in the default journal mode.
+
+Usage:
+    python scripts/create_cacao_db.py --atomic
+    python scripts/generate_embeddings.py --wal
+    python scripts/atomic_build.py --db path/to/cacao_manual.db   # run the checks only
+"""
+
+import argparse
+import os
+import sqlite3
+
+import text_compression
+
+DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'assets', 'database', 'cacao_manual.db')
+FTS_TRIGGERS = ('manual_sections_ai', 'manual_sections_ad', 'manual_sections_au')
+BUSY_TIMEOUT_MS = 5000
+
+
+def temp_build_path(db_path):
+    """Temporary path in the target's directory, so the final rename stays atomic."""
+    return f'{db_path}.building-{os.getpid()}'
+
+
+def remove_database_files(path):
+    """Remove a database file and any journal, WAL or shared-memory file next to it."""
+    for suffix in ('', '-journal', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def database_problems(path, expected_counts=None):
+    """List what is wrong with a built database (empty if it passes every check)."""
+    from create_cacao_db import table_counts
+
+    problems = []
+    conn = sqlite3.connect(path)
+    try:
+        compressed = text_compression.is_compressed(conn)
+        result = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+        if result != ['ok']:
+            problems.extend(f"integrity_check: {line}" for line in result)
+
+        counts = table_counts(conn)
+        if not counts['sections']:
+            problems.append("manual_sections is empty")
+        for name, expected in (expected_counts or {}).items():
+            if counts.get(name) != expected:
+                problems.append(f"{name}: {counts.get(name)} rows, expected {expected}")
+
+        try:
+            if compressed:
+                conn.execute("INSERT INTO manual_fts(manual_fts) VALUES ('integrity-check')")
+            else:
+                # rank = 1 also compares the index with the external content table
+                conn.execute("INSERT INTO manual_fts(manual_fts, rank) VALUES ('integrity-check', 1)")
+        except sqlite3.DatabaseError as e:
+            problems.append(f"manual_fts integrity-check: {e}")
+        indexed = conn.execute('SELECT COUNT(*) FROM manual_fts_docsize').fetchone()[0]
+        if indexed != counts['sections']:
+            problems.append(f"manual_fts indexes {indexed} rows for {counts['sections']} sections")
+        triggers = {row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'manual_sections'")}
+        missing = [name for name in FTS_TRIGGERS if name not in triggers]
+        if missing and not compressed:
+            problems.append(f"missing FTS triggers: {', '.join(missing)}")
+        conn.rollback()
+    finally:
+        conn.close()
+    return problems
+
+
+def verify_database(path, expected_counts=None):
+    problems = database_problems(path, expected_counts)
+    if problems:
+        raise ValueError(f"{path} failed verification: " + '; '.join(problems))
+
+
+def _fsync(path, directory=False):
+    fd = os.open(path, os.O_RDONLY | (getattr(os, 'O_DIRECTORY', 0) if directory else 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def swap_into_place(build_path, db_path):
+    """Atomically replace db_path with the verified build."""
+    _fsync(build_path)
+    if os.path.exists(db_path):
+        # Fold a WAL-mode target's log back into it, so no committed update
+        # is left only in <db>-wal when the file is replaced
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        except sqlite3.DatabaseError:
+            pass
+        finally:
+            conn.close()
+    os.replace(build_path, db_path)
+    try:
+        _fsync(os.path.dirname(os.path.abspath(db_path)), directory=True)
+    except OSError:
+        pass  # Directories cannot be fsynced on every platform
+
+
+def enable_wal(conn):
+    """Switch a connection's database to WAL so readers are never blocked by the writer."""
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+    mode = conn.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+    if mode.lower() != 'wal':
+        raise ValueError(f"Could not switch to WAL journaling (journal_mode is {mode})")
+    conn.execute('PRAGMA synchronous = NORMAL')
+
+
+def checkpoint(conn):
+    """Copy the WAL into the database file and truncate it; returns (log pages, checkpointed).
+
+    TRUNCATE reports 0 pages once the log is emptied, so the counts come from
+    a PASSIVE checkpoint run first.
+    """
+    busy, log_pages, checkpointed = conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return log_pages, checkpointed
+
+
+def disable_wal(conn):
+    """Switch back to rollback journaling, so the shipped file is not left in WAL mode.
+
+    Needs the database to itself; returns the journal mode in effect afterwards.
+    """
+    try:
+        return conn.execute('PRAGMA journal_mode = DELETE').fetchone()[0]
+    except sqlite3.OperationalError:  # Another connection still has it open
+        return 'wal'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the atomic-build checks on a database.')
+    parser.add_argument('--db', default=DB_PATH, help='Path to cacao_manual.db')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"Error: Database not found at {args.db}")
+        exit(1)
+    problems = database_problems(args.db)
+    if problems:
+        for problem in problems:
+            print(f"  ✗ {problem}")
+        exit(1)
+    print(f"{args.db} passed integrity, row count and FTS checks")
+
+
+if __name__ == '__main__':
+    main()
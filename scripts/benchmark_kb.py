@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Scaling benchmark for the knowledge-base build and query paths.
+
+For every corpus size the suite:
+1. Synthesizes a source directory from the seed sections (see kb_sources.py)
+2. Builds the DB with create_cacao_db.py --source --bulk
+3. Embeds it with generate_embeddings.py (cache disabled)
+4. Times FTS queries with the app's bm25 query, exact vector search over the
+   memory-mapped matrix (kb_search.py) and hybrid search
+
+and writes everything to a JSON report so runs can be compared.
+
+By default the embedding model is replaced by HashingEncoder, a deterministic
+hashed bag-of-words stub, so the suite needs no network and no model
+download. Pass --real-model to use the sentence-transformers model instead,
+or --server to encode through a running embedding_server.py.
+
+Usage:
+    python scripts/benchmark_kb.py                           # 1k, 10k, 100k, 1M rows
+    python scripts/benchmark_kb.py --sizes 1000,10000 --output bench.json
+    python scripts/benchmark_kb.py --sizes 100000 --ivf
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+import zlib
+import numpy as np
+
+import create_cacao_db
+import generate_embeddings
+import ivf_index
+import kb_search
+import kb_sources
+
+SIZES = (1_000, 10_000, 100_000, 1_000_000)
+QUERY_COUNT = 200
+
+# Farmer-style queries used for latency measurements
+BENCHMARK_QUERIES = [
+    'monilia', 'escoba de bruja', 'mazorca negra', 'poda', 'fermentación',
+    'secado del grano', 'hormiga arriera', 'fertilización', 'sombra', 'cosecha',
+    'manchas en la mazorca', 'cómo fermentar el cacao', 'control de plagas',
+    'hongo en el fruto', 'calidad del grano', 'trazabilidad', 'almacenamiento',
+    'deficiencia de nitrógeno', 'fungicida cúprico', 'humedad del grano',
+]
+
+# Model name recorded for vectors of the stub, so they never pass for the real model's
+STUB_MODEL_NAME = 'HashingEncoder (stub)'
+
+
+class HashingEncoder:
+    """Deterministic stand-in for SentenceTransformer (hashed bag of words).
+
+    Tokens are hashed with CRC32 into signed buckets, so results are stable
+    across runs and machines and the cost scales with text length like a
+    real encoder, without any model download.
+    """
+
+    def __init__(self, model_name=None, dim=generate_embeddings.EMBEDDING_DIM):
+        self.model_name = model_name
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=False, show_progress_bar=False, **kwargs):
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in text.lower().split():
+                h = zlib.crc32(token.encode('utf-8'))
+                out[row, h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        if normalize_embeddings:
+            norms = np.linalg.norm(out, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            out /= norms
+        return out[0] if single else out
+
+
+def quiet(func, *args, **kwargs):
+    """Call func with its stdout discarded."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+def export_seed_source(work_dir):
+    """Build the seed DB once and export it as a source directory."""
+    seed_db = os.path.join(work_dir, 'seed.db')
+    seed_dir = os.path.join(work_dir, 'seed_source')
+    quiet(create_cacao_db.main, ['--db', seed_db, '--export-source', seed_dir])
+    return seed_dir
+
+
+def synthesize_source(seed_dir, out_dir, n_rows, seed=0):
+    """Write a source directory with n_rows sections derived from the seed.
+
+    Each synthetic section rotates the sentences of a seed section and mixes
+    in words from the seed vocabulary, so FTS posting lists and embeddings
+    are not all identical copies.
+    """
+    records = list(kb_sources.iter_jsonl(os.path.join(seed_dir, 'sections', 'sections.jsonl')))
+    vocabulary = sorted({
+        word for r in records
+        for field in ('content', 'symptoms', 'treatment', 'prevention')
+        for word in re.findall(r'\w{4,}', r.get(field) or '')
+    })
+    rng = random.Random(seed)
+
+    os.makedirs(os.path.join(out_dir, 'sections'), exist_ok=True)
+    for sub in ('tags', 'synonyms'):
+        shutil.copytree(os.path.join(seed_dir, sub), os.path.join(out_dir, sub), dirs_exist_ok=True)
+
+    with open(os.path.join(out_dir, 'sections', 'sections.jsonl'), 'w', encoding='utf-8') as f:
+        for i in range(n_rows):
+            base = records[i % len(records)]
+            sentences = base['content'].split('. ')
+            shift = (i // len(records)) % len(sentences)
+            content = '. '.join(sentences[shift:] + sentences[:shift])
+            content += ' ' + ' '.join(rng.choice(vocabulary) for _ in range(12))
+            record = dict(base, content=content,
+                          section_title=f"{base['section_title']} #{i // len(records) + 1}")
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def latency_stats(samples):
+    samples_ms = np.asarray(samples) * 1000.0
+    return {
+        'count': int(len(samples_ms)),
+        'mean_ms': float(samples_ms.mean()),
+        'p50_ms': float(np.percentile(samples_ms, 50)),
+        'p95_ms': float(np.percentile(samples_ms, 95)),
+        'p99_ms': float(np.percentile(samples_ms, 99)),
+    }
+
+
+def time_each(func, items):
+    samples = []
+    for item in items:
+        start = time.perf_counter()
+        func(item)
+        samples.append(time.perf_counter() - start)
+    return latency_stats(samples)
+
+
+def benchmark_queries(db_path, encoder, queries, k, use_ivf):
+    engine = kb_search.KnowledgeBaseSearch(db_path, encoder)
+    try:
+        # Same statement as CacaoManualLocalDataSource.searchSections
+        fts_sql = '''
+            SELECT ms.*, bm25(manual_fts) as rank
+            FROM manual_sections ms
+            JOIN manual_fts ON ms.id = manual_fts.rowid
+            WHERE manual_fts MATCH ?
+            ORDER BY rank
+            LIMIT ?
+        '''
+        fts_queries = [engine.fts_query(q) for q in queries]
+        results = {
+            'fts': time_each(lambda q: engine.conn.execute(fts_sql, (q, k)).fetchall(), fts_queries),
+        }
+
+        start = time.perf_counter()
+        embeddings = engine.encode(queries)
+        results['query_encode_ms_per_query'] = (time.perf_counter() - start) * 1000.0 / len(queries)
+
+        results['vector_exact'] = time_each(
+            lambda e: kb_search.top_k_batch(e[None, :], engine.matrix, k), embeddings)
+        start = time.perf_counter()
+        kb_search.top_k_batch(embeddings, engine.matrix, k)
+        batch_seconds = time.perf_counter() - start
+        results['vector_exact_batch_qps'] = len(queries) / batch_seconds if batch_seconds > 0 else None
+
+        pairs = list(zip(queries, embeddings))
+        results['hybrid'] = time_each(
+            lambda p: engine.search([p[0]], k, 'hybrid', query_embeddings=p[1][None, :]), pairs)
+
+        if use_ivf:
+            centroids = ivf_index.load_centroids(engine.conn)
+            results['vector_ivf'] = time_each(
+                lambda e: ivf_index.search_ivf(engine.conn, e, k, centroids=centroids), embeddings)
+        return results
+    finally:
+        engine.close()
+
+
+def run_size(work_dir, seed_dir, n_rows, encoder_factory, model_name, args):
+    size_dir = os.path.join(work_dir, f'rows_{n_rows}')
+    source_dir = os.path.join(size_dir, 'source')
+    db_path = os.path.join(size_dir, 'cacao_manual.db')
+    os.makedirs(size_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    synthesize_source(seed_dir, source_dir, n_rows)
+    synth_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    counts = quiet(create_cacao_db.main, ['--db', db_path, '--source', source_dir, '--bulk'])
+    build_seconds = time.perf_counter() - start
+    size_after_build = os.path.getsize(db_path)
+
+    embed_argv = ['--db', db_path, '--no-cache', '--batch-size', str(args.batch_size),
+                  '--model-name', model_name]
+    if args.ivf:
+        embed_argv.append('--ivf')
+    start = time.perf_counter()
+    embed_stats = quiet(generate_embeddings.main, embed_argv, model_factory=encoder_factory)
+    embed_seconds = time.perf_counter() - start
+
+    queries = [BENCHMARK_QUERIES[i % len(BENCHMARK_QUERIES)] for i in range(args.queries)]
+    query_stats = quiet(benchmark_queries, db_path, encoder_factory(model_name),
+                        queries, args.k, args.ivf)
+
+    with sqlite3.connect(db_path) as conn:
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+
+    return {
+        'rows': counts['sections'],
+        'synthesize_seconds': synth_seconds,
+        'build_seconds': build_seconds,
+        'build_rows_per_sec': counts['sections'] / build_seconds if build_seconds > 0 else None,
+        'db_bytes_after_build': size_after_build,
+        'embed_seconds': embed_seconds,
+        'embed_sections_per_sec': embed_stats['sections_per_sec'],
+        'embed_peak_rss_mb': embed_stats['peak_rss_mb'],
+        'db_bytes_after_embed': os.path.getsize(db_path),
+        'db_pages': page_count,
+        'db_page_size': page_size,
+        'queries': query_stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark KB build and retrieval at several corpus sizes.')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in SIZES),
+                        help='Comma-separated row counts (default: 1000,10000,100000,1000000)')
+    parser.add_argument('--queries', type=int, default=QUERY_COUNT,
+                        help=f'Queries per latency measurement (default: {QUERY_COUNT})')
+    parser.add_argument('--k', type=int, default=10, help='Results per query (default: 10)')
+    parser.add_argument('--batch-size', type=int, default=generate_embeddings.BATCH_SIZE,
+                        help='Embedding batch size')
+    parser.add_argument('--ivf', action='store_true', help='Also build and time the IVF index')
+    parser.add_argument('--real-model', action='store_true',
+                        help='Use the sentence-transformers model instead of the hashing stub')
+    parser.add_argument('--server', metavar='URL',
+                        help='Encode through a running embedding_server.py (shared warm model)')
+    parser.add_argument('--work-dir', help='Keep generated corpora and DBs here (default: temp dir)')
+    parser.add_argument('--output', default='kb_benchmark.json', help='JSON report path')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    encoder_factory = generate_embeddings.load_model if args.real_model else HashingEncoder
+    model_name = generate_embeddings.MODEL_NAME if args.real_model else STUB_MODEL_NAME
+    if args.server:
+        import embedding_server
+        encoder_factory = lambda name: embedding_server.EmbeddingClient(args.server)
+        model_name = encoder_factory(None).model_name
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'encoder': f'embedding server at {args.server} ({model_name})' if args.server else model_name,
+        'k': args.k,
+        'results': [],
+    }
+
+    with contextlib.ExitStack() as stack:
+        if args.work_dir:
+            work_dir = args.work_dir
+            os.makedirs(work_dir, exist_ok=True)
+        else:
+            work_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix='kb_bench_'))
+
+        seed_dir = export_seed_source(work_dir)
+        for n_rows in sizes:
+            print(f"Benchmarking {n_rows} rows...")
+            result = run_size(work_dir, seed_dir, n_rows, encoder_factory, model_name, args)
+            report['results'].append(result)
+
+            q = result['queries']
+            print(f"  build {result['build_seconds']:.2f}s, "
+                  f"db {result['db_bytes_after_embed'] / 1e6:.1f} MB, "
+                  f"embed {result['embed_sections_per_sec']:.0f} sections/sec")
+            print(f"  fts p50/p95 {q['fts']['p50_ms']:.2f}/{q['fts']['p95_ms']:.2f} ms, "
+                  f"vector p50/p95 {q['vector_exact']['p50_ms']:.2f}/{q['vector_exact']['p95_ms']:.2f} ms, "
+                  f"hybrid p50 {q['hybrid']['p50_ms']:.2f} ms")
+
+            # Write after every size so a long run still leaves partial results
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+
+    if args.server:
+        report['server_stats'] = encoder_factory(None).stats()
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    print(f"\nReport written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
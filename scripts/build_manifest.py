@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Build manifest for reproducible knowledge-base builds.
+
+With --reproducible, create_cacao_db.py and generate_embeddings.py produce
+byte-identical databases for identical inputs and record what went into
+them in <db>.manifest.json:
+
+    {
+      "db_sha256": "...",                  # hash of the finished file
+      "model": "distiluse-...",            # embedding model, once embedded
+      "stages": {
+        "build":      {"inputs": "...", ...},
+        "embeddings": {"inputs": "...", ...}
+      },
+      "tables": {"manual_sections": {"rows": 17, "sha256": "..."}, ...}
+    }
+
+A stage is skipped when its inputs hash matches the manifest and the
+database file still has the recorded hash, so CI only rebuilds the asset
+when content, code or settings actually change. Re-running a stage drops
+the stages after it from the manifest.
+
+Usage:
+    python scripts/create_cacao_db.py --reproducible --source content/
+    python scripts/generate_embeddings.py --reproducible
+    python scripts/build_manifest.py --db assets/database/cacao_manual.db   # verify
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import types
+
+DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'assets', 'database', 'cacao_manual.db')
+STAGES = ('build', 'embeddings')
+CHUNK_SIZE = 1 << 20
+
+
+def manifest_path(db_path):
+    return db_path + '.manifest.json'
+
+
+def load_manifest(db_path):
+    path = manifest_path(db_path)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_manifest(db_path, manifest):
+    with open(manifest_path(db_path), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True, ensure_ascii=False)
+        f.write('\n')
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_files(paths, root=None):
+    """One hash over the names (relative to root) and contents of paths."""
+    h = hashlib.sha256()
+    for path in paths:
+        name = os.path.relpath(path, root) if root else os.path.basename(path)
+        h.update(name.replace(os.sep, '/').encode('utf-8') + b'\0')
+        h.update(file_sha256(path).encode('ascii') + b'\n')
+    return h.hexdigest()
+
+
+def hash_source_dir(source_dir):
+    """Hash of every file under a source directory, in sorted order."""
+    paths = []
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        paths.extend(os.path.join(root, name) for name in sorted(files))
+    return hash_files(paths, source_dir)
+
+
+def hash_inputs(inputs):
+    """Stable hash of a JSON-serializable dict of stage inputs."""
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def module_paths(module):
+    """Sorted files of a script module and every script module it imports, transitively.
+
+    Derived from the imports themselves, so a stage's input hash cannot miss
+    a module it uses. Imports inside functions are not followed.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    seen, pending = {}, [module]
+    while pending:
+        current = pending.pop()
+        path = os.path.abspath(getattr(current, '__file__', None) or '')
+        if os.path.dirname(path) != here or path in seen:
+            continue
+        seen[path] = current
+        pending.extend(value for value in vars(current).values() if isinstance(value, types.ModuleType))
+    return sorted(seen)
+
+
+def reproducible_timestamp():
+    """Fixed created_at value: SOURCE_DATE_EPOCH if set, else the Unix epoch."""
+    epoch = int(os.environ.get('SOURCE_DATE_EPOCH', '0'))
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(epoch))
+
+
+def table_checksums(conn):
+    """{table: {rows, sha256}} over every stored table, rows in key order."""
+    tables = [name for (name,) in conn.execute('''
+        SELECT name FROM sqlite_master
+        WHERE type = 'table' AND sql NOT LIKE 'CREATE VIRTUAL TABLE%'
+        ORDER BY name
+    ''')]
+    checksums = {}
+    for table in tables:
+        columns = conn.execute(f'PRAGMA table_info("{table}")').fetchall()
+        try:
+            conn.execute(f'SELECT rowid FROM "{table}" LIMIT 0')
+            order = 'rowid'
+        except sqlite3.OperationalError:
+            # WITHOUT ROWID: walk the primary key
+            order = ', '.join(f'"{c[1]}"' for c in sorted(columns, key=lambda c: c[5]) if c[5])
+        h = hashlib.sha256()
+        rows = 0
+        for row in conn.execute(f'SELECT * FROM "{table}" ORDER BY {order}'):
+            h.update(repr(row).encode('utf-8'))
+            rows += 1
+        checksums[table] = {'rows': rows, 'sha256': h.hexdigest()}
+    return checksums
+
+
+def stage_is_current(db_path, stage, inputs):
+    """True if stage already ran with these inputs and the file is unchanged since."""
+    manifest = load_manifest(db_path)
+    recorded = manifest.get('stages', {}).get(stage)
+    return (recorded is not None
+            and recorded.get('inputs') == inputs
+            and os.path.exists(db_path)
+            and file_sha256(db_path) == manifest.get('db_sha256'))
+
+
+def record_stage(db_path, stage, inputs, **details):
+    """Record a finished stage and refresh the table checksums and file hash."""
+    manifest = load_manifest(db_path) if stage != STAGES[0] else {}
+    stages = manifest.get('stages', {})
+    for later in STAGES[STAGES.index(stage) + 1:]:
+        stages.pop(later, None)
+    stages[stage] = {'inputs': inputs, **details}
+    manifest['stages'] = stages
+    if 'model' in details:
+        manifest['model'] = details['model']
+
+    conn = sqlite3.connect(db_path)
+    try:
+        manifest['tables'] = table_checksums(conn)
+    finally:
+        conn.close()
+    manifest['sqlite_version'] = sqlite3.sqlite_version
+    manifest['db_sha256'] = file_sha256(db_path)
+    write_manifest(db_path, manifest)
+    print(f"Manifest written to {manifest_path(db_path)}")
+    return manifest
+
+
+def verify_manifest(db_path):
+    """Compare a database against its manifest; returns a list of mismatches."""
+    manifest = load_manifest(db_path)
+    if not manifest:
+        return [f"no manifest at {manifest_path(db_path)}"]
+    problems = []
+    if file_sha256(db_path) != manifest.get('db_sha256'):
+        problems.append('file hash differs')
+    conn = sqlite3.connect(db_path)
+    try:
+        actual = table_checksums(conn)
+    finally:
+        conn.close()
+    for table in sorted(set(actual) | set(manifest.get('tables', {}))):
+        if actual.get(table) != manifest['tables'].get(table):
+            problems.append(f"table {table} differs")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verify a KB database against its build manifest.')
+    parser.add_argument('--db', default=DB_PATH, help='Path to cacao_manual.db')
+    args = parser.parse_args()
+
+    problems = verify_manifest(args.db)
+    if problems:
+        for problem in problems:
+            print(f"  ✗ {problem}")
+        exit(1)
+    print(f"{args.db} matches {manifest_path(args.db)}")
+
+
+if __name__ == '__main__':
+    main()
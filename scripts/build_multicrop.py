@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Parallel knowledge-base builds for several crops.
+
+Every subdirectory of --crops-dir is one crop's source directory (layout as
+in kb_sources.py), named after the crop:
+
+    crops/
+      cacao/    sections/ tags/ synonyms/
+      cafe/     ...
+
+The orchestrator
+1. builds each crop's DB with create_cacao_db.py --source --bulk, one crop
+   per worker of a process pool;
+2. embeds all crops together: sections that need embedding are cut into
+   fixed-size shards, independent of crop boundaries, and encoded by a pool
+   of workers that each load the model once. The parent process reads the
+   pages, serves cache hits and writes the results, so SQLite only ever has
+   one writer;
+3. optionally merges the crop DBs into one multi-crop DB (--merge) with a
+   `crop` column on manual_sections and per-crop partial indexes, so
+   crop-filtered queries only walk that crop's index entries. Each crop's
+   ML classes come from its own ml_mappings/ (see kb_sources.py); class ids
+   of the primary crop (cacao by default) are kept as they are, the ones of
+   other crops are namespaced as "<crop>:<class id>".
+
+Arguments after "--" are passed to create_cacao_db.py for every crop (FTS
+options, --bake-synonyms, ...).
+
+Usage:
+    python scripts/build_multicrop.py --crops-dir content/crops --out-dir build/crops
+    python scripts/build_multicrop.py --crops-dir content/crops --merge assets/database/multicrop.db \
+        --workers 8 --embed-workers 2 -- --bake-synonyms
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
+
+import create_cacao_db
+import generate_embeddings
+import text_compression
+
+SHARD_SIZE = 512
+CROP_NAME = re.compile(r'^[a-z0-9_]+$')
+
+# Set in each embedding worker by _init_embed_worker()
+_worker_model = None
+
+
+def discover_crops(crops_dir):
+    """{crop: source dir} for every subdirectory of crops_dir, in name order."""
+    crops = {}
+    for name in sorted(os.listdir(crops_dir)):
+        path = os.path.join(crops_dir, name)
+        if not os.path.isdir(path):
+            continue
+        if not CROP_NAME.match(name):
+            raise ValueError(f"Crop directory names must match {CROP_NAME.pattern}: {name}")
+        crops[name] = path
+    return crops
+
+
+def build_crop(crop, source_dir, db_path, create_args):
+    """Worker: build one crop's DB; returns (crop, counts, seconds)."""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        counts = create_cacao_db.main(['--db', db_path, '--source', source_dir, '--bulk', *create_args])
+    return crop, counts, time.perf_counter() - start
+
+
+def build_crops(crops, out_dir, create_args, workers):
+    """Build every crop DB in parallel; returns {crop: db path}."""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {crop: os.path.join(out_dir, f'{crop}.db') for crop in crops}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(build_crop, crop, source, paths[crop], create_args)
+                   for crop, source in crops.items()]
+        for future in futures:
+            crop, counts, seconds = future.result()
+            print(f"  ✓ {crop}: {counts['sections']} sections, {counts['tags']} tags in {seconds:.2f}s")
+    return paths
+
+
+def _init_embed_worker(use_stub, model_name):
+    global _worker_model
+    if use_stub:
+        import benchmark_kb
+        _worker_model = benchmark_kb.HashingEncoder(model_name)
+    else:
+        _worker_model = generate_embeddings.load_model(model_name)
+
+
+def _embed_shard(texts, batch_size):
+    return generate_embeddings.encode_batch(_worker_model, texts, batch_size)
+
+
+def iter_shards(db_paths, shard_size, fmt, with_bits, model_name=generate_embeddings.MODEL_NAME):
+    """Yield (crop, ids, texts, hashes) shards of sections that need embedding."""
+    for crop, db_path in db_paths.items():
+        conn = sqlite3.connect(db_path)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                generate_embeddings.add_embedding_columns(conn)
+            conn.commit()
+            for batch in generate_embeddings.iter_section_batches(conn, shard_size):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    ids, texts, hashes, _ = generate_embeddings.select_stale_sections(
+                        batch, False, fmt, with_bits, model_name)
+                if ids:
+                    yield crop, ids, texts, hashes
+        finally:
+            conn.close()
+
+
+def embed_crops(db_paths, workers, shard_size=SHARD_SIZE, batch_size=generate_embeddings.BATCH_SIZE,
+                cache=None, use_stub=False, fmt='float32', with_bits=False,
+                model_name=generate_embeddings.MODEL_NAME):
+    """Embed all crop DBs with a sharded process pool; returns the number of sections embedded.
+
+    Stub vectors are stored under benchmark_kb.STUB_MODEL_NAME and never
+    cached, so they cannot pass for the real model's.
+    """
+    if use_stub:
+        import benchmark_kb
+        model_name, cache = benchmark_kb.STUB_MODEL_NAME, None
+    conns = {crop: sqlite3.connect(path) for crop, path in db_paths.items()}
+    embedded = 0
+    in_flight = {}
+
+    def write(crop, ids, hashes, keys, vectors, fresh):
+        nonlocal embedded
+        if cache is not None and len(fresh):
+            cache.put_many(model_name, zip(keys, fresh))
+        fresh_iter = iter(fresh)
+        embeddings = [v if v is not None else next(fresh_iter) for v in vectors]
+        matrix = np.stack(embeddings).astype(np.float32, copy=False)
+        norms = np.linalg.norm(matrix, axis=1)
+        with conns[crop]:
+            generate_embeddings.write_embeddings(conns[crop], ids, hashes, matrix, norms, fmt, with_bits,
+                                                 model_name)
+        embedded += len(ids)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_embed_worker,
+                                 initargs=(use_stub, model_name)) as pool:
+            for crop, ids, texts, hashes in iter_shards(db_paths, shard_size, fmt, with_bits, model_name):
+                # Cache lookups happen here, so workers never touch the cache DB
+                vectors = [None] * len(texts)
+                miss_keys, miss_texts = [], []
+                if cache is not None:
+                    keys = [generate_embeddings.EmbeddingCache.key(t) for t in texts]
+                    cached = cache.get_many(model_name, keys)
+                    for i, key in enumerate(keys):
+                        if key in cached:
+                            vectors[i] = cached[key]
+                        else:
+                            miss_keys.append(key)
+                            miss_texts.append(texts[i])
+                else:
+                    miss_texts = texts
+
+                if not miss_texts:
+                    write(crop, ids, hashes, miss_keys, vectors, [])
+                    continue
+                future = pool.submit(_embed_shard, miss_texts, batch_size)
+                in_flight[future] = (crop, ids, hashes, miss_keys, vectors)
+
+                # Bound memory: at most two shards queued per worker
+                while len(in_flight) >= 2 * workers:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        write(*in_flight.pop(future), future.result()[0])
+
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(*in_flight.pop(future), future.result()[0])
+    finally:
+        for conn in conns.values():
+            conn.close()
+    return embedded
+
+
+def _crop_columns(conn, schema):
+    return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info(manual_sections)')]
+
+
+def merge_crops(db_paths, merged_path, fts_options=None, primary_crop=None):
+    """Merge crop DBs into one DB with a crop column and per-crop partial indexes."""
+    primary_crop = primary_crop or ('cacao' if 'cacao' in db_paths else next(iter(db_paths)))
+    if os.path.exists(merged_path):
+        os.remove(merged_path)
+    conn = sqlite3.connect(merged_path)
+    try:
+        create_cacao_db.apply_bulk_pragmas(conn)
+        create_cacao_db.create_schema(conn, with_fts_triggers=False, fts_options=fts_options)
+        conn.execute("ALTER TABLE manual_sections ADD COLUMN crop TEXT NOT NULL DEFAULT ''")
+        with contextlib.redirect_stdout(io.StringIO()):
+            generate_embeddings.add_embedding_columns(conn)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS query_embeddings (
+                query TEXT PRIMARY KEY,
+                embedding BLOB NOT NULL,
+                embedding_model TEXT NOT NULL
+            )
+        ''')
+        merged_columns = _crop_columns(conn, 'main')
+
+        mappings = {}
+        counts = {}
+        for crop, db_path in db_paths.items():
+            offset = conn.execute('SELECT COALESCE(MAX(id), 0) FROM manual_sections').fetchone()[0]
+            conn.execute('ATTACH DATABASE ? AS c', (db_path,))
+            if text_compression.is_compressed(conn, 'c'):
+                # Every crop has its own dictionary; merge the plain text and compress the result
+                raise ValueError(f"{db_path} stores compressed text; build crops without --compress-text")
+            columns = [c for c in _crop_columns(conn, 'c') if c in merged_columns and c != 'id']
+            names = ', '.join(columns)
+            conn.execute(f'''
+                INSERT INTO manual_sections (id, crop, {names})
+                SELECT id + ?, ?, {names} FROM c.manual_sections ORDER BY id
+            ''', (offset, crop))
+            conn.execute('INSERT OR IGNORE INTO tags (name) SELECT name FROM c.tags ORDER BY id')
+            conn.execute('''
+                INSERT OR IGNORE INTO section_tags (section_id, tag_id)
+                SELECT st.section_id + ?, t.id
+                FROM c.section_tags st
+                JOIN c.tags ct ON ct.id = st.tag_id
+                JOIN main.tags t ON t.name = ct.name
+            ''', (offset,))
+            conn.execute('''
+                INSERT OR IGNORE INTO synonyms (term, synonym)
+                SELECT term, synonym FROM c.synonyms ORDER BY id
+            ''')
+            if conn.execute("SELECT 1 FROM c.sqlite_master WHERE name = 'query_embeddings'").fetchone():
+                conn.execute('INSERT OR IGNORE INTO query_embeddings SELECT * FROM c.query_embeddings')
+
+            crop_ids = {row[0] for row in conn.execute('SELECT id FROM c.manual_sections')}
+            for class_id, label, section_ids, threshold in conn.execute('''
+                SELECT ml_class_id, ml_class_label, section_ids, confidence_threshold
+                FROM c.ml_to_manual_mapping
+            ''').fetchall():
+                ids = create_cacao_db.parse_section_ids(section_ids)
+                missing = [i for i in ids if i not in crop_ids]
+                if missing:
+                    raise ValueError(f"{db_path}: ML class {class_id} maps to missing sections "
+                                     f"{', '.join(map(str, missing))}")
+                if crop != primary_crop:
+                    class_id = f'{crop}:{class_id}'
+                remapped = ','.join(str(i + offset) for i in ids)
+                mappings[class_id] = (crop, label, remapped, threshold)
+
+            counts[crop] = conn.execute('SELECT COUNT(*) FROM c.manual_sections').fetchone()[0]
+            conn.commit()
+            conn.execute('DETACH DATABASE c')
+
+        # Vectors of different models are not comparable, so one DB holds one model
+        models = [row[0] for row in conn.execute('''
+            SELECT embedding_model FROM manual_sections WHERE embedding IS NOT NULL
+            UNION SELECT embedding_model FROM query_embeddings ORDER BY 1
+        ''')]
+        if len(models) > 1:
+            raise ValueError(f"Crops were embedded with different models: {', '.join(map(str, models))}")
+
+        conn.executemany('''
+            INSERT INTO ml_to_manual_mapping (ml_class_id, ml_class_label, section_ids, confidence_threshold)
+            VALUES (?, ?, ?, ?)
+        ''', [(class_id, label, ids, threshold) for class_id, (_, label, ids, threshold) in mappings.items()])
+        conn.commit()
+
+        # One small index per crop instead of a crop prefix on every index entry
+        conn.execute('CREATE INDEX idx_sections_crop ON manual_sections(crop)')
+        for crop in db_paths:
+            conn.execute(f'''
+                CREATE INDEX idx_sections_{crop}_chapter ON manual_sections(chapter, severity_level)
+                WHERE crop = '{crop}'
+            ''')
+            conn.execute(f'''
+                CREATE INDEX idx_sections_{crop}_embedded ON manual_sections(id)
+                WHERE crop = '{crop}' AND embedding IS NOT NULL
+            ''')
+        conn.executemany('INSERT OR REPLACE INTO kb_metadata (key, value) VALUES (?, ?)', [
+            ('crops', ','.join(db_paths)),
+            *((f'crop_sections_{crop}', str(n)) for crop, n in counts.items()),
+        ])
+        conn.commit()
+
+        create_cacao_db.sync_ml_class_sections(conn)
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_cacao_db.build_tag_postings(conn)
+            create_cacao_db.build_answer_bundles(conn)
+        create_cacao_db.rebuild_fts(conn)
+        create_cacao_db.create_fts_triggers(conn, fts_options)
+        create_cacao_db.finalize_database(conn)
+        return counts
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Build knowledge-base DBs for several crops in parallel.',
+        epilog='Arguments after "--" are passed to create_cacao_db.py for every crop.')
+    parser.add_argument('--crops-dir', required=True, help='Directory with one source directory per crop')
+    parser.add_argument('--out-dir', default='build/crops', help='Where per-crop DBs are written')
+    parser.add_argument('--merge', metavar='DB', help='Also merge all crops into this multi-crop DB')
+    parser.add_argument('--primary-crop',
+                        help='Crop whose ML class ids stay unprefixed in the merged DB (default: cacao)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Processes for the per-crop builds (default: all cores)')
+    parser.add_argument('--embed-workers', type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                        help='Embedding processes; each holds its own copy of the model '
+                             '(default: half the cores)')
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE,
+                        help=f'Sections per embedding shard (default: {SHARD_SIZE})')
+    parser.add_argument('--batch-size', type=int, default=generate_embeddings.BATCH_SIZE,
+                        help='Model batch size inside a shard')
+    parser.add_argument('--no-embeddings', action='store_true', help='Skip the embedding stage')
+    parser.add_argument('--cache', default=generate_embeddings.CACHE_PATH,
+                        help='Persistent embedding cache (used by the parent process only)')
+    parser.add_argument('--no-cache', action='store_true', help='Bypass the embedding cache')
+    parser.add_argument('--model-name', default=generate_embeddings.MODEL_NAME,
+                        help=f'Model to embed with (default: {generate_embeddings.MODEL_NAME})')
+    parser.add_argument('--stub', action='store_true',
+                        help='Embed with the hashing stub from benchmark_kb.py instead of the model')
+    args, create_args = parser.parse_known_args()
+    if create_args and create_args[0] == '--':
+        create_args = create_args[1:]
+
+    crops = discover_crops(args.crops_dir)
+    if not crops:
+        print(f"Error: no crop directories in {args.crops_dir}")
+        exit(1)
+    fts_options = create_cacao_db.parse_fts_options(create_cacao_db.parse_args(create_args))
+
+    start = time.perf_counter()
+    print(f"Building {len(crops)} crops with {args.workers} workers...")
+    db_paths = build_crops(crops, args.out_dir, create_args, max(1, args.workers))
+    build_seconds = time.perf_counter() - start
+
+    embed_seconds = 0.0
+    if not args.no_embeddings:
+        # Stub vectors must never reach the shared cache
+        cache = None if args.no_cache or args.stub else generate_embeddings.EmbeddingCache(args.cache)
+        start = time.perf_counter()
+        print(f"Embedding with {args.embed_workers} workers, shards of {args.shard_size}...")
+        try:
+            embedded = embed_crops(db_paths, max(1, args.embed_workers), max(1, args.shard_size),
+                                   max(1, args.batch_size), cache, args.stub,
+                                   model_name=args.model_name)
+        finally:
+            if cache is not None:
+                cache.close()
+        embed_seconds = time.perf_counter() - start
+        print(f"  ✓ {embedded} sections embedded in {embed_seconds:.2f}s")
+
+    if args.merge:
+        start = time.perf_counter()
+        counts = merge_crops(db_paths, args.merge, fts_options, args.primary_crop)
+        print(f"Merged {sum(counts.values())} sections from {len(counts)} crops into {args.merge} "
+              f"in {time.perf_counter() - start:.2f}s")
+
+    print(f"\nBuild {build_seconds:.2f}s, embeddings {embed_seconds:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
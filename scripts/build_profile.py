@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Stage-level profiling of the knowledge-base build pipeline.
+
+create_cacao_db.py and generate_embeddings.py accept --profile-json PATH
+(and --cprofile PATH). Each stage of the run is timed with a
+StageProfiler, and the report records:
+
+- wall and CPU time per stage, rows and rows/sec where a stage has rows;
+- peak RSS of the process at the end of the stage;
+- SQLite page count before and after the stage;
+- for pipelined work (reading, encoding and writing overlap in
+  generate_embeddings.py), the time summed per step with add();
+- final page size, page and free-list counts, and bytes per table and
+  index (from the dbstat virtual table when SQLite has it).
+
+Stages can nest; `depth` tells nested stages apart, and a parent's time
+includes its children. CPU time is process-wide, so it includes the
+encoder thread. --cprofile dumps a cProfile of the main thread for
+`python -m pstats` or snakeviz.
+
+Reports of two runs can be compared stage by stage with this script.
+
+Usage:
+    python scripts/create_cacao_db.py --bulk --profile-json build.json --cprofile build.prof
+    python scripts/generate_embeddings.py --profile-json embed.json
+    python scripts/build_profile.py old.json new.json   # per-stage changes
+"""
+
+import argparse
+import contextlib
+import cProfile
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None if unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def page_count(conn):
+    if conn is None:
+        return None
+    try:
+        return conn.execute('PRAGMA page_count').fetchone()[0]
+    except sqlite3.ProgrammingError:  # Closed connection
+        return None
+
+
+def database_stats(conn):
+    """Page counts and the bytes used by every table and index."""
+    stats = {name: conn.execute(f'PRAGMA {name}').fetchone()[0]
+             for name in ('page_size', 'page_count', 'freelist_count')}
+    kinds = dict(conn.execute("SELECT name, type FROM sqlite_master WHERE type IN ('table', 'index')"))
+    try:
+        rows = conn.execute('''
+            SELECT name, SUM(pgsize), COUNT(*) FROM dbstat GROUP BY name ORDER BY SUM(pgsize) DESC
+        ''').fetchall()
+    except sqlite3.OperationalError:  # SQLite built without SQLITE_ENABLE_DBSTAT_VTAB
+        rows = []
+    stats['objects'] = [{'name': name, 'type': kinds.get(name, 'internal'), 'bytes': size, 'pages': pages}
+                        for name, size, pages in rows]
+    return stats
+
+
+class StageProfiler:
+    """Collects timings of the stages of one script run."""
+
+    def __init__(self, script, conn=None):
+        self.script = script
+        self.conn = conn
+        self.stages = []
+        self.steps = {}
+        self._depth = 0
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=None):
+        """Time a block; set record['rows'] inside it to get rows/sec."""
+        record = {'stage': name, 'depth': self._depth, 'rows': rows}
+        pages_before = page_count(self.conn)
+        self.stages.append(record)
+        self._depth += 1
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            self._depth -= 1
+            record['wall_seconds'] = time.perf_counter() - wall
+            record['cpu_seconds'] = time.process_time() - cpu
+            if record['rows'] is not None:
+                record['rows_per_sec'] = record['rows'] / record['wall_seconds'] if record['wall_seconds'] else None
+            record['peak_rss_mb'] = peak_rss_mb()
+            record['pages_before'] = pages_before
+            record['pages_after'] = page_count(self.conn)
+
+    def add(self, name, seconds, rows=0):
+        """Add time measured elsewhere (e.g. on a worker thread) to a pipeline step."""
+        with self._lock:
+            step = self.steps.setdefault(name, {'wall_seconds': 0.0, 'rows': 0, 'calls': 0})
+            step['wall_seconds'] += seconds
+            step['rows'] += rows
+            step['calls'] += 1
+
+    def timed(self, name, iterable):
+        """Yield from iterable, adding the time spent producing each item (pages of rows) to a step."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(name, time.perf_counter() - start, len(item))
+            yield item
+
+    def report(self, db_path=None, conn=None, **extra):
+        for step in self.steps.values():
+            step['rows_per_sec'] = step['rows'] / step['wall_seconds'] if step['rows'] and step['wall_seconds'] else None
+        report = {
+            'script': self.script,
+            'argv': sys.argv[1:],
+            'database': db_path,
+            'sqlite_version': sqlite3.sqlite_version,
+            'wall_seconds': time.perf_counter() - self._start,
+            'cpu_seconds': time.process_time() - self._cpu_start,
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': self.stages,
+            'steps': self.steps,
+            **extra,
+        }
+        if conn is not None:
+            report['database_stats'] = database_stats(conn)
+        if db_path and os.path.exists(db_path):
+            report['file_bytes'] = os.path.getsize(db_path)
+        return report
+
+
+def write_report(path, report):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+        f.write('\n')
+
+
+def start_cprofile(path):
+    """Start a cProfile of the main thread if a dump path is given."""
+    if not path:
+        return None
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile
+
+
+def stop_cprofile(profile, path):
+    if profile is not None:
+        profile.disable()
+        profile.dump_stats(path)
+        print(f"cProfile written to {path}")
+
+
+def print_stages(report):
+    print(f"\n{'Stage':<32}{'Wall s':>9}{'CPU s':>9}{'Rows':>9}{'Rows/s':>11}{'Pages':>8}")
+    for stage in report['stages']:
+        rate = stage.get('rows_per_sec')
+        pages = stage['pages_after'] if stage.get('pages_after') is not None else ''
+        print(f"{'  ' * stage['depth'] + stage['stage']:<32}{stage['wall_seconds']:>9.3f}"
+              f"{stage['cpu_seconds']:>9.3f}{'' if stage['rows'] is None else stage['rows']:>9}"
+              f"{'' if rate is None else f'{rate:.0f}':>11}{pages:>8}")
+    for name, step in report['steps'].items():
+        rate = step.get('rows_per_sec')
+        print(f"{'  step ' + name:<32}{step['wall_seconds']:>9.3f}{'':>9}{step['rows']:>9}"
+              f"{'' if rate is None else f'{rate:.0f}':>11}")
+    stats = report.get('database_stats')
+    if stats:
+        print(f"Database: {stats['page_count']} pages of {stats['page_size']} bytes "
+              f"({stats['freelist_count']} free)")
+        for obj in stats['objects'][:10]:
+            print(f"  {obj['name']:<40}{obj['type']:<10}{obj['bytes'] / 1024:>10.1f} KB")
+
+
+def compare_reports(old, new):
+    """Per-stage (name, old wall, new wall) for stages present in either report."""
+    def walls(report):
+        totals = {}
+        for stage in report['stages']:
+            totals[stage['stage']] = totals.get(stage['stage'], 0.0) + stage['wall_seconds']
+        for name, step in report.get('steps', {}).items():
+            totals['step ' + name] = step['wall_seconds']
+        totals['total'] = report['wall_seconds']
+        return totals
+
+    old_walls, new_walls = walls(old), walls(new)
+    names = list(dict.fromkeys([*old_walls, *new_walls]))
+    return [(name, old_walls.get(name), new_walls.get(name)) for name in names]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two build profile reports stage by stage.')
+    parser.add_argument('old', help='Earlier --profile-json report')
+    parser.add_argument('new', help='Later --profile-json report')
+    args = parser.parse_args()
+
+    with open(args.old, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)
+
+    print(f"{'Stage':<32}{'Old s':>10}{'New s':>10}{'Change':>10}")
+    for name, before, after in compare_reports(old, new):
+        change = f"{(after - before) / before:+.1%}" if before and after is not None else ''
+        print(f"{name:<32}{'' if before is None else f'{before:.3f}':>10}"
+              f"{'' if after is None else f'{after:.3f}':>10}{change:>10}")
+    old_size, new_size = old.get('file_bytes'), new.get('file_bytes')
+    if old_size and new_size:
+        print(f"{'file size KB':<32}{old_size / 1024:>10.1f}{new_size / 1024:>10.1f}"
+              f"{(new_size - old_size) / old_size:>+10.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Sliding-window chunks of manual sections, each with its own embedding.
+
+generate_section_text() feeds the model one string per section cut at 400
+words, so long sections get a single diluted vector and their tail is never
+searchable semantically. This module splits every section into chunks:
+
+- chunks never cross a field boundary (content, symptoms, treatment,
+  prevention are chunked separately) and break at sentence ends;
+- each chunk holds at most `window` words, including a "chapter - title"
+  prefix cut to half the window (so a long title cannot squeeze the content
+  budget down to a word or two), and repeats up to `overlap` words of trailing sentences from the
+  previous chunk of the same field;
+- the window is capped so a chunk fits the model's token limit
+  (MODEL_MAX_TOKENS at about TOKENS_PER_WORD tokens per word).
+
+Chunks are stored in `section_chunks` (one row per chunk, linked to
+manual_sections) with their own embedding. A section's score for a query is
+the best score of its chunks (max-sim), see max_sim_scores().
+
+Everything streams: sections are read in id-ordered pages and chunks are
+generated, embedded and written one page at a time. Chunks whose text and
+model are unchanged since the last run are not re-embedded.
+
+Usage:
+    python scripts/generate_embeddings.py --chunks --chunk-window 80 --chunk-overlap 20
+    python scripts/chunking.py --db path/to/cacao_manual.db --window 80 --overlap 20   # chunk count only
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import numpy as np
+
+import text_compression
+
+DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'assets', 'database', 'cacao_manual.db')
+MODEL_MAX_TOKENS = 128   # DistilUSE max_seq_length
+TOKENS_PER_WORD = 1.4    # word pieces per Spanish word, with some headroom
+WINDOW_WORDS = 80
+OVERLAP_WORDS = 20
+PAGE_SIZE = 256
+
+# Text fields chunked separately, in order (chapter and title go in the prefix)
+CHUNK_FIELDS = ('content', 'symptoms', 'treatment', 'prevention')
+
+SENTENCE_END = re.compile(r'(?<=[.!?;:])\s+|\n+')
+
+
+def max_window(max_tokens=MODEL_MAX_TOKENS, tokens_per_word=TOKENS_PER_WORD):
+    """Largest window in words that stays within the model's token limit."""
+    return int(max_tokens / tokens_per_word)
+
+
+def split_sentences(text):
+    return [s.strip() for s in SENTENCE_END.split(text or '') if s.strip()]
+
+
+def _split_long_sentence(words, size, overlap):
+    """Cut a sentence longer than the window into overlapping word runs."""
+    step = max(1, size - overlap)
+    for start in range(0, len(words), step):
+        yield words[start:start + size]
+        if start + size >= len(words):
+            return
+
+
+def iter_field_chunks(text, budget, overlap):
+    """Yield chunk texts of one field with at most budget words each."""
+    current = []   # list of sentences, each a list of words
+    current_words = 0
+    for sentence in split_sentences(text):
+        words = sentence.split()
+        if len(words) > budget:
+            if current:
+                yield ' '.join(w for s in current for w in s)
+                current, current_words = [], 0
+            for piece in _split_long_sentence(words, budget, overlap):
+                yield ' '.join(piece)
+            continue
+
+        if current_words + len(words) > budget and current:
+            yield ' '.join(w for s in current for w in s)
+            # Carry trailing sentences totalling at most `overlap` words
+            carried, carried_words = [], 0
+            for previous in reversed(current):
+                if carried_words + len(previous) > overlap:
+                    break
+                carried.insert(0, previous)
+                carried_words += len(previous)
+            if carried_words + len(words) > budget:
+                carried, carried_words = [], 0
+            current, current_words = carried, carried_words
+
+        current.append(words)
+        current_words += len(words)
+
+    if current:
+        yield ' '.join(w for s in current for w in s)
+
+
+def iter_section_chunks(section, window=WINDOW_WORDS, overlap=OVERLAP_WORDS):
+    """Yield (field, chunk text) for a (id, chapter, section_title, *CHUNK_FIELDS) row."""
+    window = min(window, max_window())
+    overlap = min(overlap, window // 2)
+    prefix_words = ' - '.join(filter(None, (section[1], section[2]))).split()
+    # The content keeps at least half the window however long the title is
+    prefix = ' '.join(prefix_words[:window // 2])
+    budget = max(1, window - len(prefix.split()))
+    for field, text in zip(CHUNK_FIELDS, section[3:3 + len(CHUNK_FIELDS)]):
+        for chunk in iter_field_chunks(text, budget, overlap):
+            yield field, f'{prefix}: {chunk}' if prefix else chunk
+
+
+def iter_section_pages(conn, page_size=PAGE_SIZE):
+    """Yield id-ordered pages of (id, chapter, section_title, *CHUNK_FIELDS), decoded."""
+    text_compression.register_text_function(conn)
+    last_id = 0
+    while True:
+        rows = conn.execute(f'''
+            SELECT id, chapter, section_title, {', '.join(f'kb_text({f})' for f in CHUNK_FIELDS)}
+            FROM manual_sections WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, page_size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def create_chunk_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS section_chunks (
+            id INTEGER PRIMARY KEY,
+            section_id INTEGER NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            field TEXT NOT NULL,
+            text TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            embedding BLOB,
+            embedding_norm REAL,
+            embedding_model TEXT,
+            UNIQUE (section_id, chunk_index),
+            FOREIGN KEY (section_id) REFERENCES manual_sections(id) ON DELETE CASCADE
+        )
+    ''')
+
+
+def build_chunks(conn, get_model, model_name, window=WINDOW_WORDS, overlap=OVERLAP_WORDS,
+                 batch_size=64, cache=None, page_size=PAGE_SIZE):
+    """Chunk and embed every section; returns chunk statistics.
+
+    Runs inside the caller's transaction; uses generate_embeddings for the
+    text hash, the cache and the model call.
+    """
+    import generate_embeddings
+
+    create_chunk_table(conn)
+    # Chunks of sections that no longer exist
+    conn.execute('DELETE FROM section_chunks WHERE section_id NOT IN (SELECT id FROM manual_sections)')
+
+    stats = {'sections': 0, 'chunks': 0, 'embedded': 0, 'max_chunks': 0, 'words': 0}
+    for page in iter_section_pages(conn, page_size):
+        ids = [row[0] for row in page]
+        placeholders = ','.join('?' * len(ids))
+        stored = {(section_id, index): (text_hash, model) for section_id, index, text_hash, model in
+                  conn.execute(f'''
+                      SELECT section_id, chunk_index, text_hash, embedding_model FROM section_chunks
+                      WHERE section_id IN ({placeholders}) AND embedding IS NOT NULL
+                  ''', ids)}
+
+        rows, texts = [], []
+        for section in page:
+            n = 0
+            for n, (field, text) in enumerate(iter_section_chunks(section, window, overlap), 1):
+                text_hash = generate_embeddings.section_text_hash(text)
+                stats['words'] += len(text.split())
+                if stored.get((section[0], n - 1)) != (text_hash, model_name):
+                    rows.append((section[0], n - 1, field, text, text_hash))
+                    texts.append(text)
+            conn.execute('DELETE FROM section_chunks WHERE section_id = ? AND chunk_index >= ?',
+                         (section[0], n))
+            stats['sections'] += 1
+            stats['chunks'] += n
+            stats['max_chunks'] = max(stats['max_chunks'], n)
+
+        for start in range(0, len(texts), batch_size):
+            batch_rows = rows[start:start + batch_size]
+            embeddings, norms = generate_embeddings.embed_texts(
+                texts[start:start + batch_size], get_model, batch_size, cache, model_name)
+            conn.executemany('''
+                INSERT OR REPLACE INTO section_chunks
+                (section_id, chunk_index, field, text, text_hash, embedding, embedding_norm, embedding_model)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(*row, generate_embeddings.embedding_to_bytes(e), float(norm), model_name)
+                  for row, e, norm in zip(batch_rows, embeddings, norms)])
+            stats['embedded'] += len(batch_rows)
+    return stats
+
+
+def chunk_counts(conn, window=WINDOW_WORDS, overlap=OVERLAP_WORDS, dim=512):
+    """Chunk statistics without embedding anything, to size the cost up front."""
+    counts = []
+    words = 0
+    for page in iter_section_pages(conn):
+        for section in page:
+            chunks = list(iter_section_chunks(section, window, overlap))
+            counts.append(len(chunks))
+            words += sum(len(text.split()) for _, text in chunks)
+    counts = np.asarray(counts or [0])
+    return {
+        'sections': int(len(counts)),
+        'chunks': int(counts.sum()),
+        'mean_chunks': float(counts.mean()),
+        'max_chunks': int(counts.max()),
+        'mean_words': words / max(1, int(counts.sum())),
+        'vector_bytes': int(counts.sum()) * dim * 4,
+    }
+
+
+def load_chunk_matrix(conn):
+    """(section ids per chunk, normalized float32 chunk matrix) for max-sim scoring."""
+    section_ids, rows = [], []
+    for section_id, blob, norm in conn.execute('''
+        SELECT section_id, embedding, embedding_norm FROM section_chunks
+        WHERE embedding IS NOT NULL ORDER BY section_id, chunk_index
+    '''):
+        section_ids.append(section_id)
+        rows.append(np.frombuffer(blob, dtype=np.float32) / np.float32(norm or 1.0))
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+    return np.asarray(section_ids, dtype=np.int64), np.vstack(rows)
+
+
+def max_sim_scores(chunk_scores, chunk_sections):
+    """Aggregate chunk scores into one score per section, taking the maximum.
+
+    chunk_sections must be sorted (as load_chunk_matrix() returns it).
+    Returns (section ids, scores).
+    """
+    sections, starts = np.unique(chunk_sections, return_index=True)
+    return sections, np.maximum.reduceat(chunk_scores, starts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report how many chunks a window/overlap produces.')
+    parser.add_argument('--db', default=DB_PATH, help='Path to cacao_manual.db')
+    parser.add_argument('--window', type=int, default=WINDOW_WORDS,
+                        help=f'Max words per chunk, prefix included (default: {WINDOW_WORDS}, '
+                             f'capped at {max_window()})')
+    parser.add_argument('--overlap', type=int, default=OVERLAP_WORDS,
+                        help=f'Max words repeated from the previous chunk (default: {OVERLAP_WORDS})')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        stats = chunk_counts(conn, args.window, args.overlap)
+    finally:
+        conn.close()
+
+    print(f"Window {min(args.window, max_window())} words, overlap {args.overlap} words")
+    print(f"  Sections:            {stats['sections']}")
+    print(f"  Chunks:              {stats['chunks']} "
+          f"({stats['mean_chunks']:.1f} per section, max {stats['max_chunks']})")
+    print(f"  Words per chunk:     {stats['mean_words']:.1f}")
+    print(f"  Extra vector bytes:  {stats['vector_bytes'] / 1e6:.2f} MB at float32")
+
+
+if __name__ == '__main__':
+    main()
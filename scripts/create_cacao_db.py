@@ -2,15 +2,118 @@
 """
 Script to create and seed the cacao_manual.db SQLite database.
 This generates a pre-built database that can be shipped with the app.
+
+Usage:
+    python scripts/create_cacao_db.py
+    python scripts/create_cacao_db.py --bulk   # deferred FTS build for large corpora
+    python scripts/create_cacao_db.py --source path/to/source --bulk
+    python scripts/create_cacao_db.py --export-source path/to/source
+    python scripts/create_cacao_db.py --fts-remove-diacritics 2 --fts-prefix 2,3,4 \
+        --fts-weights section_title=5,symptoms=2 --fts-report
+    python scripts/create_cacao_db.py --bake-synonyms   # synonym expansion inside the index
+    python scripts/create_cacao_db.py --reproducible    # byte-identical output + build manifest
+    python scripts/create_cacao_db.py --atomic   # build aside, verify, rename (see atomic_build.py)
+    python scripts/create_cacao_db.py --bulk --compress-text zlib   # see text_compression.py
+    python scripts/create_cacao_db.py --bulk --profile-json build.json   # see build_profile.py
+
+See kb_sources.py for the source directory layout.
 """
 
+import argparse
+import json
+import re
 import sqlite3
 import os
+import sys
+import unicodedata
+from array import array
+
+import atomic_build
+import build_manifest
+import build_profile
+import kb_sources
+import text_compression
 
 DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'assets', 'database', 'cacao_manual.db')
 
-def create_schema(conn):
-    """Create database schema with FTS5 support."""
+# Build-time pragmas for bulk mode. The file is rebuilt from scratch, so
+# durability during the build does not matter; a crash just means rerunning.
+BULK_PRAGMAS = [
+    'PRAGMA journal_mode = OFF',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA cache_size = -262144',  # 256 MB
+    'PRAGMA temp_store = MEMORY',
+]
+
+FTS_COLUMNS = ('chapter', 'section_title', 'content', 'symptoms', 'treatment', 'prevention')
+# Extra FTS column holding the synonym terms baked into each section
+SYNONYM_COLUMN = 'synonym_terms'
+
+# FTS5 configuration. The defaults reproduce the plain fts5() table the app
+# shipped with: unicode61 with its default remove_diacritics 1, no prefix
+# indexes, all columns weighted 1.0.
+DEFAULT_FTS_OPTIONS = {
+    'remove_diacritics': None,  # 0, 1 or 2; None keeps the tokenizer default
+    'prefix': (),               # prefix lengths to index, e.g. (2, 3, 4)
+    'weights': {},              # bm25 weight per column, missing columns are 1.0
+    'synonyms': False,          # index SYNONYM_COLUMN (see bake_synonyms())
+}
+
+def fts_columns(options=None):
+    """Columns indexed by manual_fts for the given options, in order."""
+    options = {**DEFAULT_FTS_OPTIONS, **(options or {})}
+    return FTS_COLUMNS + ((SYNONYM_COLUMN,) if options['synonyms'] else ())
+
+def fts_table_sql(options=None):
+    """CREATE VIRTUAL TABLE statement for the FTS index with the given options."""
+    options = {**DEFAULT_FTS_OPTIONS, **(options or {})}
+    settings = [
+        'content=manual_sections',
+        'content_rowid=id',
+    ]
+    if options['remove_diacritics'] is not None:
+        settings.append(f"tokenize='unicode61 remove_diacritics {int(options['remove_diacritics'])}'")
+    if options['prefix']:
+        settings.append(f"prefix='{' '.join(str(int(n)) for n in options['prefix'])}'")
+    return ("CREATE VIRTUAL TABLE IF NOT EXISTS manual_fts USING fts5(\n            "
+            + ',\n            '.join(list(fts_columns(options)) + settings)
+            + '\n        )')
+
+def bm25_weights(options=None):
+    """Per-column bm25 weights in FTS column order."""
+    weights = {**DEFAULT_FTS_OPTIONS, **(options or {})}['weights']
+    return [float(weights.get(column, 1.0)) for column in fts_columns(options)]
+
+def configure_fts(conn, options=None):
+    """Set the FTS5 default rank function and record the FTS settings in kb_metadata.
+
+    With custom weights, queries that ORDER BY rank use them without having
+    to pass them to bm25() explicitly.
+    """
+    options = {**DEFAULT_FTS_OPTIONS, **(options or {})}
+    weights = bm25_weights(options)
+    if any(w != 1.0 for w in weights):
+        conn.execute("INSERT INTO manual_fts(manual_fts, rank) VALUES('rank', ?)",
+                     (f"bm25({', '.join(str(w) for w in weights)})",))
+
+    tokenize = 'unicode61' if options['remove_diacritics'] is None \
+        else f"unicode61 remove_diacritics {int(options['remove_diacritics'])}"
+    conn.executemany('INSERT OR REPLACE INTO kb_metadata (key, value) VALUES (?, ?)', [
+        ('fts_tokenize', tokenize),
+        ('fts_prefix', ' '.join(str(n) for n in options['prefix'])),
+        ('fts_bm25_weights', json.dumps(dict(zip(fts_columns(options), weights)))),
+        ('fts_columns', ' '.join(fts_columns(options))),
+        ('fts_synonyms_baked', '1' if options['synonyms'] else '0'),
+    ])
+    conn.commit()
+
+def create_schema(conn, with_fts_triggers=True, fts_options=None):
+    """Create database schema with FTS5 support.
+
+    With with_fts_triggers=False the FTS sync triggers are left out so rows
+    can be bulk-loaded first; call rebuild_fts() and create_fts_triggers()
+    afterwards. fts_options overrides DEFAULT_FTS_OPTIONS.
+    """
     cursor = conn.cursor()
 
     # Main manual sections table
@@ -29,43 +132,18 @@ def create_schema(conn):
         )
     ''')
 
-    # FTS5 virtual table for full-text search
-    cursor.execute('''
-        CREATE VIRTUAL TABLE IF NOT EXISTS manual_fts USING fts5(
-            chapter,
-            section_title,
-            content,
-            symptoms,
-            treatment,
-            prevention,
-            content=manual_sections,
-            content_rowid=id
-        )
-    ''')
-
-    # Triggers to keep FTS index in sync
-    cursor.execute('''
-        CREATE TRIGGER IF NOT EXISTS manual_sections_ai AFTER INSERT ON manual_sections BEGIN
-            INSERT INTO manual_fts(rowid, chapter, section_title, content, symptoms, treatment, prevention)
-            VALUES (new.id, new.chapter, new.section_title, new.content, new.symptoms, new.treatment, new.prevention);
-        END
-    ''')
+    # Only builds with synonyms baked into the index get the extra column,
+    # so the table the app reads keeps its shape otherwise
+    if {**DEFAULT_FTS_OPTIONS, **(fts_options or {})}['synonyms']:
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(manual_sections)')}
+        if SYNONYM_COLUMN not in columns:
+            cursor.execute(f'ALTER TABLE manual_sections ADD COLUMN {SYNONYM_COLUMN} TEXT')
 
-    cursor.execute('''
-        CREATE TRIGGER IF NOT EXISTS manual_sections_ad AFTER DELETE ON manual_sections BEGIN
-            INSERT INTO manual_fts(manual_fts, rowid, chapter, section_title, content, symptoms, treatment, prevention)
-            VALUES('delete', old.id, old.chapter, old.section_title, old.content, old.symptoms, old.treatment, old.prevention);
-        END
-    ''')
+    # FTS5 virtual table for full-text search
+    cursor.execute(fts_table_sql(fts_options))
 
-    cursor.execute('''
-        CREATE TRIGGER IF NOT EXISTS manual_sections_au AFTER UPDATE ON manual_sections BEGIN
-            INSERT INTO manual_fts(manual_fts, rowid, chapter, section_title, content, symptoms, treatment, prevention)
-            VALUES('delete', old.id, old.chapter, old.section_title, old.content, old.symptoms, old.treatment, old.prevention);
-            INSERT INTO manual_fts(rowid, chapter, section_title, content, symptoms, treatment, prevention)
-            VALUES (new.id, new.chapter, new.section_title, new.content, new.symptoms, new.treatment, new.prevention);
-        END
-    ''')
+    if with_fts_triggers:
+        create_fts_triggers(conn, fts_options)
 
     # Tags table
     cursor.execute('''
@@ -96,6 +174,39 @@ def create_schema(conn):
         )
     ''')
 
+    # Normalized ML class -> section join (section_ids above is kept for
+    # existing readers)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ml_class_sections (
+            ml_class_id TEXT NOT NULL,
+            section_id INTEGER NOT NULL,
+            position INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (ml_class_id, section_id),
+            FOREIGN KEY (ml_class_id) REFERENCES ml_to_manual_mapping(ml_class_id) ON DELETE CASCADE,
+            FOREIGN KEY (section_id) REFERENCES manual_sections(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+
+    # Pre-rendered answer per ML class: one primary-key read from a vision
+    # classification to everything the advice screen shows
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ml_answer_bundles (
+            ml_class_id TEXT PRIMARY KEY,
+            bundle TEXT NOT NULL
+        )
+    ''')
+
+    # Per-tag posting lists for faceted filtering: the sorted section ids of
+    # each tag packed as little-endian uint32, plus the facet count
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tag_postings (
+            tag_id INTEGER PRIMARY KEY,
+            section_count INTEGER NOT NULL,
+            section_ids BLOB NOT NULL,
+            FOREIGN KEY (tag_id) REFERENCES tags(id) ON DELETE CASCADE
+        )
+    ''')
+
     # Synonyms table for improved search
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS synonyms (
@@ -110,9 +221,153 @@ def create_schema(conn):
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_sections_chapter ON manual_sections(chapter)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_sections_severity ON manual_sections(severity_level)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_synonyms_term ON synonyms(term)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ml_class_sections_section ON ml_class_sections(section_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_section_tags_tag ON section_tags(tag_id, section_id)')
+
+    # Build settings (FTS configuration, index parameters, ...)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS kb_metadata (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+    conn.commit()
+    configure_fts(conn, fts_options)
+
+def create_fts_triggers(conn, fts_options=None):
+    """Create triggers that keep manual_fts in sync with manual_sections.
+
+    The update trigger only fires for the indexed text columns, so writing
+    embeddings does not re-index the row.
+    """
+    cursor = conn.cursor()
+    columns = fts_columns(fts_options)
+    names = ', '.join(columns)
+    new_values = ', '.join('new.' + c for c in columns)
+    old_values = ', '.join('old.' + c for c in columns)
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS manual_sections_ai AFTER INSERT ON manual_sections BEGIN
+            INSERT INTO manual_fts(rowid, {names})
+            VALUES (new.id, {new_values});
+        END
+    ''')
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS manual_sections_ad AFTER DELETE ON manual_sections BEGIN
+            INSERT INTO manual_fts(manual_fts, rowid, {names})
+            VALUES('delete', old.id, {old_values});
+        END
+    ''')
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS manual_sections_au AFTER UPDATE OF {names} ON manual_sections BEGIN
+            INSERT INTO manual_fts(manual_fts, rowid, {names})
+            VALUES('delete', old.id, {old_values});
+            INSERT INTO manual_fts(rowid, {names})
+            VALUES (new.id, {new_values});
+        END
+    ''')
 
     conn.commit()
 
+def fold_text(text):
+    """Lowercase and strip accents, close to what the unicode61 tokenizer indexes."""
+    decomposed = unicodedata.normalize('NFKD', (text or '').lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+def bake_synonyms(conn, batch_size=1000):
+    """Store, per section, the synonym-table terms that should also match it.
+
+    The app expands each query term t to t OR synonym(t). Indexing t in
+    synonym_terms for every section that contains one of t's synonyms gives
+    the same matches for the unexpanded query, so no synonym lookups are
+    needed at query time.
+    """
+    # synonym (folded, as a token tuple) -> terms it expands from
+    expands_to = {}
+    for term, synonym in conn.execute('SELECT term, synonym FROM synonyms'):
+        key = tuple(re.findall(r'\w+', fold_text(synonym)))
+        if key:
+            expands_to.setdefault(key, set()).add(term)
+    max_words = max((len(k) for k in expands_to), default=0)
+
+    baked = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(f'''
+            SELECT id, {', '.join(FTS_COLUMNS)} FROM manual_sections
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+
+        updates = []
+        for row in rows:
+            tokens = re.findall(r'\w+', fold_text(' '.join(filter(None, row[1:]))))
+            terms = set()
+            # Every n-gram of the section up to the longest multi-word synonym
+            for n in range(1, max_words + 1):
+                for i in range(len(tokens) - n + 1):
+                    terms.update(expands_to.get(tuple(tokens[i:i + n]), ()))
+            updates.append((' '.join(sorted(terms)) or None, row[0]))
+
+        conn.executemany(f'UPDATE manual_sections SET {SYNONYM_COLUMN} = ? WHERE id = ?', updates)
+        conn.commit()
+        baked += sum(1 for terms, _ in updates if terms)
+        last_id = rows[-1][0]
+
+    print(f"Baked synonym terms into {baked} sections")
+    return baked
+
+def apply_bulk_pragmas(conn):
+    """Trade durability for speed while building a fresh database."""
+    for pragma in BULK_PRAGMAS:
+        conn.execute(pragma)
+
+def rebuild_fts(conn):
+    """Populate manual_fts from manual_sections in a single pass."""
+    conn.execute("INSERT INTO manual_fts(manual_fts) VALUES('rebuild')")
+    conn.commit()
+
+def finalize_database(conn, profiler=None):
+    """Merge FTS segments, refresh planner statistics and compact the file."""
+    profiler = profiler or build_profile.StageProfiler('finalize')
+    with profiler.stage('fts_optimize'):
+        conn.execute("INSERT INTO manual_fts(manual_fts) VALUES('optimize')")
+        conn.commit()
+    with profiler.stage('analyze'):
+        conn.execute('ANALYZE')
+        conn.commit()
+    with profiler.stage('vacuum'):
+        conn.execute('VACUUM')
+
+def fix_timestamps(conn, timestamp):
+    """Give every section the same created_at so rebuilds are byte-identical."""
+    conn.execute('UPDATE manual_sections SET created_at = ?', (timestamp,))
+    conn.commit()
+
+def table_counts(conn):
+    """Row counts reported (and returned) by main()."""
+    return {
+        'sections': conn.execute('SELECT COUNT(*) FROM manual_sections').fetchone()[0],
+        'tags': conn.execute('SELECT COUNT(*) FROM tags').fetchone()[0],
+        'ml_mappings': conn.execute('SELECT COUNT(*) FROM ml_to_manual_mapping').fetchone()[0],
+        'synonyms': conn.execute('SELECT COUNT(*) FROM synonyms').fetchone()[0],
+    }
+
+def build_inputs(args, fts_options):
+    """Hash of everything that determines the bytes of a reproducible build."""
+    return build_manifest.hash_inputs({
+        'scripts': build_manifest.hash_files(build_manifest.module_paths(sys.modules[__name__])),
+        'source': build_manifest.hash_source_dir(args.source) if args.source else None,
+        'fts_options': {k: list(v) if isinstance(v, tuple) else v for k, v in fts_options.items()},
+        'created_at': build_manifest.reproducible_timestamp(),
+        'compress_text': [args.compress_text, args.text_dict_size] if args.compress_text else None,
+        'sqlite_version': sqlite3.sqlite_version,
+    })
+
 def seed_sections(conn):
     """Seed manual sections from BPA manual (CNC 3rd Edition 2019)."""
     cursor = conn.cursor()
@@ -307,21 +562,20 @@ def seed_sections(conn):
         }
     ]
 
-    for section in sections:
-        cursor.execute('''
-            INSERT INTO manual_sections
-            (chapter, section_title, content, symptoms, treatment, prevention, severity_level, image_examples)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            section['chapter'],
-            section['section_title'],
-            section['content'],
-            section['symptoms'],
-            section['treatment'],
-            section['prevention'],
-            section['severity_level'],
-            section['image_examples']
-        ))
+    cursor.executemany('''
+        INSERT INTO manual_sections
+        (chapter, section_title, content, symptoms, treatment, prevention, severity_level, image_examples)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(
+        section['chapter'],
+        section['section_title'],
+        section['content'],
+        section['symptoms'],
+        section['treatment'],
+        section['prevention'],
+        section['severity_level'],
+        section['image_examples']
+    ) for section in sections])
 
     conn.commit()
     print(f"Seeded {len(sections)} manual sections")
@@ -338,11 +592,8 @@ def seed_tags(conn):
         'control_químico', 'almacenamiento'
     ]
 
-    tag_ids = {}
-    for tag in tags:
-        cursor.execute('INSERT OR IGNORE INTO tags (name) VALUES (?)', (tag,))
-        cursor.execute('SELECT id FROM tags WHERE name = ?', (tag,))
-        tag_ids[tag] = cursor.fetchone()[0]
+    cursor.executemany('INSERT OR IGNORE INTO tags (name) VALUES (?)', [(tag,) for tag in tags])
+    tag_ids = dict(cursor.execute('SELECT name, id FROM tags').fetchall())
 
     # Section-tag mappings
     section_tags = {
@@ -365,13 +616,12 @@ def seed_tags(conn):
         17: ['trazabilidad', 'BPA', 'certificación'],  # Trazabilidad
     }
 
-    for section_id, tag_names in section_tags.items():
-        for tag_name in tag_names:
-            if tag_name in tag_ids:
-                cursor.execute(
-                    'INSERT OR IGNORE INTO section_tags (section_id, tag_id) VALUES (?, ?)',
-                    (section_id, tag_ids[tag_name])
-                )
+    cursor.executemany(
+        'INSERT OR IGNORE INTO section_tags (section_id, tag_id) VALUES (?, ?)',
+        [(section_id, tag_ids[tag_name])
+         for section_id, tag_names in section_tags.items()
+         for tag_name in tag_names if tag_name in tag_ids]
+    )
 
     conn.commit()
     print(f"Seeded {len(tags)} tags with section mappings")
@@ -392,17 +642,111 @@ def seed_ml_mappings(conn):
         {'ml_class_id': 'hoja_sana', 'ml_class_label': 'Hoja Sana', 'section_ids': '4,6', 'threshold': 0.8},
     ]
 
-    for mapping in ml_mappings:
-        cursor.execute('''
-            INSERT OR REPLACE INTO ml_to_manual_mapping
-            (ml_class_id, ml_class_label, section_ids, confidence_threshold)
-            VALUES (?, ?, ?, ?)
-        ''', (mapping['ml_class_id'], mapping['ml_class_label'],
-              mapping['section_ids'], mapping['threshold']))
+    cursor.executemany('''
+        INSERT OR REPLACE INTO ml_to_manual_mapping
+        (ml_class_id, ml_class_label, section_ids, confidence_threshold)
+        VALUES (?, ?, ?, ?)
+    ''', [(mapping['ml_class_id'], mapping['ml_class_label'],
+           mapping['section_ids'], mapping['threshold']) for mapping in ml_mappings])
 
     conn.commit()
+    sync_ml_class_sections(conn)
     print(f"Seeded {len(ml_mappings)} ML mappings")
 
+def build_tag_postings(conn):
+    """Precompute the sorted section id list and section count of every tag."""
+    conn.execute('DELETE FROM tag_postings')
+    postings = []
+    current_tag = None
+    ids = []
+    # idx_section_tags_tag returns the rows already grouped and sorted
+    for tag_id, section_id in conn.execute(
+            'SELECT tag_id, section_id FROM section_tags ORDER BY tag_id, section_id'):
+        if tag_id != current_tag:
+            if current_tag is not None:
+                postings.append((current_tag, len(ids), array('I', ids)))
+            current_tag, ids = tag_id, []
+        ids.append(section_id)
+    if current_tag is not None:
+        postings.append((current_tag, len(ids), array('I', ids)))
+
+    if sys.byteorder != 'little':
+        for _, _, packed in postings:
+            packed.byteswap()
+    conn.executemany(
+        'INSERT INTO tag_postings (tag_id, section_count, section_ids) VALUES (?, ?, ?)',
+        [(tag_id, count, packed.tobytes()) for tag_id, count, packed in postings]
+    )
+    conn.commit()
+    print(f"Built posting lists for {len(postings)} tags")
+
+def parse_section_ids(value):
+    """Section ids from a section_ids value, either '11,12' or a JSON list."""
+    value = (value or '').strip()
+    if value.startswith('['):
+        return [int(v) for v in json.loads(value)]
+    return [int(v) for v in value.split(',') if v.strip()]
+
+def sync_ml_class_sections(conn):
+    """Rebuild ml_class_sections from ml_to_manual_mapping.section_ids."""
+    rows = conn.execute('SELECT ml_class_id, section_ids FROM ml_to_manual_mapping').fetchall()
+    conn.execute('DELETE FROM ml_class_sections')
+    conn.executemany(
+        'INSERT OR IGNORE INTO ml_class_sections (ml_class_id, section_id, position) VALUES (?, ?, ?)',
+        [(class_id, section_id, position)
+         for class_id, section_ids in rows
+         for position, section_id in enumerate(parse_section_ids(section_ids))]
+    )
+    conn.commit()
+
+def build_answer_bundles(conn):
+    """Serialize sections, tags, severity and images of every ML class into one row each."""
+    conn.execute('DELETE FROM ml_answer_bundles')
+    mappings = conn.execute('''
+        SELECT ml_class_id, ml_class_label, confidence_threshold FROM ml_to_manual_mapping
+    ''').fetchall()
+
+    bundles = []
+    for class_id, label, threshold in mappings:
+        sections = []
+        for row in conn.execute('''
+            SELECT ms.id, ms.chapter, ms.section_title, ms.content, ms.symptoms, ms.treatment,
+                   ms.prevention, ms.severity_level, ms.image_examples,
+                   (SELECT group_concat(t.name, ',') FROM section_tags st
+                    JOIN tags t ON t.id = st.tag_id WHERE st.section_id = ms.id)
+            FROM ml_class_sections mcs
+            JOIN manual_sections ms ON ms.id = mcs.section_id
+            WHERE mcs.ml_class_id = ?
+            ORDER BY mcs.position
+        ''', (class_id,)):
+            sections.append({
+                'id': row[0],
+                'chapter': row[1],
+                'section_title': row[2],
+                'content': row[3],
+                'symptoms': row[4],
+                'treatment': row[5],
+                'prevention': row[6],
+                'severity_level': row[7],
+                'image_examples': json.loads(row[8]) if row[8] else [],
+                'tags': sorted(row[9].split(',')) if row[9] else [],
+            })
+
+        bundle = {
+            'ml_class_id': class_id,
+            'ml_class_label': label,
+            'confidence_threshold': threshold,
+            'severity_level': max((s['severity_level'] or 1 for s in sections), default=None),
+            'tags': sorted({t for s in sections for t in s['tags']}),
+            'image_examples': [img for s in sections for img in s['image_examples']],
+            'sections': sections,
+        }
+        bundles.append((class_id, json.dumps(bundle, ensure_ascii=False)))
+
+    conn.executemany('INSERT INTO ml_answer_bundles (ml_class_id, bundle) VALUES (?, ?)', bundles)
+    conn.commit()
+    print(f"Built {len(bundles)} ML answer bundles")
+
 def seed_synonyms(conn):
     """Seed synonyms for improved FTS search."""
     cursor = conn.cursor()
@@ -427,58 +771,202 @@ def seed_synonyms(conn):
         ('grano', 'semilla'), ('grano', 'almendra'), ('grano', 'haba'),
     ]
 
-    for term, synonym in synonyms:
-        cursor.execute(
-            'INSERT OR IGNORE INTO synonyms (term, synonym) VALUES (?, ?)',
-            (term, synonym)
-        )
+    cursor.executemany(
+        'INSERT OR IGNORE INTO synonyms (term, synonym) VALUES (?, ?)',
+        synonyms
+    )
 
     conn.commit()
     print(f"Seeded {len(synonyms)} synonyms")
 
-def main():
-    """Create and seed the database."""
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Create and seed cacao_manual.db.')
+    parser.add_argument('--db', default=DB_PATH, help='Output database path')
+    parser.add_argument('--bulk', action='store_true',
+                        help='Bulk-build mode: build-time pragmas, deferred FTS rebuild, '
+                             'then optimize/ANALYZE/VACUUM')
+    parser.add_argument('--source', help='Stream sections, tags, synonyms and ML mappings from this '
+                                         'source directory instead of the built-in seed data')
+    parser.add_argument('--batch-size', type=int, default=kb_sources.BATCH_SIZE,
+                        help=f'Rows per insert batch with --source (default: {kb_sources.BATCH_SIZE})')
+    parser.add_argument('--export-source', metavar='DIR',
+                        help='After building, write the content out as a source directory')
+    parser.add_argument('--fts-remove-diacritics', type=int, choices=(0, 1, 2),
+                        help='unicode61 remove_diacritics setting (default: tokenizer default, 1)')
+    parser.add_argument('--fts-prefix', default='',
+                        help='Comma-separated prefix lengths to index, e.g. 2,3,4')
+    parser.add_argument('--fts-weights', default='',
+                        help='bm25 column weights, e.g. section_title=5,symptoms=2')
+    parser.add_argument('--bake-synonyms', action='store_true',
+                        help='Index synonym expansions in an extra manual_fts column so queries '
+                             'need no synonym lookups')
+    parser.add_argument('--fts-report', action='store_true',
+                        help='Report index size vs query latency for FTS settings (see fts_tuning.py)')
+    parser.add_argument('--reproducible', action='store_true',
+                        help='Byte-identical output for identical inputs (implies --bulk); writes '
+                             '<db>.manifest.json and skips the build if its inputs are unchanged')
+    parser.add_argument('--compress-text', choices=text_compression.CODECS,
+                        help='Store content, symptoms, treatment and prevention compressed with a '
+                             'dictionary trained on the corpus (after the FTS index is built)')
+    parser.add_argument('--text-dict-size', type=int,
+                        help='Compression dictionary size in bytes (see text_compression.py)')
+    parser.add_argument('--profile-json', metavar='PATH',
+                        help='Write per-stage timings, memory, page counts and table sizes as JSON')
+    parser.add_argument('--cprofile', metavar='PATH', help='Dump a cProfile of the build to PATH')
+    parser.add_argument('--atomic', action='store_true',
+                        help='Build into a temporary file, verify it and rename it over the '
+                             'database, so readers never see a missing or partial file')
+    return parser.parse_args(argv)
+
+def parse_fts_options(args):
+    weights = {}
+    for item in filter(None, (part.strip() for part in args.fts_weights.split(','))):
+        column, _, weight = item.partition('=')
+        if column not in FTS_COLUMNS + (SYNONYM_COLUMN,):
+            raise SystemExit(f"Unknown FTS column in --fts-weights: {column}")
+        weights[column] = float(weight)
+    return {
+        'remove_diacritics': args.fts_remove_diacritics,
+        'prefix': tuple(int(n) for n in args.fts_prefix.split(',') if n.strip()),
+        'weights': weights,
+        'synonyms': args.bake_synonyms,
+    }
+
+def main(argv=None):
+    """Create and seed the database; returns the row counts."""
+    args = parse_args(argv)
+    db_path = args.db
+    fts_options = parse_fts_options(args)
+
+    if args.reproducible:
+        # A fresh, vacuumed file is the canonical page layout
+        args.bulk = True
+        inputs = build_inputs(args, fts_options)
+        if build_manifest.stage_is_current(db_path, 'build', inputs):
+            print(f"Database at {db_path} is up to date (build inputs unchanged), skipping")
+            conn = sqlite3.connect(db_path)
+            try:
+                return table_counts(conn)
+            finally:
+                conn.close()
+
+    cprofile = build_profile.start_cprofile(args.cprofile)
+
     # Ensure directory exists
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+    # With --atomic the live database stays in place until the new one is verified
+    build_path = atomic_build.temp_build_path(db_path) if args.atomic else db_path
 
     # Remove existing database
-    if os.path.exists(DB_PATH):
-        os.remove(DB_PATH)
-        print(f"Removed existing database at {DB_PATH}")
+    if os.path.exists(build_path):
+        os.remove(build_path)
+        print(f"Removed existing database at {build_path}")
 
     # Create new database
-    conn = sqlite3.connect(DB_PATH)
-    print(f"Creating database at {DB_PATH}")
+    conn = sqlite3.connect(build_path)
+    print(f"Creating database at {build_path}{' (bulk mode)' if args.bulk else ''}")
+    profiler = build_profile.StageProfiler('create_cacao_db.py', conn)
 
     try:
-        create_schema(conn)
-        print("Schema created successfully")
-
-        seed_sections(conn)
-        seed_tags(conn)
-        seed_ml_mappings(conn)
-        seed_synonyms(conn)
+        with profiler.stage('schema'):
+            if args.bulk:
+                apply_bulk_pragmas(conn)
+
+            # In bulk mode the FTS triggers are installed only after the data is
+            # loaded and indexed in one pass, instead of updating FTS per row.
+            create_schema(conn, with_fts_triggers=not args.bulk, fts_options=fts_options)
+            print("Schema created successfully")
+
+        # Outside bulk mode this includes the FTS trigger work for every row
+        with profiler.stage('load') as stage:
+            if args.source:
+                kb_sources.load_source(conn, args.source, max(1, args.batch_size))
+                sync_ml_class_sections(conn)
+            else:
+                seed_sections(conn)
+                seed_tags(conn)
+                seed_synonyms(conn)
+                # The built-in mappings point at the built-in sections' ids
+                seed_ml_mappings(conn)
+            sections = stage['rows'] = conn.execute('SELECT COUNT(*) FROM manual_sections').fetchone()[0]
+
+        with profiler.stage('tag_postings'):
+            build_tag_postings(conn)
+        with profiler.stage('answer_bundles'):
+            build_answer_bundles(conn)
+
+        if args.bake_synonyms:
+            with profiler.stage('bake_synonyms') as stage:
+                stage['rows'] = bake_synonyms(conn, max(1, args.batch_size))
+
+        if args.reproducible:
+            fix_timestamps(conn, build_manifest.reproducible_timestamp())
+
+        if args.bulk:
+            with profiler.stage('fts_rebuild', rows=sections):
+                rebuild_fts(conn)
+                create_fts_triggers(conn, fts_options)
+            with profiler.stage('finalize'):
+                finalize_database(conn, profiler)
+            print("FTS index rebuilt, optimized and database vacuumed")
 
         # Verify data
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM manual_sections")
-        sections_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM tags")
-        tags_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM ml_to_manual_mapping")
-        ml_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM synonyms")
-        synonyms_count = cursor.fetchone()[0]
-
-        print(f"\nDatabase created successfully!")
-        print(f"  - Sections: {sections_count}")
-        print(f"  - Tags: {tags_count}")
-        print(f"  - ML Mappings: {ml_count}")
-        print(f"  - Synonyms: {synonyms_count}")
-        print(f"\nDatabase saved to: {DB_PATH}")
-
-    finally:
+        counts = table_counts(conn)
+
+        if args.export_source:
+            with profiler.stage('export_source', rows=counts['sections']):
+                kb_sources.export_source(conn, args.export_source)
+
+        text_report = None
+        if args.compress_text:
+            with profiler.stage('compress_text', rows=counts['sections']):
+                text_report = text_compression.compress_database(conn, args.compress_text, args.text_dict_size)
+    except BaseException:
         conn.close()
+        if args.atomic:
+            atomic_build.remove_database_files(build_path)
+        raise
+    conn.close()
+
+    if args.atomic:
+        try:
+            with profiler.stage('verify'):
+                atomic_build.verify_database(build_path, counts)
+            with profiler.stage('swap'):
+                atomic_build.swap_into_place(build_path, db_path)
+        except BaseException:
+            atomic_build.remove_database_files(build_path)
+            raise
+        print("Verified integrity, row counts and FTS index; swapped into place")
+
+    print(f"\nDatabase created successfully!")
+    print(f"  - Sections: {counts['sections']}")
+    print(f"  - Tags: {counts['tags']}")
+    print(f"  - ML Mappings: {counts['ml_mappings']}")
+    print(f"  - Synonyms: {counts['synonyms']}")
+    if text_report is not None:
+        text_compression.print_report(text_report)
+    print(f"\nDatabase saved to: {db_path}")
+
+    if args.fts_report:
+        import fts_tuning
+        fts_tuning.print_report(fts_tuning.fts_tuning_report(db_path))
+
+    if args.reproducible:
+        build_manifest.record_stage(db_path, 'build', inputs, source=args.source)
+
+    build_profile.stop_cprofile(cprofile, args.cprofile)
+    if args.profile_json:
+        conn = sqlite3.connect(db_path)
+        try:
+            report = profiler.report(db_path, conn, bulk=args.bulk, counts=counts)
+        finally:
+            conn.close()
+        build_profile.print_stages(report)
+        build_profile.write_report(args.profile_json, report)
+        print(f"Profile written to {args.profile_json}")
+    return counts
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate detection over stored section embeddings.
+
+Many sections repeat the same guidance (copper fungicides, sanitary
+removal of diseased pods, ...). This stage finds them with blocked matrix
+products: the normalized embeddings are copied to a temporary memory-mapped
+file and scored against each other one block of rows by one block of
+columns at a time, so memory stays at BLOCK_ROWS x BLOCK_COLS scores
+whatever the corpus size, and every pair at or above the cosine threshold
+is linked. Linked sections form clusters
+(union-find); the member most similar to the rest of its cluster is the
+canonical one.
+
+Every other member gets `duplicate_of` = its canonical section id. With
+drop=True the duplicates' vectors are removed from the index (embedding set
+to NULL): the sidecar matrix, the IVF lists and brute-force scans then only
+hold one vector per cluster, and kb_search.py reports a hit on a canonical
+section for its duplicates too. Text, FTS and embedding_hash are kept, so
+generate_embeddings.py does not re-embed dropped duplicates.
+
+Usage:
+    python scripts/generate_embeddings.py --dedup-threshold 0.95 --drop-duplicates
+    python scripts/dedup.py --db path/to/cacao_manual.db --threshold 0.95   # report only
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import numpy as np
+
+import ivf_index
+
+DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'assets', 'database', 'cacao_manual.db')
+THRESHOLD = 0.95
+BLOCK_ROWS = 1024
+BLOCK_COLS = 8192   # 1024 x 8192 float32 scores = 32 MB per matrix product
+
+
+def load_vectors(conn, path):
+    """(ids, normalized matrix, stored bytes per vector) of all stored embeddings.
+
+    The matrix is written page by page to a memory-mapped .npy file at path,
+    so it never has to be resident all at once.
+    """
+    count, stored_bytes = conn.execute('''
+        SELECT COUNT(*), COALESCE(SUM(LENGTH(embedding)), 0) FROM manual_sections
+        WHERE embedding IS NOT NULL
+    ''').fetchone()
+    if not count:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32), 0
+    ids = np.zeros(count, dtype=np.int64)
+    matrix = None
+    row = 0
+    for page_ids, page in ivf_index.iter_embedding_pages(conn):
+        if matrix is None:
+            matrix = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                               shape=(count, page.shape[1]))
+        ids[row:row + len(page_ids)] = page_ids
+        matrix[row:row + len(page)] = page
+        row += len(page)
+    matrix.flush()
+    return ids, matrix, stored_bytes / count
+
+
+def similar_pairs(matrix, threshold=THRESHOLD, block_rows=BLOCK_ROWS, block_cols=BLOCK_COLS):
+    """(i, j) row pairs with i < j and cosine >= threshold, by blocked matrix products."""
+    left, right = [], []
+    for row_start in range(0, len(matrix), block_rows):
+        block = np.asarray(matrix[row_start:row_start + block_rows])
+        # Only columns from the block's first row on can pair with it as j > i
+        for col_start in range(row_start, len(matrix), block_cols):
+            scores = block @ np.asarray(matrix[col_start:col_start + block_cols]).T
+            rows, cols = np.nonzero(scores >= threshold)
+            rows, cols = rows + row_start, cols + col_start
+            keep = cols > rows
+            left.append(rows[keep])
+            right.append(cols[keep])
+    if not left:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(left), np.concatenate(right)
+
+
+def cluster_pairs(n, left, right):
+    """Union-find over the pairs; returns the root row of every row."""
+    parent = np.arange(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in zip(left.tolist(), right.tolist()):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+    return np.array([find(i) for i in range(n)])
+
+
+def canonical_members(matrix, roots):
+    """{root: canonical row} choosing the member closest to the rest of its cluster."""
+    canonical = {}
+    order = np.argsort(roots, kind='stable')
+    boundaries = np.flatnonzero(np.diff(roots[order])) + 1
+    for members in np.split(order, boundaries):
+        if len(members) < 2:
+            continue
+        vectors = matrix[members]
+        canonical[int(roots[members[0]])] = int(members[np.argmax((vectors @ vectors.T).sum(axis=1))])
+    return canonical
+
+
+def find_duplicates(ids, matrix, threshold=THRESHOLD, block_rows=BLOCK_ROWS, block_cols=BLOCK_COLS):
+    """{duplicate section id: canonical section id} plus the number of pairs found."""
+    left, right = similar_pairs(matrix, threshold, block_rows, block_cols)
+    roots = cluster_pairs(len(ids), left, right)
+    canonical = canonical_members(matrix, roots)
+    duplicates = {}
+    for row, root in enumerate(roots.tolist()):
+        if root in canonical and canonical[root] != row:
+            duplicates[int(ids[row])] = int(ids[canonical[root]])
+    return duplicates, len(left)
+
+
+def ensure_column(conn):
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(manual_sections)')}
+    if 'duplicate_of' not in columns:
+        conn.execute('ALTER TABLE manual_sections ADD COLUMN duplicate_of INTEGER')
+
+
+def apply_duplicates(conn, duplicates, drop=False):
+    """Store duplicate_of pointers; with drop, remove duplicate vectors.
+
+    Returns the number of vectors dropped by this call.
+    """
+    ensure_column(conn)
+    # Pointers are recomputed for every section that still has a vector
+    conn.execute('UPDATE manual_sections SET duplicate_of = NULL WHERE embedding IS NOT NULL')
+    conn.executemany('UPDATE manual_sections SET duplicate_of = ? WHERE id = ?',
+                     [(canonical, dup) for dup, canonical in duplicates.items()])
+    # Earlier dropped duplicates may point at a section that is now a duplicate itself
+    while conn.execute('''
+        UPDATE manual_sections
+        SET duplicate_of = (SELECT c.duplicate_of FROM manual_sections c WHERE c.id = manual_sections.duplicate_of)
+        WHERE duplicate_of IN (SELECT id FROM manual_sections WHERE duplicate_of IS NOT NULL)
+    ''').rowcount:
+        pass
+    if not drop:
+        return 0
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(manual_sections)')}
+    cleared = ['embedding = NULL', 'embedding_bits = NULL']
+    if 'embedding_reduced' in columns:
+        cleared.append('embedding_reduced = NULL')
+    return conn.execute(f'''
+        UPDATE manual_sections SET {', '.join(cleared)}
+        WHERE duplicate_of IS NOT NULL AND embedding IS NOT NULL
+    ''').rowcount
+
+
+def dropped_pointers(conn):
+    """{duplicate id: canonical id} of duplicates whose vectors are already dropped."""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(manual_sections)')}
+    if 'duplicate_of' not in columns:
+        return {}
+    return dict(conn.execute('''
+        SELECT id, duplicate_of FROM manual_sections
+        WHERE duplicate_of IS NOT NULL AND embedding IS NULL
+    '''))
+
+
+def deduplicate(conn, threshold=THRESHOLD, drop=False, block_rows=BLOCK_ROWS, write=True,
+                block_cols=BLOCK_COLS):
+    """Run the stage on a connection; returns the shrink report."""
+    start = time.perf_counter()
+    previous = dropped_pointers(conn)
+    with tempfile.TemporaryDirectory(prefix='dedup_') as tmp:
+        ids, matrix, bytes_per_vector = load_vectors(conn, os.path.join(tmp, 'vectors.npy'))
+        duplicates, pairs = (find_duplicates(ids, matrix, threshold, block_rows, block_cols)
+                             if len(ids) else ({}, 0))
+        del matrix  # Release the memory map before its file is removed
+    dropped = 0
+    if write:
+        dropped = apply_duplicates(conn, duplicates, drop)
+        pointers = dict(conn.execute(
+            'SELECT id, duplicate_of FROM manual_sections WHERE duplicate_of IS NOT NULL'))
+        ivf_index.set_metadata(conn, {'dedup_threshold': threshold, 'dedup_duplicates': len(pointers)})
+    else:
+        pointers = {**previous, **duplicates}
+
+    clusters = {}
+    for canonical in pointers.values():
+        clusters[canonical] = clusters.get(canonical, 1) + 1
+    vectors = len(ids) + len(previous)
+    return {
+        'threshold': threshold,
+        'vectors': vectors,
+        'pairs': int(pairs),
+        'clusters': len(clusters),
+        'largest_cluster': max(clusters.values(), default=1),
+        'duplicates': len(pointers),
+        'vectors_after': vectors - len(pointers),
+        'bytes_saved': int(len(pointers) * bytes_per_vector),
+        'dropped': dropped,
+        'previously_dropped': len(previous),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def print_report(report):
+    shrink = report['duplicates'] / max(1, report['vectors'])
+    print(f"Near-duplicates at cosine >= {report['threshold']}: {report['duplicates']} sections "
+          f"in {report['clusters']} clusters (largest {report['largest_cluster']}, "
+          f"{report['pairs']} pairs above threshold)")
+    print(f"  Index vectors: {report['vectors']} -> {report['vectors_after']} "
+          f"({shrink:.1%} smaller, {report['bytes_saved'] / 1024:.1f} KB of vectors)")
+    print(f"  Vectors dropped: {report['dropped']} now, {report['previously_dropped']} earlier "
+          f"({report['seconds']:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find near-duplicate sections by embedding similarity.')
+    parser.add_argument('--db', default=DB_PATH, help='Path to cacao_manual.db')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help=f'Cosine similarity at which sections are duplicates (default: {THRESHOLD})')
+    parser.add_argument('--block-rows', type=int, default=BLOCK_ROWS,
+                        help=f'Rows scored per matrix product (default: {BLOCK_ROWS})')
+    parser.add_argument('--block-cols', type=int, default=BLOCK_COLS,
+                        help=f'Columns scored per matrix product (default: {BLOCK_COLS})')
+    parser.add_argument('--apply', action='store_true', help='Store duplicate_of pointers')
+    parser.add_argument('--drop', action='store_true', help='With --apply, also drop duplicate vectors')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        with conn:
+            report = deduplicate(conn, args.threshold, args.drop, max(1, args.block_rows), args.apply,
+                                 max(1, args.block_cols))
+    finally:
+        conn.close()
+    print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+PCA reduction of section embeddings to fewer dimensions.
+
+A projection is fitted on (a sample of) the stored, unit-normalized
+embeddings: the principal axes of their uncentered second moment, ordered
+by the share of energy they carry. Not centering keeps dot products (and so
+cosine rankings) exact at full rank. The projection is stored in
+`embedding_projection`, so query vectors can be projected exactly like the
+sections:
+
+    reduced = normalize(v @ components[:dim].T)
+
+Because the components are ordered, the first d values of a reduced
+vector are its d-dimensional projection (Matryoshka style): one stored
+vector in `embedding_reduced` serves every smaller dimension by truncating
+and re-normalizing.
+
+The report mode measures recall@k of PCA prefixes and of plain truncation
+of the raw vectors against full-dimension search. Queries come from the
+query_embeddings warm cache when present, otherwise sampled sections are
+used as queries against the rest of the corpus.
+
+Usage:
+    python scripts/generate_embeddings.py --reduce-dim 128     # fit and store
+    python scripts/dim_reduction.py --db path/to/cacao_manual.db --dims 256,128,64,32 --k 10
+"""
+
+import argparse
+import os
+import sqlite3
+import numpy as np
+
+import ivf_index
+
+DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'assets', 'database', 'cacao_manual.db')
+TRAIN_SAMPLE = 50_000
+REPORT_DIMS = (256, 128, 64, 32)
+
+
+def fit_pca(vectors):
+    """Return (components, explained energy ratio), components as rows."""
+    vectors = np.asarray(vectors, dtype=np.float64)
+    second_moment = vectors.T @ vectors / max(1, len(vectors))
+    eigenvalues, eigenvectors = np.linalg.eigh(second_moment)
+    order = np.argsort(eigenvalues)[::-1]
+    eigenvalues = np.clip(eigenvalues[order], 0, None)
+    total = eigenvalues.sum() or 1.0
+    return eigenvectors[:, order].T.astype(np.float32), (eigenvalues / total).astype(np.float32)
+
+
+def project(vectors, components, dim):
+    """Project (n, D) or (D,) vectors onto the first dim components, unit-normalized."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    single = vectors.ndim == 1
+    reduced = ivf_index.normalize_rows(np.atleast_2d(vectors) @ components[:dim].T)
+    return reduced[0] if single else reduced
+
+
+def truncate(vectors, dim):
+    """Re-normalized prefix of each vector (also how stored reduced vectors are shortened)."""
+    return ivf_index.normalize_rows(np.atleast_2d(vectors)[:, :dim])
+
+
+def ensure_columns(conn):
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(manual_sections)')}
+    if 'embedding_reduced' not in columns:
+        conn.execute('ALTER TABLE manual_sections ADD COLUMN embedding_reduced BLOB')
+    if 'embedding_reduced_dim' not in columns:
+        conn.execute('ALTER TABLE manual_sections ADD COLUMN embedding_reduced_dim INTEGER')
+
+
+def store_projection(conn, components, variance, dim, model_name=None):
+    conn.execute('DROP TABLE IF EXISTS embedding_projection')
+    conn.execute('''
+        CREATE TABLE embedding_projection (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            source_dim INTEGER NOT NULL,
+            dim INTEGER NOT NULL,
+            components BLOB NOT NULL,
+            explained_variance REAL NOT NULL,
+            model TEXT
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO embedding_projection
+        (id, source_dim, dim, components, explained_variance, model)
+        VALUES (1, ?, ?, ?, ?, ?)
+    ''', (components.shape[1], dim, np.ascontiguousarray(components[:dim]).tobytes(),
+          float(variance[:dim].sum()), model_name or ''))
+
+
+def load_projection(conn):
+    """(dim, source_dim) components matrix stored by build_reduced_embeddings(), or None."""
+    try:
+        row = conn.execute(
+            'SELECT source_dim, dim, components FROM embedding_projection WHERE id = 1'
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    if row is None:
+        return None
+    source_dim, dim, components = row
+    return np.frombuffer(components, dtype=np.float32).reshape(dim, source_dim)
+
+
+def build_reduced_embeddings(conn, dim, model_name=None, train_sample=TRAIN_SAMPLE):
+    """Fit the projection, store it and write embedding_reduced for every section."""
+    training = ivf_index.sample_embeddings(conn, train_sample)
+    if training.size == 0:
+        print("No embeddings stored; skipping dimensionality reduction")
+        return None
+    dim = min(dim, training.shape[1])
+    components, variance = fit_pca(training)
+
+    with conn:
+        ensure_columns(conn)
+        store_projection(conn, components, variance, dim, model_name)
+        components = components[:dim]
+        for ids, matrix in ivf_index.iter_embedding_pages(conn):
+            reduced = project(matrix, components, dim)
+            conn.executemany(
+                'UPDATE manual_sections SET embedding_reduced = ?, embedding_reduced_dim = ? WHERE id = ?',
+                [(row.tobytes(), dim, section_id) for row, section_id in zip(reduced, ids)]
+            )
+        ivf_index.set_metadata(conn, {'reduced_dim': dim, 'reduced_model': model_name or ''})
+
+    kept = float(variance[:dim].sum())
+    print(f"Reduced embeddings {training.shape[1]} -> {dim} dims "
+          f"({kept:.1%} of energy kept, fitted on {len(training)} vectors)")
+    return {'dim': dim, 'explained_variance': kept}
+
+
+def load_matrix(conn):
+    """All stored embeddings as a normalized (ids, matrix) pair."""
+    ids, pages = [], []
+    for page_ids, matrix in ivf_index.iter_embedding_pages(conn):
+        ids.extend(page_ids)
+        pages.append(matrix)
+    if not pages:
+        return ids, np.zeros((0, 0), dtype=np.float32)
+    return ids, np.vstack(pages)
+
+
+def load_query_vectors(conn):
+    try:
+        rows = conn.execute('SELECT embedding FROM query_embeddings').fetchall()
+    except sqlite3.OperationalError:
+        return None
+    if not rows:
+        return None
+    return ivf_index.normalize_rows(np.vstack([np.frombuffer(r[0], dtype=np.float32) for r in rows]))
+
+
+def _top_k(queries, matrix, k, exclude=None, block=256):
+    results = []
+    for start in range(0, len(queries), block):
+        scores = queries[start:start + block] @ matrix.T
+        if exclude is not None:
+            scores[np.arange(scores.shape[0]), exclude[start:start + block]] = -np.inf
+        results.append(np.argpartition(-scores, k - 1, axis=1)[:, :k])
+    return np.vstack(results)
+
+
+def recall_report(matrix, dims=REPORT_DIMS, k=10, queries=None, max_queries=1000, seed=0):
+    """Recall@k of PCA prefixes and raw truncation against full-dimension search.
+
+    Without queries, sampled corpus rows are used and each is excluded from
+    its own results.
+    """
+    n, full_dim = matrix.shape
+    exclude = None
+    if queries is None:
+        rng = np.random.default_rng(seed)
+        exclude = np.sort(rng.choice(n, size=min(max_queries, n), replace=False))
+        queries = matrix[exclude]
+    k = min(k, n - 1 if exclude is not None else n)
+    if k < 1:
+        return []
+
+    baseline = _top_k(queries, matrix, k, exclude)
+    components, variance = fit_pca(matrix)
+
+    def recall(approx):
+        hits = sum(len(set(e) & set(a)) for e, a in zip(baseline, approx))
+        return hits / max(1, baseline.size)
+
+    report = [{'method': 'full', 'dim': full_dim, 'bytes_per_vector': full_dim * 4,
+               'explained_variance': 1.0, f'recall@{k}': 1.0}]
+    for dim in sorted({d for d in dims if 0 < d < full_dim}, reverse=True):
+        pca = _top_k(project(queries, components, dim), project(matrix, components, dim), k, exclude)
+        cut = _top_k(truncate(queries, dim), truncate(matrix, dim), k, exclude)
+        report.append({'method': 'pca', 'dim': dim, 'bytes_per_vector': dim * 4,
+                       'explained_variance': float(variance[:dim].sum()), f'recall@{k}': recall(pca)})
+        report.append({'method': 'truncate', 'dim': dim, 'bytes_per_vector': dim * 4,
+                       'explained_variance': None, f'recall@{k}': recall(cut)})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall-vs-dimension report for reduced embeddings.')
+    parser.add_argument('--db', default=DB_PATH, help='Database with embeddings')
+    parser.add_argument('--dims', default=','.join(str(d) for d in REPORT_DIMS),
+                        help='Comma-separated dimensions to evaluate (default: 256,128,64,32)')
+    parser.add_argument('--k', type=int, default=10, help='Neighbours per query (default: 10)')
+    parser.add_argument('--queries', type=int, default=1000,
+                        help='Max sampled corpus queries when there is no query_embeddings table')
+    parser.add_argument('--corpus-queries', action='store_true',
+                        help='Use sampled sections as queries even if query_embeddings exists')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        ids, matrix = load_matrix(conn)
+        queries = None if args.corpus_queries else load_query_vectors(conn)
+    finally:
+        conn.close()
+
+    if len(ids) < 2:
+        print("Error: need at least two embeddings. Run generate_embeddings.py first.")
+        exit(1)
+
+    dims = [int(d) for d in args.dims.split(',') if d.strip()]
+    report = recall_report(matrix, dims, args.k, queries, args.queries)
+    recall_key = next(key for key in report[0] if key.startswith('recall@'))
+
+    source = f"{len(queries)} warm-cache queries" if queries is not None else "sampled sections"
+    print(f"Vectors: {len(ids)}  Dimension: {matrix.shape[1]}  Queries: {source}")
+    print(f"\n{'Method':<10}{'Dim':>6}{'Bytes/vector':>14}{'Energy':>10}{recall_key:>12}")
+    for row in report:
+        variance = '' if row['explained_variance'] is None else f"{row['explained_variance']:.1%}"
+        print(f"{row['method']:<10}{row['dim']:>6}{row['bytes_per_vector']:>14}"
+              f"{variance:>10}{row[recall_key]:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Long-lived local embedding server with dynamic micro-batching.
+
+Loads the sentence-transformers model once (same MODEL_NAME as
+generate_embeddings.py) and serves it over local HTTP, so embedding runs,
+kb_search.py and benchmarks share one warm model instead of each paying the
+load cost.
+
+Concurrent requests are put on an asyncio queue. A single batcher task takes
+the first waiting request, then keeps collecting until --max-batch texts are
+queued or --max-wait-ms has passed since that first request, and encodes the
+whole group in one model call on a worker thread. Interactive queries wait at
+most max-wait; bulk callers fill whole batches.
+
+Endpoints:
+    POST /embed   {"texts": [...]} -> {"dim": 512, "count": n,
+                                       "embeddings": base64 float32, row-major}
+    GET  /stats   request/batch counters, batch sizes, latency percentiles
+    GET  /health  {"status": "ok", "model": ...}
+
+generate_embeddings.py --server only accepts a server whose /health model
+is MODEL_NAME (see connect()), so a --stub server can never write vectors
+into the database or the embedding cache.
+
+Embeddings are returned unnormalized; EmbeddingClient normalizes on request,
+exactly as SentenceTransformer.encode(normalize_embeddings=True) does.
+
+Usage:
+    python scripts/embedding_server.py --port 8765 --max-batch 64 --max-wait-ms 5
+    python scripts/generate_embeddings.py --server http://127.0.0.1:8765
+    python scripts/kb_search.py --server http://127.0.0.1:8765 "monilia"
+"""
+
+import argparse
+import asyncio
+import base64
+import collections
+import json
+import time
+import urllib.request
+import numpy as np
+
+import generate_embeddings
+
+HOST = '127.0.0.1'
+PORT = 8765
+MAX_BATCH = 64
+MAX_WAIT_MS = 5.0
+LATENCY_WINDOW = 10_000
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+
+class ServerStats:
+    """Counters exposed on /stats; latencies are kept for the last LATENCY_WINDOW requests."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        self.texts = 0
+        self.batches = 0
+        self.errors = 0
+        self.encode_seconds = 0.0
+        self.batch_sizes = collections.Counter()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def snapshot(self, queue_depth):
+        uptime = time.time() - self.started
+        latencies_ms = np.asarray(self.latencies) * 1000.0
+        percentiles = {}
+        if len(latencies_ms):
+            for p in (50, 95, 99):
+                percentiles[f'p{p}_ms'] = float(np.percentile(latencies_ms, p))
+        return {
+            'uptime_seconds': uptime,
+            'requests': self.requests,
+            'texts': self.texts,
+            'batches': self.batches,
+            'errors': self.errors,
+            'queue_depth': queue_depth,
+            'mean_batch_texts': self.texts / self.batches if self.batches else 0.0,
+            'batch_size_histogram': dict(sorted(self.batch_sizes.items())),
+            'encode_seconds': self.encode_seconds,
+            'texts_per_sec_encoding': self.texts / self.encode_seconds if self.encode_seconds else 0.0,
+            'texts_per_sec_uptime': self.texts / uptime if uptime else 0.0,
+            'latency': percentiles,
+        }
+
+
+class MicroBatcher:
+    """Group queued encode requests into model calls of up to max_batch texts."""
+
+    def __init__(self, model, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, stats=None):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.stats = stats or ServerStats()
+        self.queue = asyncio.Queue()
+
+    async def embed(self, texts):
+        """Queue texts and wait for their (n, dim) float32 embeddings."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((texts, future, time.perf_counter()))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            group = [await self.queue.get()]
+            n_texts = len(group[0][0])
+            deadline = loop.time() + self.max_wait
+            while n_texts < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                group.append(item)
+                n_texts += len(item[0])
+
+            texts = [text for item in group for text in item[0]]
+            start = time.perf_counter()
+            try:
+                embeddings = await loop.run_in_executor(None, self._encode, texts)
+            except Exception as e:
+                self.stats.errors += len(group)
+                for _, future, _ in group:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.stats.encode_seconds += time.perf_counter() - start
+            self.stats.batches += 1
+            self.stats.batch_sizes[len(texts)] += 1
+
+            offset = 0
+            finished = time.perf_counter()
+            for item_texts, future, queued in group:
+                if not future.done():
+                    future.set_result(embeddings[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+                self.stats.requests += 1
+                self.stats.texts += len(item_texts)
+                self.stats.latencies.append(finished - queued)
+
+    def _encode(self, texts):
+        embeddings = self.model.encode(texts, batch_size=self.max_batch,
+                                       normalize_embeddings=False, show_progress_bar=False)
+        return np.asarray(embeddings, dtype=np.float32)
+
+
+def _http_response(status, payload):
+    body = json.dumps(payload).encode('utf-8')
+    reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}[status]
+    head = (f'HTTP/1.1 {status} {reason}\r\n'
+            f'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: close\r\n\r\n')
+    return head.encode('ascii') + body
+
+
+async def handle_connection(reader, writer, batcher, model_name):
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            key, _, value = line.partition(':')
+            headers[key.strip().lower()] = value.strip()
+        if len(request_line) < 2:
+            return
+        method, path = request_line[0], request_line[1]
+
+        if method == 'GET' and path == '/health':
+            response = _http_response(200, {'status': 'ok', 'model': model_name})
+        elif method == 'GET' and path == '/stats':
+            response = _http_response(200, batcher.stats.snapshot(batcher.queue.qsize()))
+        elif method == 'POST' and path == '/embed':
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY_BYTES:
+                response = _http_response(400, {'error': 'request too large'})
+            else:
+                try:
+                    texts = json.loads(await reader.readexactly(length))['texts']
+                    if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                        raise ValueError('texts must be a list of strings')
+                except (ValueError, KeyError, TypeError) as e:
+                    response = _http_response(400, {'error': str(e)})
+                else:
+                    try:
+                        embeddings = await batcher.embed(texts) if texts else np.zeros((0, 0), np.float32)
+                        response = _http_response(200, {
+                            'dim': int(embeddings.shape[1]) if len(embeddings) else 0,
+                            'count': len(texts),
+                            'embeddings': base64.b64encode(embeddings.tobytes()).decode('ascii'),
+                        })
+                    except Exception as e:
+                        response = _http_response(500, {'error': str(e)})
+        else:
+            response = _http_response(404, {'error': f'no route for {method} {path}'})
+
+        writer.write(response)
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(model, host=HOST, port=PORT, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS,
+                model_name=generate_embeddings.MODEL_NAME):
+    batcher = MicroBatcher(model, max_batch, max_wait_ms)
+    batch_task = asyncio.create_task(batcher.run())
+    server = await asyncio.start_server(
+        lambda r, w: handle_connection(r, w, batcher, model_name), host, port)
+    print(f"Serving {model_name} on http://{host}:{port} "
+          f"(max batch {max_batch}, max wait {max_wait_ms} ms)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batch_task.cancel()
+
+
+class EmbeddingClient:
+    """SentenceTransformer-compatible encode() backed by a running embedding server.
+
+    Can be passed wherever a model is expected, e.g. as the model_factory
+    result of generate_embeddings.main() or the encoder of KnowledgeBaseSearch.
+    """
+
+    def __init__(self, url=f'http://{HOST}:{PORT}', timeout=300):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self._dim = None
+        self._model_name = None
+
+    def _request(self, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode('utf-8')
+        request = urllib.request.Request(self.url + path, data=data,
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.load(response)
+
+    def encode(self, texts, batch_size=None, normalize_embeddings=False, show_progress_bar=False,
+               **kwargs):
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        result = self._request('/embed', {'texts': list(texts)})
+        self._dim = result['dim'] or self._dim
+        embeddings = np.frombuffer(base64.b64decode(result['embeddings']), dtype=np.float32)
+        embeddings = embeddings.reshape(result['count'], -1).copy()
+        if normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            embeddings /= norms
+        return embeddings[0] if single else embeddings
+
+    @property
+    def model_name(self):
+        """Name of the model the server is running, as reported by /health."""
+        if self._model_name is None:
+            self._model_name = self._request('/health')['model']
+        return self._model_name
+
+    def get_sentence_embedding_dimension(self):
+        if self._dim is None:
+            self.encode(['dimension'])
+        return self._dim
+
+    def stats(self):
+        return self._request('/stats')
+
+
+def connect(url, model_name=generate_embeddings.MODEL_NAME):
+    """EmbeddingClient for url, refusing a server that runs a different model.
+
+    Vectors are cached and stored under model_name, so encoding them with
+    any other model (e.g. a --stub server) would poison the embedding cache
+    and make later runs treat the stored vectors as current.
+    """
+    client = EmbeddingClient(url)
+    if client.model_name != model_name:
+        raise ValueError(f"Embedding server at {url} runs {client.model_name!r}, expected {model_name!r}")
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the embedding model over local HTTP.')
+    parser.add_argument('--host', default=HOST, help=f'Bind address (default: {HOST})')
+    parser.add_argument('--port', type=int, default=PORT, help=f'Port (default: {PORT})')
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH,
+                        help=f'Texts per model call before a batch is sent early (default: {MAX_BATCH})')
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT_MS,
+                        help=f'Longest a request waits for more to batch with (default: {MAX_WAIT_MS})')
+    parser.add_argument('--stub', action='store_true',
+                        help='Serve the hashing stub from benchmark_kb.py instead of the real model')
+    args = parser.parse_args()
+
+    if args.stub:
+        import benchmark_kb
+        model, model_name = benchmark_kb.HashingEncoder(), benchmark_kb.STUB_MODEL_NAME
+    else:
+        print(f"Loading model: {generate_embeddings.MODEL_NAME}")
+        model, model_name = generate_embeddings.load_model(), generate_embeddings.MODEL_NAME
+
+    try:
+        asyncio.run(serve(model, args.host, args.port, max(1, args.max_batch), args.max_wait_ms,
+                          model_name))
+    except KeyboardInterrupt:
+        print("\nStopped")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Index-size vs query-latency report for FTS5 settings.
+
+For each candidate configuration the sections of a built database are copied
+into a scratch database, indexed with create_cacao_db.fts_table_sql() and
+measured: FTS index bytes (file size growth over the bare table after
+VACUUM), hits and latency for a fixed set of accented, unaccented and
+prefix queries.
+
+With --synonyms it instead compares the app's runtime synonym expansion
+(one synonyms lookup per query term, then MATCH) against a database built
+with create_cacao_db.py --bake-synonyms (a single MATCH on the raw terms).
+
+Usage:
+    python scripts/fts_tuning.py --db assets/database/cacao_manual.db
+    python scripts/create_cacao_db.py --fts-report
+    python scripts/fts_tuning.py --db baked.db --synonyms
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import numpy as np
+
+import create_cacao_db
+import text_compression
+
+DB_PATH = create_cacao_db.DB_PATH
+REPEAT = 50
+
+SETTINGS = [
+    ('default', {}),
+    ('remove_diacritics 0', {'remove_diacritics': 0}),
+    ('remove_diacritics 2', {'remove_diacritics': 2}),
+    ('prefix 2,3,4', {'prefix': (2, 3, 4)}),
+    ('remove_diacritics 2 + prefix 2,3,4', {'remove_diacritics': 2, 'prefix': (2, 3, 4)}),
+]
+
+# Accented/unaccented pairs and type-ahead prefixes farmers actually type
+REPORT_QUERIES = [
+    'fermentacion', 'fermentación', 'fungicidas', 'sintomas', 'cosecha',
+    'fe*', 'fer*', 'ferm*', 'mo*', 'mon*', 'po*', 'pod*', 'ma*', 'maz*',
+    'monilia OR moniliasis', 'escoba bruja',
+]
+
+# Queries whose terms have entries in the synonyms table
+SYNONYM_QUERIES = [
+    'monilia', 'poda', 'plaga', 'fermentación', 'tratamiento hongo', 'síntoma enfermedad',
+    'sombra', 'cosecha grano', 'secado', 'prevención', 'calidad trazabilidad', 'escoba',
+]
+
+# Same statement as CacaoManualLocalDataSource.searchSections
+APP_SEARCH_SQL = '''
+    SELECT ms.*, bm25(manual_fts) as rank
+    FROM manual_sections ms
+    JOIN manual_fts ON ms.id = manual_fts.rowid
+    WHERE manual_fts MATCH ?
+    ORDER BY rank
+    LIMIT ?
+'''
+
+
+def _fts_or(terms):
+    return ' OR '.join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def _file_bytes(conn):
+    return conn.execute('PRAGMA page_count').fetchone()[0] * conn.execute('PRAGMA page_size').fetchone()[0]
+
+
+def measure_setting(source_db, options, queries=REPORT_QUERIES, repeat=REPEAT):
+    """Build the FTS index with options on a copy of the sections and time queries."""
+    with tempfile.TemporaryDirectory(prefix='fts_tuning_') as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, 'fts.db'))
+        try:
+            conn.execute('ATTACH DATABASE ? AS src', (source_db,))
+            text_compression.register_text_function(conn, 'src')
+            conn.execute('''
+                CREATE TABLE manual_sections (
+                    id INTEGER PRIMARY KEY, chapter TEXT, section_title TEXT, content TEXT,
+                    symptoms TEXT, treatment TEXT, prevention TEXT
+                )
+            ''')
+            conn.execute('''
+                INSERT INTO manual_sections
+                SELECT id, chapter, section_title, kb_text(content), kb_text(symptoms),
+                       kb_text(treatment), kb_text(prevention)
+                FROM src.manual_sections
+            ''')
+            conn.commit()
+            conn.execute('DETACH DATABASE src')
+            conn.execute('VACUUM')
+            base_bytes = _file_bytes(conn)
+
+            start = time.perf_counter()
+            conn.execute(create_cacao_db.fts_table_sql(options))
+            conn.execute("INSERT INTO manual_fts(manual_fts) VALUES('rebuild')")
+            conn.execute("INSERT INTO manual_fts(manual_fts) VALUES('optimize')")
+            conn.commit()
+            build_seconds = time.perf_counter() - start
+            conn.execute('VACUUM')
+            index_bytes = _file_bytes(conn) - base_bytes
+
+            hits = {}
+            samples = []
+            for query in queries:
+                hits[query] = conn.execute(
+                    'SELECT COUNT(*) FROM manual_fts WHERE manual_fts MATCH ?', (query,)
+                ).fetchone()[0]
+                for _ in range(repeat):
+                    t = time.perf_counter()
+                    conn.execute(
+                        'SELECT rowid FROM manual_fts WHERE manual_fts MATCH ? ORDER BY rank LIMIT 10',
+                        (query,)
+                    ).fetchall()
+                    samples.append(time.perf_counter() - t)
+        finally:
+            conn.close()
+
+    samples_ms = np.asarray(samples) * 1000.0
+    return {
+        'index_bytes': index_bytes,
+        'build_seconds': build_seconds,
+        'p50_ms': float(np.percentile(samples_ms, 50)),
+        'p95_ms': float(np.percentile(samples_ms, 95)),
+        'total_hits': sum(hits.values()),
+        'hits': hits,
+    }
+
+
+def fts_tuning_report(db_path, settings=SETTINGS, repeat=REPEAT):
+    return [{'setting': name, 'options': options, **measure_setting(db_path, options, repeat=repeat)}
+            for name, options in settings]
+
+
+def runtime_expansion_search(conn, query, limit=10):
+    """The app's path: look up synonyms term by term, then MATCH the expanded query."""
+    expanded = {}
+    for term in query.lower().split():
+        expanded[term] = None
+        for (synonym,) in conn.execute('SELECT synonym FROM synonyms WHERE term = ?', (term,)):
+            expanded[synonym] = None
+    return conn.execute(APP_SEARCH_SQL, (_fts_or(expanded), limit)).fetchall()
+
+
+def baked_search(conn, query, limit=10):
+    """With synonyms baked into the index: one MATCH on the raw query terms."""
+    return conn.execute(APP_SEARCH_SQL, (_fts_or(dict.fromkeys(query.lower().split())), limit)).fetchall()
+
+
+def compare_synonym_expansion(db_path, queries=SYNONYM_QUERIES, repeat=REPEAT):
+    """Latency of runtime synonym expansion vs the baked index on the same DB."""
+    conn = sqlite3.connect(db_path)
+    try:
+        baked = conn.execute(
+            "SELECT value FROM kb_metadata WHERE key = 'fts_synonyms_baked'"
+        ).fetchone()
+        if not baked or baked[0] != '1':
+            raise SystemExit("Database was not built with --bake-synonyms")
+
+        report = {}
+        for name, search in (('runtime lookup', runtime_expansion_search), ('baked index', baked_search)):
+            samples = []
+            for query in queries:
+                for _ in range(repeat):
+                    t = time.perf_counter()
+                    search(conn, query)
+                    samples.append(time.perf_counter() - t)
+            samples_ms = np.asarray(samples) * 1000.0
+            report[name] = {
+                'p50_ms': float(np.percentile(samples_ms, 50)),
+                'p95_ms': float(np.percentile(samples_ms, 95)),
+            }
+
+        # Share of runtime-expansion hits that the baked index also returns
+        overlap = []
+        for query in queries:
+            expected = {row[0] for row in runtime_expansion_search(conn, query, 1000)}
+            actual = {row[0] for row in baked_search(conn, query, 1000)}
+            overlap.append(len(expected & actual) / len(expected) if expected else 1.0)
+        report['recall_vs_runtime'] = float(np.mean(overlap))
+        return report
+    finally:
+        conn.close()
+
+
+def print_report(report):
+    print(f"\n{'FTS setting':<38}{'Index KB':>10}{'Build s':>9}{'p50 ms':>9}{'p95 ms':>9}{'Hits':>7}")
+    for row in report:
+        print(f"{row['setting']:<38}{row['index_bytes'] / 1024:>10.1f}{row['build_seconds']:>9.3f}"
+              f"{row['p50_ms']:>9.3f}{row['p95_ms']:>9.3f}{row['total_hits']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare FTS5 settings on a built database.')
+    parser.add_argument('--db', default=DB_PATH, help='Path to cacao_manual.db')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help=f'Runs per query (default: {REPEAT})')
+    parser.add_argument('--synonyms', action='store_true',
+                        help='Compare runtime synonym expansion with the baked index')
+    args = parser.parse_args()
+
+    if args.synonyms:
+        report = compare_synonym_expansion(args.db, repeat=args.repeat)
+        print(f"\n{'Synonym expansion':<20}{'p50 ms':>9}{'p95 ms':>9}")
+        for name in ('runtime lookup', 'baked index'):
+            print(f"{name:<20}{report[name]['p50_ms']:>9.3f}{report[name]['p95_ms']:>9.3f}")
+        print(f"Baked index returns {report['recall_vs_runtime']:.1%} of runtime-expansion hits")
+        return
+
+    print_report(fts_tuning_report(args.db, repeat=args.repeat))
+
+
+if __name__ == '__main__':
+    main()
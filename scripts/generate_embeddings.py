@@ -4,34 +4,96 @@ Generate embeddings for all manual sections using DistilUSE.
 
 This script:
 1. Loads the sentence-transformers model
-2. Reads all sections from the SQLite database
-3. Generates embeddings for each section
-4. Stores embeddings back in the database
+2. Streams sections from the SQLite database in id-ordered pages
+3. Skips sections whose text hash and model are unchanged since the last run
+4. Looks up the remaining texts in a persistent on-disk embedding cache
+5. Generates embeddings in batches for cache misses only
+6. Stores embeddings back in the database in a single transaction, in the
+   format chosen with --format (see quantization.py)
+7. Embeds WARM_QUERIES and every synonym term into `query_embeddings`, keyed
+   by the same normalization as the app's EmbeddingCache, so the app can warm
+   its query cache at startup with one read
+
+Reading, encoding and writing are pipelined: while one batch is encoded on
+a worker thread, the next page is read and the previous batch is written,
+so peak memory is bounded by a couple of batches, not the corpus size.
+
+The model is loaded lazily, so a rebuild whose texts are all cached never
+loads it at all.
 
 Requirements:
     pip install sentence-transformers sqlite3
 
 Usage:
     python scripts/generate_embeddings.py
+    python scripts/generate_embeddings.py --batch-size 128
+    python scripts/generate_embeddings.py --force   # re-embed every section
+    python scripts/generate_embeddings.py --no-cache
+    python scripts/generate_embeddings.py --format int8 --sign-bits
+    python scripts/generate_embeddings.py --ivf    # also build the IVF ANN index
+    python scripts/generate_embeddings.py --reproducible   # see build_manifest.py
+    python scripts/generate_embeddings.py --server http://127.0.0.1:8765   # shared warm model
+    python scripts/generate_embeddings.py --warm-queries queries.txt   # extra queries to precompute
+    python scripts/generate_embeddings.py --reduce-dim 128 --reduce-report   # see dim_reduction.py
+    python scripts/generate_embeddings.py --chunks   # per-chunk vectors, see chunking.py
+    python scripts/generate_embeddings.py --dedup-threshold 0.95 --drop-duplicates   # see dedup.py
+    python scripts/generate_embeddings.py --wal   # readers keep working during the update
+    python scripts/generate_embeddings.py --profile-json embed.json   # see build_profile.py
 """
 
+import argparse
+import hashlib
+import re
 import sqlite3
-import struct
 import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
-# Try to import sentence_transformers, provide helpful error if not installed
-try:
-    from sentence_transformers import SentenceTransformer
-except ImportError:
-    print("Error: sentence-transformers not installed.")
-    print("Install with: pip install sentence-transformers")
-    exit(1)
+import atomic_build
+import build_manifest
+import build_profile
+import chunking
+import dedup
+import dim_reduction
+import ivf_index
+import quantization
+import text_compression
 
 # Configuration
 DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'assets', 'database', 'cacao_manual.db')
 MODEL_NAME = 'sentence-transformers/distiluse-base-multilingual-cased-v2'
 EMBEDDING_DIM = 512
+BATCH_SIZE = 64
+CACHE_PATH = os.path.join(os.path.dirname(__file__), '.cache', 'embedding_cache.db')
+CACHE_MAX_ENTRIES = 200_000
+
+# Frequent farmer queries precomputed into query_embeddings (synonym terms are
+# added from the database)
+WARM_QUERIES = [
+    'monilia', 'moniliasis', 'escoba de bruja', 'mazorca negra', 'phytophthora',
+    'manchas en la mazorca', 'mazorca podrida', 'hongo en el fruto', 'hongo blanco en la mazorca',
+    'hojas amarillas', 'hojas secas', 'se caen las flores', 'frutos pequeños',
+    'cómo podar el cacao', 'poda de formación', 'poda sanitaria', 'cuándo podar',
+    'cómo fermentar el cacao', 'fermentación', 'cuántos días fermentar', 'secado del grano',
+    'humedad del grano', 'calidad del grano', 'almacenamiento del cacao', 'cosecha',
+    'cuándo cosechar', 'fertilización', 'abono orgánico', 'deficiencia de nitrógeno',
+    'control de plagas', 'hormiga arriera', 'barrenador', 'chinche', 'control de malezas',
+    'fungicida cúprico', 'caldo bordelés', 'sombra para el cacao', 'injerto',
+    'vivero', 'siembra', 'riego', 'trazabilidad', 'buenas prácticas agrícolas',
+]
+
+
+def load_model(model_name=MODEL_NAME):
+    """Load the sentence-transformers model, with a helpful error if it is not installed."""
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        print("Error: sentence-transformers not installed.")
+        print("Install with: pip install sentence-transformers")
+        exit(1)
+    return SentenceTransformer(model_name)
 
 
 def add_embedding_columns(conn):
@@ -50,6 +112,28 @@ def add_embedding_columns(conn):
         cursor.execute('ALTER TABLE manual_sections ADD COLUMN embedding_norm REAL')
         print("Added 'embedding_norm' column")
 
+    if 'embedding_hash' not in columns:
+        cursor.execute('ALTER TABLE manual_sections ADD COLUMN embedding_hash TEXT')
+        print("Added 'embedding_hash' column")
+
+    if 'embedding_model' not in columns:
+        cursor.execute('ALTER TABLE manual_sections ADD COLUMN embedding_model TEXT')
+        print("Added 'embedding_model' column")
+
+    # Quantization metadata (see quantization.py)
+    for name, column_type in (('embedding_format', 'TEXT'),
+                              ('embedding_scale', 'REAL'),
+                              ('embedding_zero_point', 'REAL'),
+                              ('embedding_bits', 'BLOB')):
+        if name not in columns:
+            cursor.execute(f'ALTER TABLE manual_sections ADD COLUMN {name} {column_type}')
+            print(f"Added '{name}' column")
+
+    # Canonical section of a near-duplicate (see dedup.py)
+    if 'duplicate_of' not in columns:
+        cursor.execute('ALTER TABLE manual_sections ADD COLUMN duplicate_of INTEGER')
+        print("Added 'duplicate_of' column")
+
     conn.commit()
 
 
@@ -74,80 +158,612 @@ def generate_section_text(section):
     return full_text
 
 
+def section_text_hash(text):
+    """SHA-256 of the text that is fed to the model."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def needs_embedding(section, text_hash, model_name, force=False,
+                    fmt=quantization.DEFAULT_FORMAT, with_bits=False):
+    """Whether a section's stored embedding is missing or stale."""
+    if force:
+        return True
+    has_embedding, stored_hash, stored_model = section[7], section[8], section[9]
+    stored_format, has_bits = section[10], section[11]
+    return (not has_embedding or stored_hash != text_hash or stored_model != model_name
+            or stored_format != fmt or (with_bits and not has_bits))
+
+
+def iter_section_batches(conn, batch_size):
+    """Yield pages of sections using rowid keyset pagination.
+
+    Each page is a fresh "WHERE id > last_id" query, so only one page of
+    text columns is held in memory at a time. Duplicates whose vector was
+    dropped by dedup.py count as embedded. Compressed text is decoded (see
+    text_compression.py).
+    """
+    text_compression.register_text_function(conn)
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, chapter, section_title, kb_text(content), kb_text(symptoms),
+                   kb_text(treatment), kb_text(prevention),
+                   embedding IS NOT NULL OR duplicate_of IS NOT NULL, embedding_hash, embedding_model,
+                   embedding_format, embedding_bits IS NOT NULL OR duplicate_of IS NOT NULL
+            FROM manual_sections
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def select_stale_sections(batch, force=False, fmt=quantization.DEFAULT_FORMAT, with_bits=False,
+                          model_name=MODEL_NAME):
+    """Split a page into sections that need embedding and a count of unchanged ones."""
+    ids = []
+    texts = []
+    hashes = []
+    unchanged = 0
+    for section in batch:
+        text = generate_section_text(section)
+        if not text.strip():
+            print(f"  ⚠ Section {section[0]}: Empty text, skipping")
+            continue
+        text_hash = section_text_hash(text)
+        if not needs_embedding(section, text_hash, model_name, force, fmt, with_bits):
+            unchanged += 1
+            continue
+        ids.append(section[0])
+        texts.append(text)
+        hashes.append(text_hash)
+    return ids, texts, hashes, unchanged
+
+
+def write_embeddings(conn, ids, hashes, embeddings, norms,
+                     fmt=quantization.DEFAULT_FORMAT, with_bits=False, model_name=MODEL_NAME):
+    """Store a batch of float32 embeddings in the requested format.
+
+    For quantized formats embedding_norm is the norm of the dequantized
+    vector, so readers can divide by it directly.
+    """
+    blobs, scales, zero_points = quantization.quantize(embeddings, fmt)
+    if fmt != 'float32':
+        norms = np.linalg.norm(quantization.dequantize_matrix(embeddings, fmt), axis=1)
+    if scales is None:
+        scales = zero_points = [None] * len(ids)
+    bits = quantization.sign_bits(embeddings) if with_bits else [None] * len(ids)
+
+    conn.executemany('''
+        UPDATE manual_sections
+        SET embedding = ?, embedding_norm = ?, embedding_hash = ?, embedding_model = ?,
+            embedding_format = ?, embedding_scale = ?, embedding_zero_point = ?,
+            embedding_bits = ?
+        WHERE id = ?
+    ''', [
+        (blob, float(norm), text_hash, model_name, fmt,
+         None if scale is None else float(scale),
+         None if zero_point is None else float(zero_point),
+         None if packed is None else packed.tobytes(),
+         section_id)
+        for section_id, blob, norm, text_hash, scale, zero_point, packed
+        in zip(ids, blobs, norms, hashes, scales, zero_points, bits)
+    ])
+
+
+def normalize_text(text):
+    """Collapse whitespace so formatting-only edits still hit the cache."""
+    return ' '.join(text.split())
+
+
+class EmbeddingCache:
+    """Persistent embedding cache keyed by (model name, normalized text hash).
+
+    Lives in its own SQLite file so it survives create_cacao_db.py deleting
+    and rebuilding cacao_manual.db. Least recently used entries are evicted
+    once the cache grows past max_entries.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Only ever used by one thread at a time (the encoder worker)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_last_used ON embedding_cache(last_used)')
+        self.conn.commit()
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+    def get_many(self, model_name, keys):
+        """Return {key: embedding} for the keys present in the cache."""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        # Stay well below SQLite's bound-parameter limit
+        for i in range(0, len(unique_keys), 500):
+            chunk = unique_keys[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f'SELECT text_hash, embedding FROM embedding_cache '
+                f'WHERE model = ? AND text_hash IN ({placeholders})',
+                [model_name, *chunk],
+            )
+            for text_hash, blob in rows:
+                found[text_hash] = np.frombuffer(blob, dtype=np.float32)
+
+        if found:
+            now = time.time()
+            self.conn.executemany(
+                'UPDATE embedding_cache SET last_used = ? WHERE model = ? AND text_hash = ?',
+                [(now, model_name, text_hash) for text_hash in found],
+            )
+            self.conn.commit()
+
+        self.hits += sum(1 for k in keys if k in found)
+        self.misses += sum(1 for k in keys if k not in found)
+        return found
+
+    def put_many(self, model_name, items):
+        """Store (key, embedding) pairs and evict the oldest entries if over capacity."""
+        now = time.time()
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO embedding_cache (model, text_hash, embedding, last_used) '
+            'VALUES (?, ?, ?, ?)',
+            [(model_name, k, embedding_to_bytes(e), now) for k, e in items],
+        )
+        self.conn.commit()
+        self.evict()
+
+    def evict(self):
+        count = self.conn.execute('SELECT COUNT(*) FROM embedding_cache').fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self.conn.execute('''
+                DELETE FROM embedding_cache WHERE rowid IN (
+                    SELECT rowid FROM embedding_cache ORDER BY last_used LIMIT ?
+                )
+            ''', (overflow,))
+            self.conn.commit()
+            self.evictions += overflow
+
+    @property
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        self.conn.close()
+
+
+def normalize_query(query):
+    """Same key as EmbeddingCache._normalizeQuery in the app."""
+    return re.sub(r'\s+', ' ', query.lower().strip())
+
+
+def warm_query_texts(conn, extra_path=None):
+    """Normalized, de-duplicated queries to precompute, curated list first."""
+    queries = list(WARM_QUERIES)
+    if extra_path:
+        with open(extra_path, encoding='utf-8') as f:
+            queries.extend(line for line in f if not line.startswith('#'))
+    for term, synonym in conn.execute('SELECT term, synonym FROM synonyms ORDER BY id'):
+        queries.extend((term, synonym))
+    return [q for q in dict.fromkeys(normalize_query(q) for q in queries) if q]
+
+
+def build_query_cache(conn, get_model, batch_size, cache=None, extra_path=None, model_name=MODEL_NAME):
+    """Fill query_embeddings with unit-norm float32 vectors; returns (added, total).
+
+    Queries already stored for model_name are kept, entries for other models
+    or no longer in the list are dropped.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS query_embeddings (
+            query TEXT PRIMARY KEY,
+            embedding BLOB NOT NULL,
+            embedding_model TEXT NOT NULL
+        )
+    ''')
+    queries = warm_query_texts(conn, extra_path)
+    stored = {q for (q,) in conn.execute(
+        'SELECT query FROM query_embeddings WHERE embedding_model = ?', (model_name,))}
+    wanted = set(queries)
+    conn.executemany('DELETE FROM query_embeddings WHERE query = ?',
+                     [(q,) for (q,) in conn.execute('SELECT query FROM query_embeddings')
+                      if q not in wanted or q not in stored])
+
+    missing = [q for q in queries if q not in stored]
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        embeddings, _ = embed_texts(batch, get_model, batch_size, cache, model_name)
+        conn.executemany(
+            'INSERT INTO query_embeddings (query, embedding, embedding_model) VALUES (?, ?, ?)',
+            [(q, embedding_to_bytes(e), model_name) for q, e in zip(batch, embeddings)]
+        )
+    return len(missing), len(queries)
+
+
 def embedding_to_bytes(embedding):
     """Convert numpy array to bytes (float32)."""
-    return struct.pack(f'{len(embedding)}f', *embedding.tolist())
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+
+def encode_batch(model, texts, batch_size):
+    """Encode a list of texts and return (embeddings, norms) for the batch."""
+    embeddings = model.encode(
+        texts,
+        batch_size=batch_size,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    )
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1)
+    return embeddings, norms
+
+
+def embed_texts(texts, get_model, batch_size, cache=None, model_name=MODEL_NAME):
+    """Embed texts, serving what it can from the cache (keyed by model_name) and encoding the rest."""
+    if cache is None:
+        return encode_batch(get_model(), texts, batch_size)
+
+    keys = [EmbeddingCache.key(text) for text in texts]
+    cached = cache.get_many(model_name, keys)
+
+    miss_positions = [i for i, k in enumerate(keys) if k not in cached]
+    if miss_positions:
+        miss_embeddings, _ = encode_batch(get_model(), [texts[i] for i in miss_positions], batch_size)
+        fresh = {keys[i]: e for i, e in zip(miss_positions, miss_embeddings)}
+        cache.put_many(model_name, fresh.items())
+        cached.update(fresh)
+
+    embeddings = np.stack([cached[k] for k in keys]).astype(np.float32, copy=False)
+    norms = np.linalg.norm(embeddings, axis=1)
+    return embeddings, norms
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Generate embeddings for manual sections.')
+    parser.add_argument('--db', default=DB_PATH, help='Path to cacao_manual.db')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help=f'Sections per encode/write batch (default: {BATCH_SIZE})')
+    parser.add_argument('--model-name', default=MODEL_NAME,
+                        help='Model to load, recorded with every stored vector and cache entry '
+                             f'(default: {MODEL_NAME})')
+    parser.add_argument('--force', action='store_true',
+                        help='Re-embed every section even if its text and model are unchanged')
+    parser.add_argument('--cache', default=CACHE_PATH, help='Path to the persistent embedding cache')
+    parser.add_argument('--cache-max-entries', type=int, default=CACHE_MAX_ENTRIES,
+                        help=f'Maximum cached embeddings before LRU eviction (default: {CACHE_MAX_ENTRIES})')
+    parser.add_argument('--no-cache', action='store_true', help='Bypass the embedding cache')
+    parser.add_argument('--format', choices=quantization.FORMATS, default=quantization.DEFAULT_FORMAT,
+                        help='Storage format of the embedding column (default: float32, '
+                             'the only format the app currently decodes)')
+    parser.add_argument('--sign-bits', action='store_true',
+                        help='Also store 1-bit sign vectors in embedding_bits for Hamming prefiltering')
+    parser.add_argument('--ivf', action='store_true',
+                        help='Build the IVF approximate nearest-neighbour index (see ivf_index.py)')
+    parser.add_argument('--ivf-lists', type=int, help='Number of IVF lists (default: ~sqrt(N))')
+    parser.add_argument('--chunks', action='store_true',
+                        help='Also embed sliding-window chunks of every section into section_chunks')
+    parser.add_argument('--chunk-window', type=int, default=chunking.WINDOW_WORDS,
+                        help=f'Max words per chunk (default: {chunking.WINDOW_WORDS})')
+    parser.add_argument('--chunk-overlap', type=int, default=chunking.OVERLAP_WORDS,
+                        help=f'Words repeated between consecutive chunks (default: {chunking.OVERLAP_WORDS})')
+    parser.add_argument('--dedup-threshold', type=float,
+                        help='Mark sections whose embeddings have at least this cosine similarity '
+                             'as near-duplicates of one canonical section (see dedup.py)')
+    parser.add_argument('--drop-duplicates', action='store_true',
+                        help='With --dedup-threshold, remove duplicate vectors from the index')
+    parser.add_argument('--reduce-dim', type=int,
+                        help='Fit a PCA projection and store reduced vectors of this many dimensions')
+    parser.add_argument('--reduce-report', action='store_true',
+                        help='Print recall@10 of reduced dimensions against full-dimension search')
+    parser.add_argument('--no-query-cache', action='store_true',
+                        help='Do not precompute the query_embeddings warm cache')
+    parser.add_argument('--warm-queries', metavar='FILE',
+                        help='Extra queries (one per line) to precompute into query_embeddings')
+    parser.add_argument('--server', metavar='URL',
+                        help='Encode through a running embedding_server.py instead of loading the model')
+    parser.add_argument('--wal', action='store_true',
+                        help='Update the database in WAL mode so concurrent readers are never '
+                             'blocked, and checkpoint the log at the end (see atomic_build.py)')
+    parser.add_argument('--profile-json', metavar='PATH',
+                        help='Write per-stage timings, memory, page counts and table sizes as JSON')
+    parser.add_argument('--cprofile', metavar='PATH', help='Dump a cProfile of the run to PATH')
+    parser.add_argument('--reproducible', action='store_true',
+                        help='Vacuum to a canonical layout, record the stage in <db>.manifest.json '
+                             'and skip the run if the database and settings are unchanged')
+    return parser.parse_args(argv)
+
+
+def embedding_inputs(db_path, args):
+    """Hash of the built database plus every setting that changes the embeddings."""
+    build = build_manifest.load_manifest(db_path).get('stages', {}).get('build')
+    return build_manifest.hash_inputs({
+        'build': build['inputs'] if build else build_manifest.file_sha256(db_path),
+        'scripts': build_manifest.hash_files(build_manifest.module_paths(sys.modules[__name__])),
+        'model': args.model_name,
+        'format': args.format,
+        'sign_bits': args.sign_bits,
+        'ivf': args.ivf,
+        'ivf_lists': args.ivf_lists,
+        'query_cache': not args.no_query_cache,
+        'reduce_dim': args.reduce_dim,
+        'wal': args.wal,
+        'dedup': [args.dedup_threshold, args.drop_duplicates] if args.dedup_threshold else None,
+        'chunks': [args.chunk_window, args.chunk_overlap] if args.chunks else None,
+        'warm_queries': build_manifest.file_sha256(args.warm_queries) if args.warm_queries else None,
+    })
+
+
+def main(argv=None, model_factory=load_model):
+    """Run the embedding step; returns a stats dict.
+
+    model_factory(model_name) must return an object with a
+    sentence-transformers compatible encode(); benchmarks pass a local stub
+    together with --model-name, so its vectors are stored under its own name.
+    """
+    args = parse_args(argv)
+    db_path = args.db
+    model_name = args.model_name
+    batch_size = max(1, args.batch_size)
 
-
-def main():
     # Check if database exists
-    if not os.path.exists(DB_PATH):
-        print(f"Error: Database not found at {DB_PATH}")
+    if not os.path.exists(db_path):
+        print(f"Error: Database not found at {db_path}")
         print("Run create_cacao_db.py first to create the database.")
         exit(1)
 
-    print(f"Loading model: {MODEL_NAME}")
-    print("This may take a moment on first run...")
-    model = SentenceTransformer(MODEL_NAME)
-    print(f"Model loaded. Embedding dimension: {model.get_sentence_embedding_dimension()}")
+    if args.reproducible:
+        inputs = embedding_inputs(db_path, args)
+        if not args.force and build_manifest.stage_is_current(db_path, 'embeddings', inputs):
+            print(f"Embeddings in {db_path} are up to date (inputs unchanged), skipping")
+            return {
+                'sections_processed': 0,
+                'sections_unchanged': None,
+                'seconds': 0.0,
+                'sections_per_sec': 0.0,
+                'peak_rss_mb': build_profile.peak_rss_mb(),
+                'cache': None,
+            }
+
+    if args.server:
+        import embedding_server
+        try:
+            client = embedding_server.connect(args.server, model_name)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            exit(1)
+        model_factory = lambda name: client
+
+    cprofile = build_profile.start_cprofile(args.cprofile)
+
+    profiler = build_profile.StageProfiler('generate_embeddings.py')
+    model = None
+    load_seconds = 0.0
+
+    def get_model():
+        nonlocal model, load_seconds
+        if model is None:
+            print(f"Loading model: {model_name}")
+            print("This may take a moment on first run...")
+            load_start = time.perf_counter()
+            model = model_factory(model_name)
+            load_seconds = time.perf_counter() - load_start
+            profiler.add('model_load', load_seconds)
+            print(f"Model loaded. Embedding dimension: {model.get_sentence_embedding_dimension()}")
+        return model
+
+    def timed_encode(texts):
+        # Runs on the encoder thread; model loading is reported separately
+        loaded_before = load_seconds
+        encode_start = time.perf_counter()
+        result = embed_texts(texts, get_model, batch_size, cache, model_name)
+        profiler.add('encode', time.perf_counter() - encode_start - (load_seconds - loaded_before), len(texts))
+        return result
+
+    cache = None if args.no_cache else EmbeddingCache(args.cache, args.cache_max_entries)
 
     # Connect to database
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(db_path)
+    profiler.conn = conn
+    if args.wal:
+        atomic_build.enable_wal(conn)
 
     # Ensure embedding columns exist
-    add_embedding_columns(conn)
-
-    cursor = conn.cursor()
-
-    # Get all sections
-    cursor.execute('''
-        SELECT id, chapter, section_title, content, symptoms, treatment, prevention
-        FROM manual_sections
-    ''')
-    sections = cursor.fetchall()
-
-    print(f"\nGenerating embeddings for {len(sections)} sections...")
-
-    for i, section in enumerate(sections):
-        section_id = section[0]
-        section_title = section[2][:50] if section[2] else 'Unknown'
-
-        # Generate text for embedding
-        text = generate_section_text(section)
-
-        if not text.strip():
-            print(f"  ⚠ Section {section_id}: Empty text, skipping")
-            continue
-
-        # Generate embedding (normalized)
-        embedding = model.encode(text, normalize_embeddings=True)
-
-        # Convert to bytes
-        embedding_bytes = embedding_to_bytes(embedding)
-
-        # Calculate L2 norm (should be 1.0 since we normalized)
-        embedding_norm = float(np.linalg.norm(embedding))
-
-        # Update database
-        cursor.execute('''
-            UPDATE manual_sections
-            SET embedding = ?, embedding_norm = ?
-            WHERE id = ?
-        ''', (embedding_bytes, embedding_norm, section_id))
-
-        print(f"  ✓ [{i+1}/{len(sections)}] Section {section_id}: {section_title}...")
-
-    conn.commit()
+    with profiler.stage('columns'):
+        add_embedding_columns(conn)
+
+    total = conn.execute('SELECT COUNT(*) FROM manual_sections').fetchone()[0]
+
+    print(f"\nGenerating embeddings for {total} sections (batch size {batch_size})...")
+
+    start = time.perf_counter()
+    processed = 0
+    unchanged = 0
+    seen = 0
+
+    def flush(pending):
+        nonlocal processed
+        future, ids, hashes, upto = pending
+        embeddings, norms = future.result()
+        write_start = time.perf_counter()
+        write_embeddings(conn, ids, hashes, embeddings, norms, args.format, args.sign_bits, model_name)
+        profiler.add('write', time.perf_counter() - write_start, len(ids))
+        processed += len(ids)
+        print(f"  ✓ [{upto}/{total}] Batch of {len(ids)} sections")
+
+    # One transaction for the whole run; each batch is written with executemany.
+    # The encoder thread works on batch N while batch N-1 is written and page
+    # N+1 is read.
+    pending = None
+    with conn, ThreadPoolExecutor(max_workers=1) as encoder:
+        with profiler.stage('sections') as stage:
+            for batch in profiler.timed('read', iter_section_batches(conn, batch_size)):
+                seen += len(batch)
+                ids, texts, hashes, skipped = select_stale_sections(
+                    batch, args.force, args.format, args.sign_bits, model_name)
+                unchanged += skipped
+
+                submitted = None
+                if texts:
+                    future = encoder.submit(timed_encode, texts)
+                    submitted = (future, ids, hashes, seen)
+
+                if pending is not None:
+                    flush(pending)
+                pending = submitted
+
+            if pending is not None:
+                flush(pending)
+            stage['rows'] = processed
+
+        chunk_stats = None
+        if args.chunks:
+            with profiler.stage('chunks') as stage:
+                chunk_stats = chunking.build_chunks(conn, get_model, model_name, args.chunk_window,
+                                                    args.chunk_overlap, batch_size, cache)
+                stage['rows'] = chunk_stats['embedded']
+
+        warm_added = warm_total = 0
+        if not args.no_query_cache:
+            with profiler.stage('query_cache') as stage:
+                warm_added, warm_total = build_query_cache(conn, get_model, batch_size, cache,
+                                                           args.warm_queries, model_name)
+                stage['rows'] = warm_added
+
+        with profiler.stage('commit'):
+            conn.commit()
+
+    elapsed = time.perf_counter() - start
+    rate = processed / elapsed if elapsed > 0 else 0.0
+
+    dedup_report = None
+    if args.dedup_threshold:
+        with profiler.stage('dedup'), conn:
+            dedup_report = dedup.deduplicate(conn, args.dedup_threshold, args.drop_duplicates)
+        dedup.print_report(dedup_report)
+    vectors_changed = processed or (dedup_report is not None and dedup_report['dropped'])
+
+    if args.ivf:
+        has_index = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'ivf_centroids'"
+        ).fetchone()
+        if vectors_changed or not has_index or args.ivf_lists:
+            with profiler.stage('ivf'):
+                ivf_index.build_ivf_index(conn, args.ivf_lists, model_name)
+        else:
+            print("IVF index up to date")
+
+    if args.reduce_dim:
+        stored = dim_reduction.load_projection(conn)
+        if vectors_changed or stored is None or len(stored) != args.reduce_dim:
+            with profiler.stage('reduce_dim'):
+                dim_reduction.build_reduced_embeddings(conn, args.reduce_dim, model_name)
+        else:
+            print("Reduced embeddings up to date")
+
+    if args.reduce_report:
+        with profiler.stage('reduce_report'):
+            ids, matrix = dim_reduction.load_matrix(conn)
+            if len(ids) > 1:
+                dims = sorted({*dim_reduction.REPORT_DIMS, *([args.reduce_dim] if args.reduce_dim else [])},
+                              reverse=True)
+                report = dim_reduction.recall_report(matrix, dims,
+                                                     queries=dim_reduction.load_query_vectors(conn))
+                recall_key = next(key for key in report[0] if key.startswith('recall@'))
+                print(f"\nDimension reduction ({recall_key} vs {matrix.shape[1]} dims):")
+                for row in report:
+                    print(f"   {row['method']:<9}{row['dim']:>5} dims  {row[recall_key]:.3f}")
+
+    if args.reproducible:
+        with profiler.stage('vacuum'):
+            conn.execute('VACUUM')
+    if args.wal:
+        with profiler.stage('checkpoint'):
+            log_pages, _ = atomic_build.checkpoint(conn)
+            journal_mode = atomic_build.disable_wal(conn)
+        print(f"Checkpointed {log_pages} WAL pages into {db_path}")
+        if journal_mode.lower() == 'wal':
+            print("  ⚠ Other connections are open; the database stays in WAL mode")
+    profile_report = None
+    if args.profile_json:
+        profile_report = profiler.report(db_path, conn, model=model_name, format=args.format,
+                                         sections_processed=processed, sections_unchanged=unchanged)
     conn.close()
+    if args.reproducible:
+        build_manifest.record_stage(db_path, 'embeddings', inputs, model=model_name,
+                                    format=args.format, sign_bits=args.sign_bits)
+    if cache is not None:
+        cache.close()
 
     print(f"\n{'='*50}")
     print(f"✅ Embeddings generated successfully!")
-    print(f"   Sections processed: {len(sections)}")
+    print(f"   Sections processed: {processed}")
+    print(f"   Sections unchanged: {unchanged}")
+    if chunk_stats is not None:
+        print(f"   Chunks: {chunk_stats['chunks']} for {chunk_stats['sections']} sections "
+              f"({chunk_stats['chunks'] / max(1, chunk_stats['sections']):.1f} per section, "
+              f"max {chunk_stats['max_chunks']}), {chunk_stats['embedded']} newly embedded")
+    if dedup_report is not None:
+        kept = dedup_report['vectors_after'] if args.drop_duplicates else dedup_report['vectors']
+        print(f"   Near-duplicates: {dedup_report['duplicates']} of {dedup_report['vectors']} sections "
+              f"({kept} vectors in the index)")
+    if not args.no_query_cache:
+        print(f"   Warm query cache: {warm_total} queries ({warm_added} newly embedded)")
+    print(f"   Throughput: {rate:.1f} sections/sec ({elapsed:.2f}s)")
+    rss = build_profile.peak_rss_mb()
+    if rss is not None:
+        print(f"   Peak RSS: {rss:.1f} MB")
+    if cache is not None:
+        stats = cache.stats
+        print(f"   Cache: {stats['hits']} hits, {stats['misses']} misses, "
+              f"{stats['evictions']} evicted ({stats['hit_rate']:.0%} hit rate)")
+    print(f"   Model loaded: {'yes' if model is not None else 'no (all cached)'}")
     print(f"   Embedding dimension: {EMBEDDING_DIM}")
-    print(f"   Bytes per embedding: {EMBEDDING_DIM * 4}")
-    print(f"   Database: {DB_PATH}")
+    print(f"   Storage format: {args.format}{' + sign bits' if args.sign_bits else ''}")
+    print(f"   Bytes per embedding: {quantization.bytes_per_vector(args.format, EMBEDDING_DIM)}")
+    print(f"   Database: {db_path}")
     print(f"{'='*50}")
 
+    build_profile.stop_cprofile(cprofile, args.cprofile)
+    if profile_report is not None:
+        profile_report['cache'] = cache.stats if cache is not None else None
+        build_profile.print_stages(profile_report)
+        build_profile.write_report(args.profile_json, profile_report)
+        print(f"Profile written to {args.profile_json}")
+
+    return {
+        'sections_processed': processed,
+        'sections_unchanged': unchanged,
+        'seconds': elapsed,
+        'sections_per_sec': rate,
+        'peak_rss_mb': rss,
+        'cache': cache.stats if cache is not None else None,
+    }
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+IVF (inverted file) approximate nearest-neighbour index stored in the KB database.
+
+Section embeddings are clustered with spherical k-means. The centroids go in
+`ivf_centroids` and the members of each cluster in `ivf_lists`, clustered
+by centroid id so one list is one contiguous range scan. A reader scores the
+query against the (few) centroids, picks the nprobe closest lists and only
+re-ranks the sections in those lists, instead of every embedding or only
+FTS hits.
+
+Index parameters are recorded in `kb_metadata` (ivf_* keys).
+
+Usage:
+    python scripts/generate_embeddings.py --ivf              # build after embedding
+    python scripts/ivf_index.py --db path/to/cacao_manual.db --lists 64
+"""
+
+import argparse
+import os
+import sqlite3
+import numpy as np
+
+import quantization
+
+DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'assets', 'database', 'cacao_manual.db')
+KMEANS_ITERATIONS = 20
+TRAIN_SAMPLE = 50_000
+PAGE_SIZE = 4096
+DEFAULT_NPROBE = 4
+
+
+def ensure_metadata_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS kb_metadata (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+
+def set_metadata(conn, values):
+    ensure_metadata_table(conn)
+    conn.executemany(
+        'INSERT OR REPLACE INTO kb_metadata (key, value) VALUES (?, ?)',
+        [(key, str(value)) for key, value in values.items()]
+    )
+
+
+def iter_embedding_pages(conn, page_size=PAGE_SIZE):
+    """Yield (ids, float32 matrix) pages of stored embeddings, in id order."""
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, embedding, embedding_format, embedding_scale, embedding_zero_point
+            FROM manual_sections
+            WHERE id > ? AND embedding IS NOT NULL
+            ORDER BY id
+            LIMIT ?
+        ''', (last_id, page_size)).fetchall()
+        if not rows:
+            return
+        ids = [row[0] for row in rows]
+        matrix = np.vstack([quantization.dequantize(*row[1:]) for row in rows])
+        yield ids, normalize_rows(matrix)
+        last_id = ids[-1]
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def sample_embeddings(conn, limit, seed=0):
+    """Reservoir-sample up to limit normalized embeddings without loading them all."""
+    rng = np.random.default_rng(seed)
+    sample = []
+    seen = 0
+    for _, matrix in iter_embedding_pages(conn):
+        for row in matrix:
+            if len(sample) < limit:
+                sample.append(row)
+            else:
+                j = rng.integers(0, seen + 1)
+                if j < limit:
+                    sample[j] = row
+            seen += 1
+    if not sample:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.vstack(sample)
+
+
+def spherical_kmeans(vectors, n_lists, iterations=KMEANS_ITERATIONS, seed=0):
+    """Cluster unit vectors by cosine similarity; returns unit-norm centroids."""
+    rng = np.random.default_rng(seed)
+    n_lists = max(1, min(n_lists, len(vectors)))
+    centroids = vectors[rng.choice(len(vectors), size=n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=n_lists)
+
+        # Re-seed empty clusters with random points so no list is wasted
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), size=len(empty))]
+
+        new_centroids = normalize_rows(sums)
+        if np.allclose(new_centroids, centroids, atol=1e-6):
+            centroids = new_centroids
+            break
+        centroids = new_centroids
+
+    return centroids
+
+
+def default_list_count(n_vectors):
+    """Rule of thumb: about sqrt(N) lists."""
+    return max(1, int(round(np.sqrt(n_vectors))))
+
+
+def build_ivf_index(conn, n_lists=None, model_name=None, train_sample=TRAIN_SAMPLE):
+    """(Re)build ivf_centroids / ivf_lists from the stored embeddings."""
+    n_vectors = conn.execute(
+        'SELECT COUNT(*) FROM manual_sections WHERE embedding IS NOT NULL'
+    ).fetchone()[0]
+    if n_vectors == 0:
+        print("No embeddings stored; skipping IVF index")
+        return None
+
+    n_lists = min(n_lists or default_list_count(n_vectors), n_vectors)
+    training = sample_embeddings(conn, train_sample)
+    centroids = spherical_kmeans(training, n_lists)
+    n_lists = len(centroids)
+
+    with conn:
+        conn.execute('DROP TABLE IF EXISTS ivf_lists')
+        conn.execute('DROP TABLE IF EXISTS ivf_centroids')
+        conn.execute('''
+            CREATE TABLE ivf_centroids (
+                id INTEGER PRIMARY KEY,
+                centroid BLOB NOT NULL,
+                list_size INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE ivf_lists (
+                centroid_id INTEGER NOT NULL,
+                section_id INTEGER NOT NULL,
+                PRIMARY KEY (centroid_id, section_id)
+            ) WITHOUT ROWID
+        ''')
+
+        sizes = np.zeros(n_lists, dtype=np.int64)
+        for ids, matrix in iter_embedding_pages(conn):
+            assignment = np.argmax(matrix @ centroids.T, axis=1)
+            sizes += np.bincount(assignment, minlength=n_lists)
+            conn.executemany(
+                'INSERT INTO ivf_lists (centroid_id, section_id) VALUES (?, ?)',
+                [(int(c), section_id) for c, section_id in zip(assignment, ids)]
+            )
+
+        conn.executemany(
+            'INSERT INTO ivf_centroids (id, centroid, list_size) VALUES (?, ?, ?)',
+            [(i, centroid.tobytes(), int(size)) for i, (centroid, size) in enumerate(zip(centroids, sizes))]
+        )
+        set_metadata(conn, {
+            'ivf_lists': n_lists,
+            'ivf_dim': centroids.shape[1],
+            'ivf_vectors': n_vectors,
+            'ivf_model': model_name or '',
+        })
+
+    largest = int(sizes.max()) if len(sizes) else 0
+    print(f"IVF index: {n_lists} lists over {n_vectors} vectors "
+          f"(avg {n_vectors / n_lists:.1f}, largest {largest})")
+    return {'lists': n_lists, 'vectors': n_vectors, 'largest_list': largest}
+
+
+def load_centroids(conn):
+    rows = conn.execute('SELECT id, centroid FROM ivf_centroids ORDER BY id').fetchall()
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    return ids, np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+
+
+def search_ivf(conn, query, k=10, nprobe=DEFAULT_NPROBE, centroids=None):
+    """Approximate top-k (section_id, cosine) pairs for a query vector.
+
+    Pass a preloaded (ids, matrix) tuple from load_centroids() as centroids
+    to avoid re-reading them for every query.
+    """
+    query = np.asarray(query, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+    centroid_ids, centroid_matrix = centroids or load_centroids(conn)
+
+    nprobe = min(nprobe, len(centroid_ids))
+    probe = centroid_ids[np.argsort(-(centroid_matrix @ query))[:nprobe]]
+    placeholders = ','.join('?' * len(probe))
+    rows = conn.execute(f'''
+        SELECT ms.id, ms.embedding, ms.embedding_format, ms.embedding_scale,
+               ms.embedding_zero_point, ms.embedding_norm
+        FROM ivf_lists l
+        JOIN manual_sections ms ON ms.id = l.section_id
+        WHERE l.centroid_id IN ({placeholders})
+    ''', [int(c) for c in probe]).fetchall()
+    if not rows:
+        return []
+
+    matrix = np.vstack([quantization.dequantize(*row[1:5]) for row in rows])
+    norms = np.array([row[5] or 1.0 for row in rows], dtype=np.float32)
+    scores = (matrix @ query) / norms
+    order = np.argsort(-scores)[:k]
+    return [(rows[i][0], float(scores[i])) for i in order]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the IVF index inside a KB database.')
+    parser.add_argument('--db', default=DB_PATH, help='Path to cacao_manual.db')
+    parser.add_argument('--lists', type=int, help='Number of inverted lists (default: ~sqrt(N))')
+    parser.add_argument('--train-sample', type=int, default=TRAIN_SAMPLE,
+                        help=f'Max vectors used to train k-means (default: {TRAIN_SAMPLE})')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        build_ivf_index(conn, args.lists, train_sample=args.train_sample)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,652 @@
+#!/usr/bin/env python3
+"""
+Row-level delta packages between two built knowledge-base databases.
+
+Instead of downloading a whole new cacao_manual.db, a device can fetch a
+delta package and patch the database it already has. Sections are matched
+by their stable key (chapter + section title) and compared by a hash of
+their stored columns and tag names, so only inserted, updated and deleted
+rows travel, together with their embeddings. A kept section whose id
+changed (ids shift when an earlier section is removed) travels as an
+(old id, new id) move: apply renumbers the row it already has, with its
+tags and chunks, instead of receiving it again. Tags, synonyms, ML mappings
+and kb_metadata are diffed the same way.
+
+Tables derived from the embeddings that apply cannot rebuild on the device
+(SIDE_TABLES: the PCA projection, the sliding-window chunks and the
+precomputed query embeddings) are diffed row by row on their key. A table
+whose schema changed, or that the base does not have, is replaced as a
+whole; one the target no longer has is dropped. Refitting the projection
+rewrites every embedding_reduced, so its new matrix always travels with
+those rows.
+
+The package is a small SQLite file (gzip-compressed for transport) whose
+delta_* tables are ATTACHed by the apply routine and merged with set-based
+statements. The manual_sections triggers keep manual_fts in step with the
+patched rows; derived tables (ml_class_sections, tag_postings,
+ml_answer_bundles and the IVF index if present) are rebuilt afterwards.
+
+Every package records a digest of its base and target section state: apply
+refuses a database that is not the base version and verifies the result,
+and does the same for every side table the delta patches. The delta is
+applied to a copy of the database, which only replaces it once it matches
+the target (see atomic_build.py), so a failing delta leaves it untouched.
+
+Usage:
+    python scripts/kb_delta.py create old.db new.db update.kbdelta.gz
+    python scripts/kb_delta.py apply assets/database/cacao_manual.db update.kbdelta.gz
+"""
+
+import argparse
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+
+import atomic_build
+import create_cacao_db
+import text_compression
+
+DELTA_FORMAT = 3
+
+# {table: key columns} of the derived tables shipped row by row
+SIDE_TABLES = {
+    'embedding_projection': ('id',),
+    'query_embeddings': ('query',),
+    'section_chunks': ('section_id', 'chunk_index'),
+}
+
+# Columns that differ between otherwise identical builds
+IGNORED_COLUMNS = ('id', 'created_at')
+
+# kb_metadata keys that change the FTS table itself; a delta cannot patch those
+FTS_METADATA_KEYS = ('fts_tokenize', 'fts_prefix', 'fts_columns')
+
+
+def section_columns(conn):
+    """[(name, declared type)] of the manual_sections columns a delta carries."""
+    return [(row[1], row[2]) for row in conn.execute('PRAGMA table_info(manual_sections)')
+            if row[1] not in IGNORED_COLUMNS]
+
+
+def section_states(conn, columns):
+    """{key: (id, row hash)} for every section.
+
+    Repeated chapter/title pairs get an occurrence number so keys stay unique.
+    """
+    names = ', '.join('ms.' + c for c in columns)
+    states = {}
+    for row in conn.execute(f'''
+        SELECT ms.id, ms.chapter, ms.section_title, {names},
+               (SELECT group_concat(name, ',') FROM (
+                    SELECT t.name FROM section_tags st JOIN tags t ON t.id = st.tag_id
+                    WHERE st.section_id = ms.id ORDER BY t.name))
+        FROM manual_sections ms ORDER BY ms.id
+    '''):
+        base_key = f'{row[1]}\x1f{row[2]}'
+        key, n = base_key, 1
+        while key in states:
+            n += 1
+            key = f'{base_key}\x1f{n}'
+        digest = hashlib.sha256(repr(row[3:]).encode('utf-8')).hexdigest()
+        states[key] = (row[0], digest)
+    return states
+
+
+def state_digest(states):
+    """One hash over (key, id, row hash) of every section."""
+    h = hashlib.sha256()
+    for key in sorted(states):
+        section_id, digest = states[key]
+        h.update(f'{key}\x1e{section_id}\x1e{digest}\n'.encode('utf-8'))
+    return h.hexdigest()
+
+
+def read_metadata(conn):
+    try:
+        return dict(conn.execute('SELECT key, value FROM kb_metadata').fetchall())
+    except sqlite3.OperationalError:
+        return {}
+
+
+def diff_sections(old_states, new_states):
+    """Return (insert ids, update ids, delete ids, [(old id, new id)] moves).
+
+    Ids refer to the new DB for inserts and updates, the old DB for deletes.
+    A section whose id changed is a move; if its content changed too it is
+    also an update of its new id.
+    """
+    inserts, updates, deletes, moves = [], [], [], []
+    for key, (new_id, new_hash) in new_states.items():
+        old = old_states.get(key)
+        if old is None:
+            inserts.append(new_id)
+            continue
+        if old[0] != new_id:
+            moves.append((old[0], new_id))
+        if old[1] != new_hash:
+            updates.append(new_id)
+    deletes.extend(old_id for key, (old_id, _) in old_states.items() if key not in new_states)
+    return sorted(inserts), sorted(updates), sorted(deletes), sorted(moves)
+
+
+def _create_delta_schema(delta, columns):
+    column_defs = ',\n'.join(f'{name} {decl}' for name, decl in columns)
+    delta.executescript(f'''
+        CREATE TABLE delta_info (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE delta_columns (position INTEGER PRIMARY KEY, name TEXT, decl TEXT);
+        CREATE TABLE delta_sections (
+            op TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            {column_defs}
+        );
+        CREATE TABLE delta_moves (old_id INTEGER PRIMARY KEY, new_id INTEGER NOT NULL);
+        CREATE TABLE delta_section_tags (section_id INTEGER NOT NULL, tag_name TEXT NOT NULL);
+        CREATE TABLE delta_tags (op TEXT NOT NULL, name TEXT NOT NULL);
+        CREATE TABLE delta_synonyms (op TEXT NOT NULL, term TEXT NOT NULL, synonym TEXT NOT NULL);
+        CREATE TABLE delta_ml_mappings (
+            op TEXT NOT NULL,
+            ml_class_id TEXT NOT NULL,
+            ml_class_label TEXT,
+            section_ids TEXT,
+            confidence_threshold REAL
+        );
+        CREATE TABLE delta_metadata (op TEXT NOT NULL, key TEXT NOT NULL, value TEXT);
+        CREATE TABLE delta_tables (
+            name TEXT PRIMARY KEY,
+            mode TEXT NOT NULL,
+            sql TEXT,
+            key_columns TEXT,
+            columns TEXT,
+            base_digest TEXT,
+            target_digest TEXT
+        );
+    ''')
+
+
+def _set_diff(old_rows, new_rows):
+    old_rows, new_rows = set(old_rows), set(new_rows)
+    return ([('insert', *row) for row in sorted(new_rows - old_rows, key=repr)] +
+            [('delete', *row) for row in sorted(old_rows - new_rows, key=repr)])
+
+
+def _table_sql(conn, name, schema='main'):
+    row = conn.execute(f"SELECT sql FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?",
+                       (name,)).fetchone()
+    return row[0] if row else None
+
+
+def _side_columns(conn, name, keys, schema='main'):
+    """Columns of a side table that a delta compares (surrogate ids are ignored)."""
+    return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info({name})')
+            if row[1] not in IGNORED_COLUMNS or row[1] in keys]
+
+
+def table_digest(conn, name, keys, columns, schema='main'):
+    """Hash of a side table's rows in key order."""
+    h = hashlib.sha256()
+    for row in conn.execute(f'SELECT {", ".join(columns)} FROM {schema}.{name} ORDER BY {", ".join(keys)}'):
+        h.update(repr(row).encode('utf-8') + b'\n')
+    return h.hexdigest()
+
+
+def _moved_side_table(delta, name, keys):
+    """(schema, table) of base.name as apply sees it once sections are moved.
+
+    Tables keyed by section_id follow the section moves and lose the rows of
+    deleted sections, the same way _move_sections() patches them.
+    """
+    if 'section_id' not in keys:
+        return 'base', name
+    view = f'moved_{name}'
+    select_list = ', '.join('COALESCE(m.new_id, t.section_id) AS section_id' if column == 'section_id'
+                            else f't.{column}' for column in _side_columns(delta, name, keys, 'base'))
+    delta.execute(f'''
+        CREATE TEMP VIEW {view} AS
+        SELECT {select_list} FROM base.{name} t
+        LEFT JOIN delta_moves m ON m.old_id = t.section_id
+        WHERE t.section_id NOT IN (SELECT id FROM delta_sections WHERE op = 'delete')
+    ''')
+    return 'temp', view
+
+
+def _diff_side_table(delta, name, keys):
+    """Ship the changes of one side table between base and src; returns (mode, rows shipped) or None."""
+    new_sql, old_sql = _table_sql(delta, name, 'src'), _table_sql(delta, name, 'base')
+    if new_sql is None:
+        if old_sql is None:
+            return None
+        delta.execute("INSERT INTO delta_tables (name, mode) VALUES (?, 'drop')", (name,))
+        return 'drop', 0
+
+    columns = _side_columns(delta, name, keys, 'src')
+    column_list, key_list = ', '.join(columns), ', '.join(keys)
+    rows_table = f'delta_rows_{name}'
+    delta.execute(f'CREATE TABLE {rows_table} AS SELECT NULL AS op, {column_list} FROM src.{name} WHERE 0')
+    base_digest = None
+    if old_sql == new_sql:
+        mode = 'patch'
+        base_schema, base_name = _moved_side_table(delta, name, keys)
+        base_digest = table_digest(delta, base_name, keys, columns, base_schema)
+        delta.execute(f'''
+            INSERT INTO {rows_table} (op, {column_list})
+            SELECT 'upsert', * FROM (SELECT {column_list} FROM src.{name}
+                                     EXCEPT SELECT {column_list} FROM {base_schema}.{base_name})
+        ''')
+        delta.execute(f'''
+            INSERT INTO {rows_table} (op, {key_list})
+            SELECT 'delete', * FROM (SELECT {key_list} FROM {base_schema}.{base_name}
+                                     EXCEPT SELECT {key_list} FROM src.{name})
+        ''')
+    else:
+        mode = 'replace'
+        delta.execute(f"INSERT INTO {rows_table} (op, {column_list}) SELECT 'upsert', {column_list} FROM src.{name}")
+
+    shipped = delta.execute(f'SELECT COUNT(*) FROM {rows_table}').fetchone()[0]
+    if mode == 'patch' and not shipped:
+        delta.execute(f'DROP TABLE {rows_table}')
+        return None
+    delta.execute('INSERT INTO delta_tables VALUES (?, ?, ?, ?, ?, ?, ?)', (
+        name, mode, new_sql, ','.join(keys), ','.join(columns), base_digest,
+        table_digest(delta, name, keys, columns, 'src')))
+    return mode, shipped
+
+
+def _apply_side_tables(conn):
+    """Patch, replace or drop the side tables listed in the attached delta."""
+    for name, mode, sql, key_columns, columns in conn.execute(
+            'SELECT name, mode, sql, key_columns, columns FROM d.delta_tables ORDER BY name').fetchall():
+        if mode in ('drop', 'replace'):
+            conn.execute(f'DROP TABLE IF EXISTS {name}')
+        if mode == 'drop':
+            continue
+        if mode == 'replace':
+            conn.execute(sql)
+        rows_table = f'd.delta_rows_{name}'
+        key_list = ', '.join(key_columns.split(','))
+        column_list = ', '.join(columns.split(','))
+        conn.execute(f'''
+            DELETE FROM {name} WHERE ({key_list}) IN (
+                SELECT {key_list} FROM {rows_table} WHERE op = 'delete')
+        ''')
+        conn.execute(f'''
+            INSERT OR REPLACE INTO {name} ({column_list})
+            SELECT {column_list} FROM {rows_table} WHERE op = 'upsert'
+        ''')
+
+
+def _side_table_problems(conn, when):
+    """Side tables of the attached delta whose digest differs from its base or target state."""
+    problems = []
+    for name, key_columns, columns, base, target in conn.execute('''
+        SELECT name, key_columns, columns, base_digest, target_digest FROM d.delta_tables
+        WHERE mode != 'drop'
+    ''').fetchall():
+        expected = base if when == 'base' else target
+        if expected is None:
+            continue
+        if not _has_table(conn, name) or table_digest(
+                conn, name, key_columns.split(','), columns.split(',')) != expected:
+            problems.append(name)
+    return problems
+
+
+def create_delta(old_db, new_db, package_path):
+    """Write the delta turning old_db into new_db; returns a summary dict."""
+    old = sqlite3.connect(old_db)
+    new = sqlite3.connect(new_db)
+    fd, delta_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        if text_compression.is_compressed(old) or text_compression.is_compressed(new):
+            raise ValueError("Compressed text columns; decompress both databases (text_compression.py "
+                             "--decompress) before building a delta")
+        old_meta, new_meta = read_metadata(old), read_metadata(new)
+        changed = [k for k in FTS_METADATA_KEYS if old_meta.get(k) != new_meta.get(k)]
+        if changed:
+            raise ValueError(f"FTS configuration changed ({', '.join(changed)}); ship the full database")
+
+        columns = section_columns(new)
+        names = [name for name, _ in columns]
+        old_columns = {name for name, _ in section_columns(old)}
+        base_columns = [n for n in names if n in old_columns]
+        base_states = section_states(old, base_columns)
+        new_states = section_states(new, names)
+        # Hashes only compare when both sides cover the same columns; a new
+        # column (e.g. the first embeddings) turns every kept section into an update
+        old_states = base_states
+        if old_columns != set(names):
+            old_states = {k: (i, None) for k, (i, _) in base_states.items()}
+        inserts, updates, deletes, moves = diff_sections(old_states, new_states)
+
+        delta = sqlite3.connect(delta_path)
+        _create_delta_schema(delta, columns)
+        delta.execute('ATTACH DATABASE ? AS src', (new_db,))
+        delta.execute('CREATE TEMP TABLE shipped (id INTEGER PRIMARY KEY, op TEXT)')
+        delta.executemany('INSERT INTO shipped VALUES (?, ?)',
+                          [(i, 'insert') for i in inserts] + [(i, 'update') for i in updates])
+        column_list = ', '.join(names)
+        delta.execute(f'''
+            INSERT INTO delta_sections (op, id, {column_list})
+            SELECT s.op, ms.id, {', '.join('ms.' + n for n in names)}
+            FROM shipped s JOIN src.manual_sections ms ON ms.id = s.id
+            ORDER BY ms.id
+        ''')
+        delta.executemany('INSERT INTO delta_sections (op, id) VALUES (?, ?)',
+                          [('delete', i) for i in deletes])
+        delta.executemany('INSERT INTO delta_moves VALUES (?, ?)', moves)
+        delta.execute('''
+            INSERT INTO delta_section_tags (section_id, tag_name)
+            SELECT st.section_id, t.name
+            FROM shipped s
+            JOIN src.section_tags st ON st.section_id = s.id
+            JOIN src.tags t ON t.id = st.tag_id
+        ''')
+        delta.executemany('INSERT INTO delta_columns VALUES (?, ?, ?)',
+                          [(i, name, decl) for i, (name, decl) in enumerate(columns)])
+
+        delta.executemany('INSERT INTO delta_tags VALUES (?, ?)', _set_diff(
+            old.execute('SELECT name FROM tags'), new.execute('SELECT name FROM tags')))
+        delta.executemany('INSERT INTO delta_synonyms VALUES (?, ?, ?)', _set_diff(
+            old.execute('SELECT term, synonym FROM synonyms'),
+            new.execute('SELECT term, synonym FROM synonyms')))
+
+        mapping_sql = '''SELECT ml_class_id, ml_class_label, section_ids, confidence_threshold
+                         FROM ml_to_manual_mapping'''
+        old_mappings = {row[0]: row for row in old.execute(mapping_sql)}
+        new_mappings = {row[0]: row for row in new.execute(mapping_sql)}
+        delta.executemany('INSERT INTO delta_ml_mappings VALUES (?, ?, ?, ?, ?)',
+                          [('upsert', *row) for key, row in sorted(new_mappings.items())
+                           if old_mappings.get(key) != row] +
+                          [('delete', key, None, None, None) for key in sorted(old_mappings)
+                           if key not in new_mappings])
+        delta.executemany('INSERT INTO delta_metadata VALUES (?, ?, ?)',
+                          [('upsert', k, v) for k, v in sorted(new_meta.items()) if old_meta.get(k) != v] +
+                          [('delete', k, None) for k in sorted(old_meta) if k not in new_meta])
+
+        delta.execute('ATTACH DATABASE ? AS base', (old_db,))
+        side_tables = {name: change for name, keys in SIDE_TABLES.items()
+                       if (change := _diff_side_table(delta, name, keys)) is not None}
+        delta.commit()
+        delta.execute('DETACH DATABASE base')
+
+        delta.executemany('INSERT INTO delta_info VALUES (?, ?)', [
+            ('format', str(DELTA_FORMAT)),
+            ('base_digest', state_digest(base_states)),
+            ('base_columns', ','.join(base_columns)),
+            ('target_digest', state_digest(new_states)),
+            ('has_ivf', str(int(_has_table(new, 'ivf_centroids')))),
+        ])
+        delta.commit()
+        delta.execute('DETACH DATABASE src')
+        delta.execute('VACUUM')
+        delta.close()
+
+        with open(delta_path, 'rb') as src, gzip.open(package_path, 'wb', compresslevel=9) as dst:
+            shutil.copyfileobj(src, dst)
+
+        summary = {
+            'inserted': len(inserts),
+            'updated': len(updates),
+            'deleted': len(deletes),
+            'moved': len(moves),
+            'unchanged': len(new_states) - len(inserts) - len(updates),
+            'side_tables': side_tables,
+            'delta_bytes': os.path.getsize(package_path),
+            'full_bytes': os.path.getsize(new_db),
+            'full_gzip_bytes': _gzip_size(new_db),
+        }
+        return summary
+    finally:
+        old.close()
+        new.close()
+        os.remove(delta_path)
+
+
+def _gzip_size(path):
+    """Compressed size of a file, streamed so large DBs are not held in memory."""
+    compressor_out = _CountingWriter()
+    with open(path, 'rb') as src, gzip.GzipFile(fileobj=compressor_out, mode='wb', compresslevel=9) as dst:
+        shutil.copyfileobj(src, dst)
+    return compressor_out.size
+
+
+class _CountingWriter:
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def _has_table(conn, name, schema='main'):
+    return conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?",
+                        (name,)).fetchone() is not None
+
+
+def _has_fts_triggers(conn):
+    return conn.execute('''
+        SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'
+        AND name IN ('manual_sections_ai', 'manual_sections_ad', 'manual_sections_au')
+    ''').fetchone()[0] == 3
+
+
+def apply_delta(db_path, package_path):
+    """Patch db_path with a delta package; returns the row counts applied.
+
+    The patch and the derived-table rebuilds run on a copy next to db_path,
+    which is swapped into place only after it verified against the target.
+    """
+    build_path = atomic_build.temp_build_path(db_path)
+    atomic_build.remove_database_files(build_path)
+    source, copy = sqlite3.connect(db_path), sqlite3.connect(build_path)
+    try:
+        source.backup(copy)
+    finally:
+        source.close()
+        copy.close()
+    try:
+        counts = _patch_database(build_path, package_path, db_path)
+        atomic_build.swap_into_place(build_path, db_path)
+    except BaseException:
+        atomic_build.remove_database_files(build_path)
+        raise
+    return counts
+
+
+def _move_sections(conn):
+    """Delete the delta's removed sections and give moved ones their new ids.
+
+    Moved rows are re-inserted under their new id so the manual_sections
+    triggers move their manual_fts rows too; their tags and the side tables
+    keyed by section_id follow them.
+    """
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(manual_sections)') if row[1] != 'id']
+    column_list = ', '.join(columns)
+    conn.execute(f'''
+        CREATE TEMP TABLE moved_sections AS
+        SELECT m.new_id AS id, {', '.join('ms.' + c for c in columns)}
+        FROM d.delta_moves m JOIN manual_sections ms ON ms.id = m.old_id
+    ''')
+    conn.execute('''
+        CREATE TEMP TABLE moved_section_tags AS
+        SELECT m.new_id AS section_id, st.tag_id
+        FROM d.delta_moves m JOIN section_tags st ON st.section_id = m.old_id
+    ''')
+    removed = "SELECT old_id FROM d.delta_moves UNION ALL SELECT id FROM d.delta_sections WHERE op = 'delete'"
+    conn.execute(f'DELETE FROM section_tags WHERE section_id IN ({removed})')
+    conn.execute(f'DELETE FROM manual_sections WHERE id IN ({removed})')
+    conn.execute(f'''
+        INSERT INTO manual_sections (id, {column_list})
+        SELECT id, {column_list} FROM temp.moved_sections ORDER BY id
+    ''')
+    conn.execute('INSERT INTO section_tags (section_id, tag_id) SELECT section_id, tag_id FROM temp.moved_section_tags')
+    conn.execute('DROP TABLE temp.moved_sections')
+    conn.execute('DROP TABLE temp.moved_section_tags')
+
+    for name, keys in SIDE_TABLES.items():
+        if 'section_id' not in keys or not _has_table(conn, name):
+            continue
+        conn.execute(f"DELETE FROM {name} WHERE section_id IN "
+                     f"(SELECT id FROM d.delta_sections WHERE op = 'delete')")
+        # Negative ids first so no row collides with a moved row's new id
+        conn.execute(f'''
+            UPDATE {name} SET section_id = -(
+                SELECT new_id FROM d.delta_moves WHERE old_id = {name}.section_id)
+            WHERE section_id IN (SELECT old_id FROM d.delta_moves)
+        ''')
+        conn.execute(f'UPDATE {name} SET section_id = -section_id WHERE section_id < 0')
+
+
+def _patch_database(path, package_path, db_path):
+    """Apply a delta package to the copy at path in place and verify the result."""
+    fd, delta_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    conn = sqlite3.connect(path)
+    try:
+        with gzip.open(package_path, 'rb') as src, open(delta_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        if text_compression.is_compressed(conn):
+            raise ValueError(f"{db_path} stores compressed text; decompress it before applying a delta")
+        conn.execute('ATTACH DATABASE ? AS d', (delta_path,))
+        info = dict(conn.execute('SELECT key, value FROM d.delta_info').fetchall())
+        if int(info['format']) != DELTA_FORMAT:
+            raise ValueError(f"Unsupported delta format {info['format']}")
+
+        base_columns = info['base_columns'].split(',')
+        if state_digest(section_states(conn, base_columns)) != info['base_digest']:
+            raise ValueError(f"{db_path} is not the base version of this delta")
+        columns = conn.execute('SELECT name, decl FROM d.delta_columns ORDER BY position').fetchall()
+        existing = {name for name, _ in section_columns(conn)}
+        names = [name for name, _ in columns]
+        column_list = ', '.join(names)
+        counts = dict(conn.execute('SELECT op, COUNT(*) FROM d.delta_sections GROUP BY op').fetchall())
+        counts['move'] = conn.execute('SELECT COUNT(*) FROM d.delta_moves').fetchone()[0]
+
+        with conn:
+            for name, decl in columns:
+                if name not in existing:
+                    conn.execute(f'ALTER TABLE manual_sections ADD COLUMN {name} {decl}')
+
+            # Deletes and moves first, so updates and inserts address target
+            # ids; the manual_sections triggers patch manual_fts row by row
+            _move_sections(conn)
+            stale = _side_table_problems(conn, 'base')
+            if stale:
+                raise ValueError(f"{db_path} is not the base version of this delta ({', '.join(stale)} differ)")
+            conn.execute("DELETE FROM section_tags WHERE section_id IN "
+                         "(SELECT id FROM d.delta_sections WHERE op != 'delete')")
+            conn.execute(f'''
+                UPDATE manual_sections SET ({column_list}) = (
+                    SELECT {column_list} FROM d.delta_sections ds
+                    WHERE ds.op = 'update' AND ds.id = manual_sections.id)
+                WHERE id IN (SELECT id FROM d.delta_sections WHERE op = 'update')
+            ''')
+            conn.execute(f'''
+                INSERT INTO manual_sections (id, {column_list})
+                SELECT id, {column_list} FROM d.delta_sections WHERE op = 'insert' ORDER BY id
+            ''')
+
+            conn.execute("INSERT OR IGNORE INTO tags (name) SELECT name FROM d.delta_tags WHERE op = 'insert'")
+            conn.execute('''
+                INSERT OR IGNORE INTO section_tags (section_id, tag_id)
+                SELECT dst.section_id, t.id FROM d.delta_section_tags dst JOIN tags t ON t.name = dst.tag_name
+            ''')
+            conn.execute('''
+                DELETE FROM section_tags WHERE tag_id IN (
+                    SELECT t.id FROM tags t JOIN d.delta_tags dt ON dt.name = t.name WHERE dt.op = 'delete')
+            ''')
+            conn.execute("DELETE FROM tags WHERE name IN (SELECT name FROM d.delta_tags WHERE op = 'delete')")
+
+            conn.execute('''
+                DELETE FROM synonyms WHERE (term, synonym) IN (
+                    SELECT term, synonym FROM d.delta_synonyms WHERE op = 'delete')
+            ''')
+            conn.execute('''
+                INSERT OR IGNORE INTO synonyms (term, synonym)
+                SELECT term, synonym FROM d.delta_synonyms WHERE op = 'insert'
+            ''')
+
+            conn.execute('''
+                DELETE FROM ml_to_manual_mapping WHERE ml_class_id IN (
+                    SELECT ml_class_id FROM d.delta_ml_mappings WHERE op = 'delete')
+            ''')
+            conn.execute('''
+                INSERT OR REPLACE INTO ml_to_manual_mapping
+                (ml_class_id, ml_class_label, section_ids, confidence_threshold)
+                SELECT ml_class_id, ml_class_label, section_ids, confidence_threshold
+                FROM d.delta_ml_mappings WHERE op = 'upsert'
+            ''')
+
+            conn.execute("DELETE FROM kb_metadata WHERE key IN "
+                         "(SELECT key FROM d.delta_metadata WHERE op = 'delete')")
+            conn.execute('''
+                INSERT OR REPLACE INTO kb_metadata (key, value)
+                SELECT key, value FROM d.delta_metadata WHERE op = 'upsert'
+            ''')
+            _apply_side_tables(conn)
+            stale = _side_table_problems(conn, 'target')
+
+        conn.execute('DETACH DATABASE d')
+        if not _has_fts_triggers(conn):
+            create_cacao_db.rebuild_fts(conn)
+        create_cacao_db.sync_ml_class_sections(conn)
+        create_cacao_db.build_tag_postings(conn)
+        create_cacao_db.build_answer_bundles(conn)
+        if info.get('has_ivf') == '1' or _has_table(conn, 'ivf_centroids'):
+            import ivf_index
+            ivf_index.build_ivf_index(conn)
+
+        if state_digest(section_states(conn, names)) != info['target_digest'] or stale:
+            raise ValueError(f"{db_path} does not match the target version after applying the delta")
+        conn.execute("INSERT INTO manual_fts(manual_fts) VALUES ('integrity-check')")
+
+        return {
+            'inserted': counts.get('insert', 0),
+            'updated': counts.get('update', 0),
+            'deleted': counts.get('delete', 0),
+            'moved': counts['move'],
+        }
+    finally:
+        conn.close()
+        os.remove(delta_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create or apply KB delta packages.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    create = sub.add_parser('create', help='Diff two built databases into a delta package')
+    create.add_argument('old_db', help='Database the devices have')
+    create.add_argument('new_db', help='Newly built database')
+    create.add_argument('package', help='Output delta package (gzip)')
+    apply = sub.add_parser('apply', help='Patch a database with a delta package')
+    apply.add_argument('db', help='Database to patch')
+    apply.add_argument('package', help='Delta package')
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        summary = create_delta(args.old_db, args.new_db, args.package)
+        print(f"Delta written to {args.package}")
+        print(f"  Sections: {summary['inserted']} inserted, {summary['updated']} updated, "
+              f"{summary['deleted']} deleted, {summary['moved']} moved, {summary['unchanged']} unchanged")
+        for name, (mode, rows) in summary['side_tables'].items():
+            print(f"  {name}: {mode}, {rows} rows shipped")
+        print(f"  Delta size: {summary['delta_bytes'] / 1024:.1f} KB")
+        print(f"  Full DB:    {summary['full_bytes'] / 1024:.1f} KB "
+              f"({summary['full_gzip_bytes'] / 1024:.1f} KB gzipped)")
+        print(f"  Delta is {100.0 * summary['delta_bytes'] / max(1, summary['full_gzip_bytes']):.1f}% "
+              f"of the gzipped full download")
+    else:
+        counts = apply_delta(args.db, args.package)
+        print(f"Applied delta to {args.db}: {counts['inserted']} inserted, "
+              f"{counts['updated']} updated, {counts['deleted']} deleted, {counts['moved']} moved")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Offline retrieval engine over cacao_manual.db, mirroring the app's search.
+
+Hybrid mode reproduces the Dart path: expand the query with the synonyms
+table (like CacaoManualLocalDataSource._expandQueryWithSynonyms), take up to
+fts_limit FTS5 candidates and re-rank them by cosine similarity (like
+KnowledgeSearchService.searchHybrid). Vector mode skips FTS and scores the
+whole corpus.
+
+All embeddings are exported once to a contiguous float32 sidecar file
+(<db>.embeddings.npy plus <db>.embeddings.ids.npy) and memory-mapped, so a
+batch of queries is scored with one matrix multiply per block of rows. The
+sidecar is rebuilt automatically when the database file changes.
+
+Near-duplicates whose vectors were dropped by dedup.py have no row in the
+matrix; they are scored with their canonical section's vector when FTS or a
+tag filter selects them. Vector mode returns one section per cluster.
+
+Usage:
+    python scripts/kb_search.py "monilia en la mazorca" "cómo fermentar"
+    python scripts/kb_search.py --queries-file queries.txt --mode vector --k 5
+    python scripts/kb_search.py --mode fts "poda"
+    python scripts/kb_search.py --tags enfermedad,control_químico --facets "hongo"
+    python scripts/kb_search.py --server http://127.0.0.1:8765 "monilia"   # see embedding_server.py
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+import numpy as np
+
+import chunking
+import quantization
+
+DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'assets', 'database', 'cacao_manual.db')
+MODES = ('hybrid', 'vector', 'fts', 'chunks')
+FTS_LIMIT = 150
+TOP_K = 10
+SCORE_BLOCK_ROWS = 65_536
+
+
+def sidecar_paths(db_path):
+    base = os.path.abspath(db_path)
+    return base + '.embeddings.npy', base + '.embeddings.ids.npy', base + '.embeddings.json'
+
+
+def _db_fingerprint(db_path):
+    stat = os.stat(db_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def export_embedding_matrix(conn, db_path, page_size=4096):
+    """Write every stored embedding, dequantized to float32, into the sidecar files."""
+    matrix_path, ids_path, meta_path = sidecar_paths(db_path)
+    rows = conn.execute(
+        'SELECT COUNT(*) FROM manual_sections WHERE embedding IS NOT NULL'
+    ).fetchone()[0]
+    if not rows:
+        raise RuntimeError("No embeddings stored. Run generate_embeddings.py first.")
+
+    first = conn.execute('''
+        SELECT embedding, embedding_format, embedding_scale, embedding_zero_point
+        FROM manual_sections WHERE embedding IS NOT NULL LIMIT 1
+    ''').fetchone()
+    dim = len(quantization.dequantize(*first))
+
+    matrix = np.lib.format.open_memmap(matrix_path, mode='w+', dtype=np.float32, shape=(rows, dim))
+    ids = np.empty(rows, dtype=np.int64)
+
+    position = 0
+    last_id = 0
+    while True:
+        page = conn.execute('''
+            SELECT id, embedding, embedding_format, embedding_scale, embedding_zero_point, embedding_norm
+            FROM manual_sections
+            WHERE id > ? AND embedding IS NOT NULL
+            ORDER BY id
+            LIMIT ?
+        ''', (last_id, page_size)).fetchall()
+        if not page:
+            break
+        block = np.vstack([quantization.dequantize(*row[1:5]) for row in page])
+        # Store unit vectors so a dot product is the cosine the app computes
+        norms = np.array([row[5] or np.linalg.norm(v) or 1.0 for row, v in zip(page, block)],
+                         dtype=np.float32)
+        matrix[position:position + len(page)] = block / norms[:, None]
+        ids[position:position + len(page)] = [row[0] for row in page]
+        position += len(page)
+        last_id = page[-1][0]
+
+    matrix.flush()
+    del matrix
+    np.save(ids_path, ids)
+    with open(meta_path, 'w') as f:
+        json.dump(_db_fingerprint(db_path), f)
+    return rows, dim
+
+
+def load_embedding_matrix(conn, db_path, rebuild=False):
+    """Memory-map the sidecar matrix, exporting it first if missing or stale."""
+    matrix_path, ids_path, meta_path = sidecar_paths(db_path)
+    stale = rebuild or not all(os.path.exists(p) for p in (matrix_path, ids_path, meta_path))
+    if not stale:
+        with open(meta_path) as f:
+            stale = json.load(f) != _db_fingerprint(db_path)
+    if stale:
+        rows, dim = export_embedding_matrix(conn, db_path)
+        print(f"Exported {rows} x {dim} embedding matrix to {matrix_path}")
+    return np.load(ids_path), np.load(matrix_path, mmap_mode='r')
+
+
+def top_k_batch(queries, matrix, k, block_rows=SCORE_BLOCK_ROWS):
+    """Exact top-k rows of matrix for every query: (positions, scores), each (q, k).
+
+    The matrix is scored a block of rows at a time, so a memory-mapped corpus
+    never has to be resident all at once.
+    """
+    n = matrix.shape[0]
+    k = min(k, n)
+    best_pos = np.zeros((len(queries), 0), dtype=np.int64)
+    best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+
+    for start in range(0, n, block_rows):
+        scores = queries @ np.asarray(matrix[start:start + block_rows]).T
+        all_scores = np.hstack([best_scores, scores])
+        all_pos = np.hstack([best_pos, np.arange(start, start + scores.shape[1])[None, :]
+                             .repeat(len(queries), axis=0)])
+        keep = np.argpartition(-all_scores, min(k, all_scores.shape[1]) - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(all_scores, keep, axis=1)
+        best_pos = np.take_along_axis(all_pos, keep, axis=1)
+
+    order = np.argsort(-best_scores, axis=1)
+    return np.take_along_axis(best_pos, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+class KnowledgeBaseSearch:
+    """Hybrid FTS + cosine search over a built knowledge-base database."""
+
+    def __init__(self, db_path=DB_PATH, encoder=None, rebuild_matrix=False):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.encoder = encoder
+        self.rebuild_matrix = rebuild_matrix
+        self._embeddings = None
+        self._synonyms = None
+        self._postings = None
+        self._chunks = None
+        self._canonical = None
+
+    def close(self):
+        self.conn.close()
+
+    def _embedding_matrix(self):
+        # Only the vector and hybrid paths need the matrix, so FTS search works without embeddings
+        if self._embeddings is None:
+            self._embeddings = load_embedding_matrix(self.conn, self.db_path, self.rebuild_matrix)
+        return self._embeddings
+
+    @property
+    def ids(self):
+        """Section id of every matrix row, loaded on first use."""
+        return self._embedding_matrix()[0]
+
+    @property
+    def matrix(self):
+        """Memory-mapped embedding matrix, exported and loaded on first use."""
+        return self._embedding_matrix()[1]
+
+    def _synonym_map(self):
+        if self._synonyms is None:
+            self._synonyms = {}
+            for term, synonym in self.conn.execute('SELECT term, synonym FROM synonyms'):
+                self._synonyms.setdefault(term, []).append(synonym)
+        return self._synonyms
+
+    def expand_query(self, query):
+        """Query terms plus their synonyms, as the app expands them."""
+        synonyms = self._synonym_map()
+        expanded = {}
+        for term in query.lower().split():
+            expanded[term] = None
+            for synonym in synonyms.get(term, []):
+                expanded[synonym] = None
+        return list(expanded)
+
+    def fts_query(self, query):
+        # Quote each term so punctuation and multi-word synonyms are valid FTS5
+        return ' OR '.join('"' + term.replace('"', '""') + '"' for term in self.expand_query(query))
+
+    def fts_candidates(self, query, limit=FTS_LIMIT):
+        return [row[0] for row in self.conn.execute('''
+            SELECT rowid FROM manual_fts WHERE manual_fts MATCH ? ORDER BY rank LIMIT ?
+        ''', (self.fts_query(query), limit))]
+
+    def encode(self, queries):
+        if self.encoder is None:
+            raise RuntimeError("No query encoder configured; use mode='fts' or pass embeddings")
+        embeddings = self.encoder.encode(list(queries), normalize_embeddings=True,
+                                         show_progress_bar=False)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def canonical_map(self):
+        """{dropped duplicate id: canonical id}, see dedup.py."""
+        if self._canonical is None:
+            try:
+                self._canonical = dict(self.conn.execute('''
+                    SELECT id, duplicate_of FROM manual_sections
+                    WHERE duplicate_of IS NOT NULL AND embedding IS NULL
+                '''))
+            except sqlite3.OperationalError:
+                self._canonical = {}
+        return self._canonical
+
+    def resolve(self, section_ids):
+        """(section ids, matrix positions) with dropped duplicates scored by their canonical vector."""
+        section_ids = np.asarray(section_ids, dtype=np.int64)
+        canonical = self.canonical_map()
+        lookup = section_ids
+        if canonical:
+            lookup = np.array([canonical.get(i, i) for i in section_ids.tolist()], dtype=np.int64)
+        if len(self.ids) == 0 or len(lookup) == 0:
+            return section_ids[:0], np.zeros(0, dtype=np.int64)
+        pos = np.clip(np.searchsorted(self.ids, lookup), 0, len(self.ids) - 1)
+        found = self.ids[pos] == lookup
+        return section_ids[found], pos[found]
+
+    def tag_postings(self):
+        """{tag name: sorted section id array}, read once from tag_postings."""
+        if self._postings is None:
+            self._postings = {
+                name: np.frombuffer(blob, dtype='<u4').astype(np.int64)
+                for name, blob in self.conn.execute('''
+                    SELECT t.name, tp.section_ids FROM tag_postings tp JOIN tags t ON t.id = tp.tag_id
+                ''')
+            }
+        return self._postings
+
+    def sections_with_tags(self, tags):
+        """Sorted ids of the sections carrying every one of the given tags."""
+        postings = self.tag_postings()
+        result = None
+        for tag in tags:
+            ids = postings.get(tag, np.zeros(0, dtype=np.int64))
+            result = ids if result is None else np.intersect1d(result, ids, assume_unique=True)
+        return result if result is not None else np.zeros(0, dtype=np.int64)
+
+    def facet_counts(self, section_ids=None):
+        """Number of the given sections (or of all sections) under each tag."""
+        postings = self.tag_postings()
+        if section_ids is None:
+            counts = {tag: len(ids) for tag, ids in postings.items()}
+        else:
+            section_ids = np.unique(np.asarray(list(section_ids), dtype=np.int64))
+            counts = {tag: int(np.intersect1d(ids, section_ids, assume_unique=True).size)
+                      for tag, ids in postings.items()}
+        return dict(sorted(((t, c) for t, c in counts.items() if c), key=lambda item: -item[1]))
+
+    def search(self, queries, k=TOP_K, mode='hybrid', fts_limit=FTS_LIMIT, query_embeddings=None,
+               tags=None):
+        """Return one list of (section_id, score) per query.
+
+        With tags, only sections carrying all of them are returned.
+        """
+        if isinstance(queries, str):
+            queries = [queries]
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode: {mode}")
+        allowed = self.sections_with_tags(tags) if tags else None
+
+        if mode == 'fts':
+            results = []
+            for q in queries:
+                candidates = self.fts_candidates(q, k if allowed is None else fts_limit)
+                if allowed is not None:
+                    allowed_set = set(allowed.tolist())
+                    candidates = [c for c in candidates if c in allowed_set]
+                results.append([(section_id, None) for section_id in candidates[:k]])
+            return results
+
+        if query_embeddings is None:
+            query_embeddings = self.encode(queries)
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+
+        if mode == 'chunks':
+            return self.chunk_search(query_embeddings, k, allowed)
+
+        if mode == 'vector':
+            if allowed is None:
+                positions, scores = top_k_batch(query_embeddings, self.matrix, k)
+            else:
+                subset_ids, subset = self.resolve(allowed)
+                if len(subset) == 0:
+                    return [[] for _ in queries]
+                order = np.argsort(subset, kind='stable')
+                subset_ids, subset = subset_ids[order], subset[order]
+                positions, scores = top_k_batch(query_embeddings, np.asarray(self.matrix[subset]), k)
+                return [[(int(subset_ids[p]), float(s)) for p, s in zip(row_pos, row_scores)]
+                        for row_pos, row_scores in zip(positions, scores)]
+            return [[(int(self.ids[p]), float(s)) for p, s in zip(row_pos, row_scores)]
+                    for row_pos, row_scores in zip(positions, scores)]
+
+        results = []
+        for query, embedding in zip(queries, query_embeddings):
+            candidates = self.fts_candidates(query, fts_limit)
+            if allowed is not None:
+                candidates = np.asarray(candidates, dtype=np.int64)
+                candidates = candidates[np.isin(candidates, allowed, assume_unique=True)]
+            candidate_ids, positions = self.resolve(candidates)
+            if len(positions) == 0:
+                results.append([])
+                continue
+            # Sorted positions keep reads from the memory map sequential
+            by_position = np.argsort(positions, kind='stable')
+            candidate_ids, positions = candidate_ids[by_position], positions[by_position]
+            scores = np.asarray(self.matrix[positions]) @ embedding
+            order = np.argsort(-scores, kind='stable')[:k]
+            results.append([(int(candidate_ids[i]), float(scores[i])) for i in order])
+        return results
+
+    def chunk_search(self, query_embeddings, k=TOP_K, allowed=None):
+        """Rank sections by their best-matching chunk (max-sim over section_chunks)."""
+        if self._chunks is None:
+            self._chunks = chunking.load_chunk_matrix(self.conn)
+        chunk_sections, chunk_matrix = self._chunks
+        if allowed is not None:
+            keep = np.isin(chunk_sections, allowed)
+            chunk_sections, chunk_matrix = chunk_sections[keep], chunk_matrix[keep]
+        if len(chunk_sections) == 0:
+            return [[] for _ in query_embeddings]
+
+        results = []
+        for scores in np.asarray(query_embeddings, dtype=np.float32) @ chunk_matrix.T:
+            sections, section_scores = chunking.max_sim_scores(scores, chunk_sections)
+            order = np.argsort(-section_scores)[:k]
+            results.append([(int(sections[i]), float(section_scores[i])) for i in order])
+        return results
+
+    def titles(self, section_ids):
+        if not section_ids:
+            return {}
+        placeholders = ','.join('?' * len(section_ids))
+        return dict(self.conn.execute(
+            f'SELECT id, section_title FROM manual_sections WHERE id IN ({placeholders})',
+            list(section_ids)))
+
+
+def load_encoder(server=None):
+    """Load the same sentence-transformers model used to embed the sections.
+
+    With a server URL, queries are encoded by a running embedding_server.py.
+    """
+    if server:
+        import embedding_server
+        return embedding_server.EmbeddingClient(server)
+    import generate_embeddings
+    return generate_embeddings.load_model(generate_embeddings.MODEL_NAME)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search cacao_manual.db offline.')
+    parser.add_argument('queries', nargs='*', help='Query strings')
+    parser.add_argument('--db', default=DB_PATH, help='Path to cacao_manual.db')
+    parser.add_argument('--queries-file', help='File with one query per line')
+    parser.add_argument('--mode', choices=MODES, default='hybrid', help='Search mode (default: hybrid)')
+    parser.add_argument('--k', type=int, default=TOP_K, help=f'Results per query (default: {TOP_K})')
+    parser.add_argument('--fts-limit', type=int, default=FTS_LIMIT,
+                        help=f'FTS candidates re-ranked in hybrid mode (default: {FTS_LIMIT})')
+    parser.add_argument('--tags', default='', help='Only return sections with all these comma-separated tags')
+    parser.add_argument('--facets', action='store_true', help='Print tag counts over each result set')
+    parser.add_argument('--server', metavar='URL', help='Encode queries with a running embedding_server.py')
+    parser.add_argument('--rebuild-matrix', action='store_true', help='Re-export the sidecar matrix')
+    parser.add_argument('--quiet', action='store_true', help='Only print the throughput summary')
+    args = parser.parse_args()
+
+    queries = list(args.queries)
+    if args.queries_file:
+        with open(args.queries_file, encoding='utf-8') as f:
+            queries.extend(line.strip() for line in f if line.strip())
+    if not queries:
+        parser.error('no queries given')
+
+    encoder = None if args.mode == 'fts' else load_encoder(args.server)
+    engine = KnowledgeBaseSearch(args.db, encoder, args.rebuild_matrix)
+    try:
+        start = time.perf_counter()
+        embeddings = None if args.mode == 'fts' else engine.encode(queries)
+        encoded = time.perf_counter()
+        tags = [t.strip() for t in args.tags.split(',') if t.strip()]
+        results = engine.search(queries, args.k, args.mode, args.fts_limit, embeddings, tags)
+        elapsed = time.perf_counter() - encoded
+
+        if not args.quiet:
+            titles = engine.titles({sid for hits in results for sid, _ in hits})
+            for query, hits in zip(queries, results):
+                print(f"\n{query}")
+                for section_id, score in hits:
+                    score_text = '' if score is None else f"{score:.4f}  "
+                    print(f"  {score_text}[{section_id}] {titles.get(section_id, '')}")
+                if args.facets:
+                    facets = engine.facet_counts(section_id for section_id, _ in hits)
+                    print('  tags: ' + ', '.join(f"{tag} ({count})" for tag, count in facets.items()))
+
+        print(f"\n{len(queries)} queries, mode={args.mode}: "
+              f"encode {encoded - start:.3f}s, search {elapsed:.3f}s "
+              f"({len(queries) / elapsed if elapsed > 0 else 0:.0f} queries/sec)")
+    finally:
+        engine.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+Streaming loader for knowledge-base content kept in source files.
+
+Instead of the Python literals in create_cacao_db.py, content can live in a
+source directory with this layout:
+
+    source/
+      sections/   *.jsonl or *.md  (searched recursively, in name order)
+      tags/       *.txt (one tag per line) or *.jsonl ({"name": ...})
+      synonyms/   *.jsonl ({"term": ..., "synonym": ...}) or *.tsv
+      ml_mappings/ *.jsonl (optional, see below)
+
+Section JSONL lines use the same keys as seed_sections():
+chapter, section_title, content, symptoms, treatment, prevention,
+severity_level, image_examples, plus an optional "tags" list.
+
+Markdown sections look like:
+
+    # Chapter
+    ## Section title
+    severity_level: 3
+    tags: enfermedad, hongo
+    image_examples: ["monilia.jpg"]
+
+    Content paragraphs...
+
+    ### Síntomas
+    ...
+    ### Tratamiento
+    ...
+    ### Prevención
+    ...
+
+ML class mappings name their sections by chapter and title, since section
+ids are only assigned while loading:
+
+    {"ml_class_id": "monilia", "ml_class_label": "Moniliasis",
+     "confidence_threshold": 0.7,
+     "sections": [{"chapter": "...", "section_title": "..."}]}
+
+A source without ml_mappings/ builds a database without ML mappings.
+
+Every reader is a generator and rows are written in fixed-size batches, so
+memory stays bounded by the batch size regardless of corpus size.
+
+Usage:
+    python scripts/create_cacao_db.py --source path/to/source --bulk
+"""
+
+import json
+import os
+import unicodedata
+from itertools import islice
+
+BATCH_SIZE = 1000
+
+SECTION_FIELDS = (
+    'chapter', 'section_title', 'content', 'symptoms', 'treatment',
+    'prevention', 'severity_level', 'image_examples',
+)
+
+# Markdown "###" headings mapped to section fields (accents and case ignored)
+MARKDOWN_FIELD_HEADINGS = {
+    'contenido': 'content',
+    'content': 'content',
+    'sintomas': 'symptoms',
+    'symptoms': 'symptoms',
+    'tratamiento': 'treatment',
+    'treatment': 'treatment',
+    'prevencion': 'prevention',
+    'prevention': 'prevention',
+}
+
+MARKDOWN_METADATA_KEYS = ('severity_level', 'tags', 'image_examples')
+
+
+def batched(iterable, size):
+    """Yield lists of up to size items from iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_source_files(directory, suffixes):
+    """Yield files under directory with one of the given suffixes, in sorted order."""
+    if not os.path.isdir(directory):
+        return
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(suffixes):
+                yield os.path.join(root, name)
+
+
+def iter_jsonl(path):
+    """Yield one dict per non-empty line of a JSONL file."""
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_no}: invalid JSON ({e})") from e
+
+
+def _fold(text):
+    """Lowercase and strip accents, for matching Markdown headings."""
+    decomposed = unicodedata.normalize('NFKD', text.strip().lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _finish_markdown_section(chapter, section, fields):
+    record = {'chapter': chapter, **section}
+    for field, lines in fields.items():
+        text = '\n'.join(lines).strip()
+        record[field] = text or None
+    return record
+
+
+def iter_markdown_sections(path):
+    """Yield section dicts from a Markdown file, one "##" heading at a time."""
+    chapter = None
+    section = None
+    fields = {}
+    current_field = 'content'
+
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            stripped = line.rstrip('\n')
+
+            if stripped.startswith('# '):
+                if section is not None:
+                    yield _finish_markdown_section(chapter, section, fields)
+                    section = None
+                chapter = stripped[2:].strip()
+            elif stripped.startswith('## '):
+                if section is not None:
+                    yield _finish_markdown_section(chapter, section, fields)
+                section = {'section_title': stripped[3:].strip()}
+                fields = {'content': []}
+                current_field = 'content'
+            elif stripped.startswith('### ') and section is not None:
+                current_field = MARKDOWN_FIELD_HEADINGS.get(_fold(stripped[4:]), current_field)
+                fields.setdefault(current_field, [])
+            elif section is not None:
+                key, sep, value = stripped.partition(':')
+                if (sep and key.strip() in MARKDOWN_METADATA_KEYS
+                        and current_field == 'content' and not any(fields['content'])):
+                    section[key.strip()] = value.strip()
+                else:
+                    fields[current_field].append(stripped)
+
+    if section is not None:
+        yield _finish_markdown_section(chapter, section, fields)
+
+
+def normalize_section(record, origin=''):
+    """Coerce a raw section record into column values plus a tag list."""
+    missing = [k for k in ('chapter', 'section_title', 'content') if not record.get(k)]
+    if missing:
+        raise ValueError(f"{origin}: section is missing {', '.join(missing)}")
+
+    tags = record.get('tags') or []
+    if isinstance(tags, str):
+        tags = [t.strip() for t in tags.split(',') if t.strip()]
+
+    images = record.get('image_examples')
+    if isinstance(images, list):
+        images = json.dumps(images, ensure_ascii=False)
+
+    row = {field: record.get(field) for field in SECTION_FIELDS}
+    row['severity_level'] = int(record.get('severity_level') or 1)
+    row['image_examples'] = images
+    return row, tags
+
+
+def iter_sections(source_dir):
+    """Yield (row, tags) for every section in source_dir/sections."""
+    for path in iter_source_files(os.path.join(source_dir, 'sections'), ('.jsonl', '.md')):
+        records = iter_jsonl(path) if path.endswith('.jsonl') else iter_markdown_sections(path)
+        for record in records:
+            yield normalize_section(record, path)
+
+
+def iter_tags(source_dir):
+    """Yield tag names from source_dir/tags."""
+    for path in iter_source_files(os.path.join(source_dir, 'tags'), ('.txt', '.jsonl')):
+        if path.endswith('.jsonl'):
+            for record in iter_jsonl(path):
+                yield record['name']
+        else:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    name = line.strip()
+                    if name and not name.startswith('#'):
+                        yield name
+
+
+def iter_synonyms(source_dir):
+    """Yield (term, synonym) pairs from source_dir/synonyms."""
+    for path in iter_source_files(os.path.join(source_dir, 'synonyms'), ('.jsonl', '.tsv')):
+        if path.endswith('.jsonl'):
+            for record in iter_jsonl(path):
+                yield record['term'], record['synonym']
+        else:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    parts = line.rstrip('\n').split('\t')
+                    if len(parts) >= 2 and parts[0]:
+                        yield parts[0], parts[1]
+
+
+def iter_ml_mappings(source_dir):
+    """Yield (path, mapping record) from source_dir/ml_mappings."""
+    for path in iter_source_files(os.path.join(source_dir, 'ml_mappings'), ('.jsonl',)):
+        for record in iter_jsonl(path):
+            if not record.get('ml_class_id'):
+                raise ValueError(f"{path}: ML mapping is missing ml_class_id")
+            yield path, record
+
+
+def load_ml_mappings(conn, mappings):
+    """Insert ML class mappings, resolving their sections to the loaded ids."""
+    section_ids = {}
+    for section_id, chapter, title in conn.execute(
+            'SELECT id, chapter, section_title FROM manual_sections ORDER BY id DESC'):
+        # Descending, so a repeated chapter/title resolves to its first section
+        section_ids[(chapter, title)] = section_id
+
+    rows = []
+    for path, record in mappings:
+        ids = []
+        for section in record.get('sections') or []:
+            key = (section.get('chapter'), section.get('section_title'))
+            if key not in section_ids:
+                raise ValueError(f"{path}: ML class {record['ml_class_id']} refers to unknown section "
+                                 f"{key[0]!r} / {key[1]!r}")
+            ids.append(str(section_ids[key]))
+        rows.append((record['ml_class_id'], record.get('ml_class_label') or record['ml_class_id'],
+                     ','.join(ids), float(record.get('confidence_threshold', 0.7))))
+    conn.executemany('''
+        INSERT OR REPLACE INTO ml_to_manual_mapping
+        (ml_class_id, ml_class_label, section_ids, confidence_threshold)
+        VALUES (?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    return len(rows)
+
+
+def resolve_tag_ids(conn, names, tag_ids):
+    """Make sure every tag in names exists and is present in the tag_ids map."""
+    new_names = [n for n in dict.fromkeys(names) if n not in tag_ids]
+    if not new_names:
+        return
+    conn.executemany('INSERT OR IGNORE INTO tags (name) VALUES (?)', [(n,) for n in new_names])
+    placeholders = ','.join('?' * len(new_names))
+    for tag_id, name in conn.execute(
+            f'SELECT id, name FROM tags WHERE name IN ({placeholders})', new_names):
+        tag_ids[name] = tag_id
+
+
+def load_tags(conn, tags, tag_ids, batch_size=BATCH_SIZE):
+    count = 0
+    for batch in batched(tags, batch_size):
+        resolve_tag_ids(conn, batch, tag_ids)
+        conn.commit()
+        count += len(batch)
+    return count
+
+
+def load_sections(conn, sections, tag_ids, batch_size=BATCH_SIZE):
+    """Insert (row, tags) pairs in batches and link their tags.
+
+    Ids are assigned here rather than by AUTOINCREMENT so the section_tags
+    rows of a batch can be written without reading the ids back.
+    """
+    next_id = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM manual_sections').fetchone()[0]
+    count = 0
+
+    for batch in batched(sections, batch_size):
+        section_rows = []
+        tag_rows = []
+        resolve_tag_ids(conn, [t for _, tags in batch for t in tags], tag_ids)
+
+        for row, tags in batch:
+            section_rows.append((next_id, *(row[field] for field in SECTION_FIELDS)))
+            tag_rows.extend((next_id, tag_ids[t]) for t in tags)
+            next_id += 1
+
+        conn.executemany('''
+            INSERT INTO manual_sections
+            (id, chapter, section_title, content, symptoms, treatment, prevention, severity_level, image_examples)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', section_rows)
+        conn.executemany(
+            'INSERT OR IGNORE INTO section_tags (section_id, tag_id) VALUES (?, ?)',
+            tag_rows
+        )
+        conn.commit()
+        count += len(section_rows)
+
+    return count
+
+
+def load_synonyms(conn, synonyms, batch_size=BATCH_SIZE):
+    count = 0
+    for batch in batched(synonyms, batch_size):
+        conn.executemany('INSERT OR IGNORE INTO synonyms (term, synonym) VALUES (?, ?)', batch)
+        conn.commit()
+        count += len(batch)
+    return count
+
+
+def load_source(conn, source_dir, batch_size=BATCH_SIZE):
+    """Stream tags, sections and synonyms from source_dir into the database."""
+    if not os.path.isdir(source_dir):
+        raise FileNotFoundError(f"Source directory not found: {source_dir}")
+
+    tag_ids = dict(conn.execute('SELECT name, id FROM tags').fetchall())
+    tags = load_tags(conn, iter_tags(source_dir), tag_ids, batch_size)
+    sections = load_sections(conn, iter_sections(source_dir), tag_ids, batch_size)
+    synonyms = load_synonyms(conn, iter_synonyms(source_dir), batch_size)
+    ml_mappings = load_ml_mappings(conn, iter_ml_mappings(source_dir))
+
+    print(f"Loaded {sections} sections, {tags} tags, {synonyms} synonyms and "
+          f"{ml_mappings} ML mappings from {source_dir}")
+    return {'sections': sections, 'tags': tags, 'synonyms': synonyms, 'ml_mappings': ml_mappings}
+
+
+def export_source(conn, out_dir):
+    """Write the sections, tags and synonyms of a built database as a source directory.
+
+    Useful to turn the seed data (or any existing DB) into source files that
+    load_source() can read back.
+    """
+    for sub in ('sections', 'tags', 'synonyms', 'ml_mappings'):
+        os.makedirs(os.path.join(out_dir, sub), exist_ok=True)
+
+    with open(os.path.join(out_dir, 'tags', 'tags.txt'), 'w', encoding='utf-8') as f:
+        for (name,) in conn.execute('SELECT name FROM tags ORDER BY id'):
+            f.write(name + '\n')
+
+    cursor = conn.execute(f'''
+        SELECT ms.id, {', '.join('ms.' + c for c in SECTION_FIELDS)},
+               (SELECT json_group_array(name) FROM (
+                    SELECT t.name FROM section_tags st JOIN tags t ON t.id = st.tag_id
+                    WHERE st.section_id = ms.id ORDER BY t.id))
+        FROM manual_sections ms ORDER BY ms.id
+    ''')
+    with open(os.path.join(out_dir, 'sections', 'sections.jsonl'), 'w', encoding='utf-8') as f:
+        for row in cursor:
+            record = dict(zip(SECTION_FIELDS, row[1:-1]))
+            # A JSON array, so tag names containing commas survive the round trip
+            record['tags'] = json.loads(row[-1])
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    with open(os.path.join(out_dir, 'synonyms', 'synonyms.jsonl'), 'w', encoding='utf-8') as f:
+        for term, synonym in conn.execute('SELECT term, synonym FROM synonyms ORDER BY id'):
+            f.write(json.dumps({'term': term, 'synonym': synonym}, ensure_ascii=False) + '\n')
+
+    from create_cacao_db import parse_section_ids
+
+    titles = {section_id: (chapter, title) for section_id, chapter, title in
+              conn.execute('SELECT id, chapter, section_title FROM manual_sections')}
+    with open(os.path.join(out_dir, 'ml_mappings', 'ml_mappings.jsonl'), 'w', encoding='utf-8') as f:
+        for class_id, label, section_ids, threshold in conn.execute('''
+            SELECT ml_class_id, ml_class_label, section_ids, confidence_threshold
+            FROM ml_to_manual_mapping ORDER BY ml_class_id
+        '''):
+            sections = [{'chapter': titles[i][0], 'section_title': titles[i][1]}
+                        for i in parse_section_ids(section_ids) if i in titles]
+            f.write(json.dumps({'ml_class_id': class_id, 'ml_class_label': label,
+                                'confidence_threshold': threshold, 'sections': sections},
+                               ensure_ascii=False) + '\n')
+
+    print(f"Exported source files to {out_dir}")
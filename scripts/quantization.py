@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Quantized storage formats for section embeddings.
+
+Formats for the `embedding` column (recorded in `embedding_format`):
+- float32: 4 bytes/dim, what the app reads today
+- float16: 2 bytes/dim
+- int8:    1 byte/dim plus a per-vector scale and zero point
+           (`embedding_scale`, `embedding_zero_point`), dequantized as
+           (q - zero_point) * scale
+
+Independently, `embedding_bits` can hold the 1-bit sign vector of each
+embedding (dim / 8 bytes) for a Hamming-distance prefilter before exact
+re-ranking.
+
+The report mode measures recall@k of every format against float32 on the
+corpus itself (each sampled section is used as a query), to decide how much
+recall to trade for a smaller index.
+
+Usage:
+    python scripts/quantization.py --db assets/database/cacao_manual.db --k 10
+"""
+
+import argparse
+import os
+import sqlite3
+import numpy as np
+
+DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'assets', 'database', 'cacao_manual.db')
+FORMATS = ('float32', 'float16', 'int8')
+DEFAULT_FORMAT = 'float32'
+
+# Popcount of every byte value, for Hamming distances on packed bits
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+# Queries and packed rows compared per step in hamming_distances(); the
+# intermediate XOR block is at most HAMMING_QUERY_BLOCK x HAMMING_ROW_BLOCK x bytes
+HAMMING_QUERY_BLOCK = 64
+HAMMING_ROW_BLOCK = 4096
+
+
+def bytes_per_vector(fmt, dim):
+    """Storage cost of one vector in the given format (int8 includes scale/zero point)."""
+    if fmt == 'float32':
+        return dim * 4
+    if fmt == 'float16':
+        return dim * 2
+    if fmt == 'int8':
+        return dim + 16
+    if fmt == 'binary':
+        return (dim + 7) // 8
+    raise ValueError(f"Unknown embedding format: {fmt}")
+
+
+def quantize(embeddings, fmt):
+    """Quantize a (n, dim) float32 matrix.
+
+    Returns (blobs, scales, zero_points); scales and zero points are None
+    for the float formats.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if embeddings.ndim == 1:
+        embeddings = embeddings[None, :]
+
+    if fmt == 'float32':
+        return [row.tobytes() for row in embeddings], None, None
+    if fmt == 'float16':
+        return [row.tobytes() for row in embeddings.astype(np.float16)], None, None
+    if fmt == 'int8':
+        q, scales, zero_points = quantize_int8(embeddings)
+        return [row.tobytes() for row in q], scales, zero_points
+    raise ValueError(f"Unknown embedding format: {fmt}")
+
+
+def quantize_int8(embeddings):
+    """Per-vector asymmetric int8 quantization mapping [min, max] onto [-128, 127]."""
+    mins = embeddings.min(axis=1)
+    maxs = embeddings.max(axis=1)
+    scales = (maxs - mins) / 255.0
+    scales[scales == 0] = 1.0
+    zero_points = np.round(-128.0 - mins / scales)
+    q = np.clip(np.round(embeddings / scales[:, None] + zero_points[:, None]), -128, 127)
+    return q.astype(np.int8), scales.astype(np.float64), zero_points.astype(np.float64)
+
+
+def dequantize(blob, fmt, scale=None, zero_point=None):
+    """Decode one stored vector back to float32."""
+    if fmt in (None, 'float32'):
+        return np.frombuffer(blob, dtype=np.float32)
+    if fmt == 'float16':
+        return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+    if fmt == 'int8':
+        q = np.frombuffer(blob, dtype=np.int8).astype(np.float32)
+        return (q - np.float32(zero_point)) * np.float32(scale)
+    raise ValueError(f"Unknown embedding format: {fmt}")
+
+
+def dequantize_matrix(embeddings, fmt):
+    """Round-trip a float32 matrix through a format (used for the recall report)."""
+    if fmt == 'float32':
+        return embeddings
+    if fmt == 'float16':
+        return embeddings.astype(np.float16).astype(np.float32)
+    if fmt == 'int8':
+        q, scales, zero_points = quantize_int8(embeddings)
+        return ((q.astype(np.float32) - zero_points[:, None]) * scales[:, None]).astype(np.float32)
+    raise ValueError(f"Unknown embedding format: {fmt}")
+
+
+def sign_bits(embeddings):
+    """Pack the sign of every dimension into bits: (n, dim) -> (n, dim / 8) uint8."""
+    embeddings = np.asarray(embeddings)
+    if embeddings.ndim == 1:
+        embeddings = embeddings[None, :]
+    return np.packbits(embeddings > 0, axis=1)
+
+
+def hamming_distances(query_bits, bits, query_block=HAMMING_QUERY_BLOCK, row_block=HAMMING_ROW_BLOCK):
+    """Hamming distance from each packed query (q, b) to each packed row (n, b).
+
+    Computed a block of queries by a block of rows at a time into a (q, n)
+    int32 result, so the temporaries stay bounded whatever the corpus size.
+    """
+    query_bits, bits = np.atleast_2d(query_bits), np.atleast_2d(bits)
+    distances = np.empty((len(query_bits), len(bits)), dtype=np.int32)
+    for q_start in range(0, len(query_bits), query_block):
+        queries = query_bits[q_start:q_start + query_block, None, :]
+        for r_start in range(0, len(bits), row_block):
+            xor = np.bitwise_xor(queries, bits[None, r_start:r_start + row_block, :])
+            distances[q_start:q_start + query_block, r_start:r_start + row_block] = \
+                _POPCOUNT[xor].sum(axis=2, dtype=np.int32)
+    return distances
+
+
+def load_float32_matrix(conn):
+    """Load (ids, matrix) for every section stored as float32."""
+    ids = []
+    rows = []
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(manual_sections)')}
+    format_filter = "AND COALESCE(embedding_format, 'float32') = 'float32'" \
+        if 'embedding_format' in columns else ''
+    for section_id, blob in conn.execute(f'''
+        SELECT id, embedding FROM manual_sections
+        WHERE embedding IS NOT NULL {format_filter}
+        ORDER BY id
+    '''):
+        ids.append(section_id)
+        rows.append(np.frombuffer(blob, dtype=np.float32))
+    if not rows:
+        return ids, np.zeros((0, 0), dtype=np.float32)
+    return ids, np.vstack(rows)
+
+
+def _top_k(scores, k):
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return top
+
+
+def _recall(expected, actual):
+    hits = sum(len(set(e) & set(a)) for e, a in zip(expected, actual))
+    return hits / max(1, expected.size)
+
+
+def quantization_report(matrix, k=10, max_queries=1000, prefilter_factor=4, seed=0):
+    """Recall@k and size of each format relative to exact float32 search.
+
+    Each sampled corpus vector is used as a query against all other vectors.
+    Returns a list of dicts, one per format plus the binary variants.
+    """
+    n, dim = matrix.shape
+    if n < 2:
+        return []
+    k = min(k, n - 1)
+    rng = np.random.default_rng(seed)
+    query_idx = np.sort(rng.choice(n, size=min(max_queries, n), replace=False))
+    queries = matrix[query_idx]
+
+    def search(candidates, block=256):
+        results = []
+        for start in range(0, len(queries), block):
+            scores = queries[start:start + block] @ candidates.T
+            scores[np.arange(scores.shape[0]), query_idx[start:start + block]] = -np.inf
+            results.append(_top_k(scores, k))
+        return np.vstack(results)
+
+    baseline = search(matrix)
+    report = []
+    for fmt in FORMATS:
+        approx = baseline if fmt == 'float32' else search(dequantize_matrix(matrix, fmt))
+        report.append({
+            'format': fmt,
+            'bytes_per_vector': bytes_per_vector(fmt, dim),
+            'compression': bytes_per_vector('float32', dim) / bytes_per_vector(fmt, dim),
+            f'recall@{k}': _recall(baseline, approx),
+        })
+
+    bits = sign_bits(matrix)
+    query_bits = bits[query_idx]
+    n_candidates = min(n - 1, k * prefilter_factor)
+    binary_only = []
+    prefiltered = []
+    for start in range(0, len(queries), 256):
+        distances = hamming_distances(query_bits[start:start + 256], bits).astype(np.float32)
+        rows = np.arange(distances.shape[0])
+        distances[rows, query_idx[start:start + 256]] = np.inf
+        binary_only.append(_top_k(-distances, k))
+
+        candidates = _top_k(-distances, n_candidates)
+        for row, cand in zip(range(start, start + len(rows)), candidates):
+            exact = matrix[cand] @ queries[row]
+            prefiltered.append(cand[np.argsort(-exact)[:k]])
+
+    for name, approx in (('binary', np.vstack(binary_only)),
+                         (f'binary+rerank(x{prefilter_factor})', np.vstack(prefiltered))):
+        report.append({
+            'format': name,
+            'bytes_per_vector': bytes_per_vector('binary', dim),
+            'compression': bytes_per_vector('float32', dim) / bytes_per_vector('binary', dim),
+            f'recall@{k}': _recall(baseline, approx),
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall-vs-size report for embedding formats.')
+    parser.add_argument('--db', default=DB_PATH, help='Database with float32 embeddings')
+    parser.add_argument('--k', type=int, default=10, help='Neighbours per query (default: 10)')
+    parser.add_argument('--queries', type=int, default=1000, help='Max sampled queries (default: 1000)')
+    parser.add_argument('--prefilter-factor', type=int, default=4,
+                        help='Hamming candidates per result before re-ranking (default: 4)')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    ids, matrix = load_float32_matrix(conn)
+    conn.close()
+
+    if len(ids) < 2:
+        print("Error: need at least two float32 embeddings. Run generate_embeddings.py first.")
+        exit(1)
+
+    report = quantization_report(matrix, args.k, args.queries, args.prefilter_factor)
+    recall_key = f'recall@{min(args.k, len(ids) - 1)}'
+
+    print(f"Vectors: {len(ids)}  Dimension: {matrix.shape[1]}")
+    print(f"\n{'Format':<22}{'Bytes/vector':>14}{'Smaller':>10}{recall_key:>12}")
+    for row in report:
+        print(f"{row['format']:<22}{row['bytes_per_vector']:>14}"
+              f"{row['compression']:>9.1f}x{row[recall_key]:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
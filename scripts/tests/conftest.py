@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The build scripts import each other by plain module name
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
@@ -0,0 +1,103 @@
+import contextlib
+import io
+import json
+import os
+import sqlite3
+
+import pytest
+
+import build_multicrop
+import create_cacao_db
+import kb_sources
+
+
+def _write_jsonl(path, records):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def _make_crops(tmp_path):
+    crops_dir = tmp_path / 'crops'
+    seed_db = str(tmp_path / 'seed.db')
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_cacao_db.main(['--db', seed_db])
+        conn = sqlite3.connect(seed_db)
+        kb_sources.export_source(conn, str(crops_dir / 'cacao'))
+        conn.close()
+
+    sections = [{'chapter': 'Enfermedades', 'section_title': title, 'content': f'{title} del café'}
+                for title in ('Roya', 'Broca', 'Ojo de gallo')]
+    _write_jsonl(str(crops_dir / 'cafe' / 'sections' / 'sections.jsonl'), sections)
+    _write_jsonl(str(crops_dir / 'cafe' / 'ml_mappings' / 'ml_mappings.jsonl'), [
+        {'ml_class_id': 'roya', 'ml_class_label': 'Roya', 'confidence_threshold': 0.7,
+         'sections': [{'chapter': 'Enfermedades', 'section_title': 'Roya'}]},
+        {'ml_class_id': 'broca', 'ml_class_label': 'Broca', 'confidence_threshold': 0.6,
+         'sections': [{'chapter': 'Enfermedades', 'section_title': 'Broca'},
+                      {'chapter': 'Enfermedades', 'section_title': 'Ojo de gallo'}]},
+    ])
+    return str(crops_dir)
+
+
+def test_merged_mappings_point_at_existing_sections(tmp_path):
+    crops = build_multicrop.discover_crops(_make_crops(tmp_path))
+    merged = str(tmp_path / 'merged.db')
+    with contextlib.redirect_stdout(io.StringIO()):
+        db_paths = build_multicrop.build_crops(crops, str(tmp_path / 'out'), [], 1)
+        build_multicrop.merge_crops(db_paths, merged)
+
+    conn = sqlite3.connect(merged)
+    try:
+        section_ids = {row[0] for row in conn.execute('SELECT id FROM manual_sections')}
+        mappings = conn.execute('SELECT ml_class_id, section_ids FROM ml_to_manual_mapping').fetchall()
+        assert {class_id for class_id, _ in mappings} >= {'monilia', 'cafe:roya', 'cafe:broca'}
+        # The cafe crop has no cacao classes of its own
+        assert not [c for c, _ in mappings if c.startswith('cafe:') and c not in ('cafe:roya', 'cafe:broca')]
+        for class_id, ids in mappings:
+            mapped = create_cacao_db.parse_section_ids(ids)
+            assert mapped, class_id
+            assert set(mapped) <= section_ids, class_id
+
+        crops_of = dict(conn.execute('SELECT id, crop FROM manual_sections'))
+        for class_id, ids in mappings:
+            expected = 'cafe' if class_id.startswith('cafe:') else 'cacao'
+            assert {crops_of[i] for i in create_cacao_db.parse_section_ids(ids)} == {expected}
+
+        for class_id, bundle in conn.execute('SELECT ml_class_id, bundle FROM ml_answer_bundles'):
+            assert json.loads(bundle)['sections'], class_id
+    finally:
+        conn.close()
+
+
+def test_stub_embeddings_keep_the_stub_model_name(tmp_path):
+    import benchmark_kb
+
+    crops = build_multicrop.discover_crops(_make_crops(tmp_path))
+    merged = str(tmp_path / 'merged.db')
+    with contextlib.redirect_stdout(io.StringIO()):
+        db_paths = build_multicrop.build_crops(crops, str(tmp_path / 'out'), [], 1)
+        embedded = build_multicrop.embed_crops(db_paths, 1, shard_size=2, use_stub=True)
+        build_multicrop.merge_crops(db_paths, merged)
+
+    conn = sqlite3.connect(merged)
+    try:
+        assert embedded == conn.execute('SELECT COUNT(*) FROM manual_sections').fetchone()[0]
+        models = conn.execute('SELECT DISTINCT embedding_model FROM manual_sections').fetchall()
+        assert models == [(benchmark_kb.STUB_MODEL_NAME,)]
+    finally:
+        conn.close()
+
+
+def test_merge_refuses_crops_of_different_models(tmp_path):
+    crops = build_multicrop.discover_crops(_make_crops(tmp_path))
+    with contextlib.redirect_stdout(io.StringIO()):
+        db_paths = build_multicrop.build_crops(crops, str(tmp_path / 'out'), [], 1)
+        build_multicrop.embed_crops(db_paths, 1, use_stub=True)
+    conn = sqlite3.connect(db_paths['cafe'])
+    conn.execute("UPDATE manual_sections SET embedding_model = 'other-model'")
+    conn.commit()
+    conn.close()
+
+    with pytest.raises(ValueError, match='other-model'):
+        build_multicrop.merge_crops(db_paths, str(tmp_path / 'merged.db'))
@@ -0,0 +1,16 @@
+import chunking
+
+
+def test_long_title_keeps_half_the_window_for_content():
+    title = ' '.join(f'titulo{i}' for i in range(200))
+    content = ' '.join(f'palabra{i}' for i in range(100)) + '.'
+    chunks = list(chunking.iter_section_chunks((1, 'Capítulo', title, content, None, None, None),
+                                               window=60, overlap=10))
+
+    assert chunks
+    for field, text in chunks:
+        prefix, body = text.split(': ', 1)
+        assert field == 'content'
+        assert len(text.split()) <= 60
+        assert len(prefix.split()) <= 30
+        assert len(body.split()) >= 20
@@ -0,0 +1,25 @@
+import numpy as np
+
+import dedup
+
+
+def planted_vectors(n=60, dim=16, seed=3):
+    rng = np.random.default_rng(seed)
+    matrix = rng.normal(size=(n, dim)).astype(np.float32)
+    # Near-copies spread across row and column blocks
+    for source, target in [(0, 13), (2, 41), (17, 18), (25, 59), (41, 50)]:
+        matrix[target] = matrix[source] + rng.normal(scale=0.01, size=dim)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def test_similar_pairs_match_brute_force_across_blocks():
+    matrix = planted_vectors()
+    threshold = 0.95
+    expected = set(zip(*np.nonzero(np.triu(matrix @ matrix.T >= threshold, 1))))
+    assert expected
+
+    for block_rows, block_cols in [(7, 5), (5, 7), (60, 60), (1, 1)]:
+        left, right = dedup.similar_pairs(matrix, threshold, block_rows, block_cols)
+        found = set(zip(left.tolist(), right.tolist()))
+        assert found == {(int(i), int(j)) for i, j in expected}
+        assert len(found) == len(left)
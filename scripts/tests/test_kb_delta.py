@@ -0,0 +1,85 @@
+import contextlib
+import io
+import json
+import shutil
+import sqlite3
+
+import chunking
+import create_cacao_db
+import kb_delta
+import kb_sources
+
+
+def _build(tmp_path, name, drop_title=None):
+    """Build a database from the seed source, optionally without one section."""
+    source = tmp_path / f'{name}_source'
+    db_path = str(tmp_path / f'{name}.db')
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_cacao_db.main(['--db', str(tmp_path / 'seed.db')])
+        conn = sqlite3.connect(str(tmp_path / 'seed.db'))
+        kb_sources.export_source(conn, str(source))
+        conn.close()
+        sections_path = source / 'sections' / 'sections.jsonl'
+        records = [json.loads(line) for line in sections_path.read_text(encoding='utf-8').splitlines()]
+        sections_path.write_text(''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records
+                                         if r['section_title'] != drop_title), encoding='utf-8')
+        create_cacao_db.main(['--db', db_path, '--source', str(source)])
+
+    conn = sqlite3.connect(db_path)
+    chunking.create_chunk_table(conn)
+    conn.execute('''
+        INSERT INTO section_chunks (section_id, chunk_index, field, text, text_hash)
+        SELECT id, 0, 'content', section_title, chapter FROM manual_sections
+    ''')
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def _unmapped_title(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        mapped = {i for (ids,) in conn.execute('SELECT section_ids FROM ml_to_manual_mapping')
+                  for i in create_cacao_db.parse_section_ids(ids)}
+        return next(title for section_id, title in
+                    conn.execute('SELECT id, section_title FROM manual_sections ORDER BY id')
+                    if section_id not in mapped)
+    finally:
+        conn.close()
+
+
+def test_deleting_one_section_ships_one_delete(tmp_path):
+    old_db = _build(tmp_path, 'old')
+    new_db = _build(tmp_path, 'new', drop_title=_unmapped_title(old_db))
+    package = str(tmp_path / 'update.kbdelta.gz')
+
+    summary = kb_delta.create_delta(old_db, new_db, package)
+    assert (summary['inserted'], summary['updated'], summary['deleted']) == (0, 0, 1)
+    assert summary['moved'] > 0
+    # The chunks follow their sections, so none of them travel
+    assert 'section_chunks' not in summary['side_tables']
+
+    patched = str(tmp_path / 'patched.db')
+    shutil.copy(old_db, patched)
+    with contextlib.redirect_stdout(io.StringIO()):
+        counts = kb_delta.apply_delta(patched, package)
+    assert counts['deleted'] == 1
+
+    conn = sqlite3.connect(patched)
+    target = sqlite3.connect(new_db)
+    try:
+        query = '''
+            SELECT ms.id, ms.section_title, group_concat(t.name)
+            FROM manual_sections ms
+            LEFT JOIN section_tags st ON st.section_id = ms.id
+            LEFT JOIN tags t ON t.id = st.tag_id
+            GROUP BY ms.id ORDER BY ms.id
+        '''
+        assert conn.execute(query).fetchall() == target.execute(query).fetchall()
+        chunks = 'SELECT section_id, text FROM section_chunks ORDER BY section_id'
+        assert conn.execute(chunks).fetchall() == target.execute(chunks).fetchall()
+        fts = "SELECT rowid FROM manual_fts WHERE manual_fts MATCH 'cacao' ORDER BY rowid"
+        assert conn.execute(fts).fetchall() == target.execute(fts).fetchall()
+    finally:
+        conn.close()
+        target.close()
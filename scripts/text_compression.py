@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Dictionary-compressed storage of the long text columns of manual_sections.
+
+content, symptoms, treatment and prevention make up most of the shipped
+database besides the embeddings. This stage replaces each of their values
+with a compressed BLOB. Sections repeat the same vocabulary and phrasing,
+so every value is compressed against one dictionary trained on the corpus:
+
+- zlib (stdlib): a raw-deflate preset dictionary built from the corpus'
+  most valuable repeated phrases (deflate only looks back 32 KB);
+- zstd (needs the zstandard package): a dictionary trained with ZDICT,
+  falling back to the phrase dictionary for corpora too small to train on.
+
+The codec and dictionary live in `text_dictionary`. manual_fts stays an
+external-content index of manual_sections: it must already be built from
+the uncompressed text (create_cacao_db.py compresses after the FTS
+rebuild). MATCH and bm25 ranking only read the index; snippet() and
+highlight() would read the compressed bytes and must not be used. The FTS
+sync triggers are removed while the text is compressed, because they would
+index compressed bytes, and restored by decompress_database().
+
+Readers decompress only the rows they display, with read_sections(), or
+in SQL with the kb_text() function that register_text_function() installs
+(kb_text(content) returns the plain text of compressed and uncompressed
+databases alike). The app itself still reads the plain columns, so only
+ship compressed databases to readers that decode them.
+
+Usage:
+    python scripts/create_cacao_db.py --bulk --compress-text zlib
+    python scripts/text_compression.py --db path/to/cacao_manual.db --codec zstd   # compress in place
+    python scripts/text_compression.py --db path/to/cacao_manual.db --decompress
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+import zlib
+from collections import Counter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'assets', 'database', 'cacao_manual.db')
+TEXT_COLUMNS = ('content', 'symptoms', 'treatment', 'prevention')
+CODECS = ('zlib', 'zstd')
+ZLIB_DICT_SIZE = 32 * 1024   # deflate's window; a larger preset dictionary is never used
+ZSTD_DICT_SIZE = 64 * 1024
+TRAIN_SAMPLE = 2000          # sections sampled for the dictionary
+PHRASE_WORDS = (2, 3, 5, 8)  # n-gram lengths considered for the phrase dictionary
+PAGE_SIZE = 256
+
+
+def _zstd_required():
+    if zstandard is None:
+        raise ValueError("zstd compression needs the zstandard package (pip install zstandard)")
+
+
+def build_phrase_dictionary(texts, size=ZLIB_DICT_SIZE):
+    """Most valuable repeated phrases, best last (deflate reaches the end of the dictionary cheapest)."""
+    counts = Counter()
+    for text in texts:
+        words = text.split()
+        for n in PHRASE_WORDS:
+            for i in range(len(words) - n + 1):
+                counts[' '.join(words[i:i + n])] += 1
+    scored = sorted(((count * len(phrase.encode('utf-8')), phrase)
+                     for phrase, count in counts.items() if count > 1),
+                    key=lambda item: (-item[0], item[1]))
+    chosen, total = [], 0
+    for _, phrase in scored:
+        if total >= size:
+            break
+        # Skip phrases already contained in a recently chosen longer one
+        if any(phrase in other for other in chosen[-64:]):
+            continue
+        chosen.append(phrase)
+        total += len(phrase.encode('utf-8')) + 1
+    return ' '.join(reversed(chosen)).encode('utf-8')[-size:]
+
+
+class TextCodec:
+    """Compresses and decompresses single column values against a shared dictionary."""
+
+    def __init__(self, codec, dictionary):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown text codec: {codec}")
+        self.codec = codec
+        self.dictionary = dictionary
+        if codec == 'zstd':
+            _zstd_required()
+            zdict = zstandard.ZstdCompressionDict(dictionary)
+            self._compressor = zstandard.ZstdCompressor(level=19, dict_data=zdict,
+                                                        write_checksum=False, write_dict_id=False)
+            self._decompressor = zstandard.ZstdDecompressor(dict_data=zdict)
+
+    @classmethod
+    def train(cls, codec, texts, size=None):
+        texts = [t for t in texts if t]
+        if codec == 'zstd':
+            _zstd_required()
+            size = size or ZSTD_DICT_SIZE
+            try:
+                trained = zstandard.train_dictionary(size, [t.encode('utf-8') for t in texts])
+                return cls(codec, trained.as_bytes())
+            except zstandard.ZstdError:
+                pass  # Too few samples to train on; use the phrase dictionary as raw content
+            return cls(codec, build_phrase_dictionary(texts, size))
+        return cls(codec, build_phrase_dictionary(texts, min(size or ZLIB_DICT_SIZE, ZLIB_DICT_SIZE)))
+
+    def compress(self, text):
+        data = text.encode('utf-8')
+        if self.codec == 'zstd':
+            return self._compressor.compress(data)
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, self.dictionary)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, blob):
+        if self.codec == 'zstd':
+            return self._decompressor.decompress(blob).decode('utf-8')
+        decompressor = zlib.decompressobj(-15, self.dictionary)
+        return (decompressor.decompress(blob) + decompressor.flush()).decode('utf-8')
+
+    def decode(self, value):
+        """Plain text of a stored value (compressed values are BLOBs, plain ones TEXT)."""
+        return self.decompress(value) if isinstance(value, bytes) else value
+
+
+def is_compressed(conn, schema='main'):
+    return conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' "
+                        "AND name = 'text_dictionary'").fetchone() is not None
+
+
+def load_codec(conn, schema='main'):
+    """The database's TextCodec, or None if its text is stored uncompressed."""
+    if not is_compressed(conn, schema):
+        return None
+    codec, dictionary = conn.execute(
+        f'SELECT codec, dictionary FROM {schema}.text_dictionary WHERE id = 1').fetchone()
+    return TextCodec(codec, dictionary)
+
+
+def register_text_function(conn, schema='main'):
+    """Install kb_text(value): the plain text of a (possibly compressed) column value."""
+    codec = load_codec(conn, schema)
+    conn.create_function('kb_text', 1, codec.decode if codec else (lambda value: value),
+                         deterministic=True)
+    return codec
+
+
+def read_sections(conn, section_ids, codec=None):
+    """{id: {column: text}} of the given sections, decompressing only those rows."""
+    if not section_ids:
+        return {}
+    codec = codec if codec is not None else load_codec(conn)
+    decode = codec.decode if codec else (lambda value: value)
+    placeholders = ','.join('?' * len(section_ids))
+    rows = conn.execute(f'''
+        SELECT id, chapter, section_title, {', '.join(TEXT_COLUMNS)}
+        FROM manual_sections WHERE id IN ({placeholders})
+    ''', list(section_ids))
+    names = ('chapter', 'section_title') + TEXT_COLUMNS
+    return {row[0]: {name: decode(value) if name in TEXT_COLUMNS else value
+                     for name, value in zip(names, row[1:])}
+            for row in rows}
+
+
+def live_bytes(conn):
+    """Bytes in use by the database file, not counting free pages."""
+    page_count, freelist, page_size = (conn.execute(f'PRAGMA {p}').fetchone()[0]
+                                       for p in ('page_count', 'freelist_count', 'page_size'))
+    return (page_count - freelist) * page_size
+
+
+def text_bytes(conn):
+    sums = ' + '.join(f'COALESCE(SUM(LENGTH(CAST({c} AS BLOB))), 0)' for c in TEXT_COLUMNS)
+    return conn.execute(f'SELECT {sums} FROM manual_sections').fetchone()[0]
+
+
+def _fts_triggers(conn):
+    return [row[0] for row in conn.execute('''
+        SELECT sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'manual_sections'
+        AND name IN ('manual_sections_ai', 'manual_sections_ad', 'manual_sections_au') ORDER BY name
+    ''')]
+
+
+def _iter_pages(conn, page_size=PAGE_SIZE):
+    last_id = 0
+    while True:
+        rows = conn.execute(f'''
+            SELECT id, {', '.join(TEXT_COLUMNS)} FROM manual_sections WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, page_size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def sample_texts(conn, limit=TRAIN_SAMPLE):
+    """Text values of about `limit` sections spread over the id range."""
+    total = conn.execute('SELECT COUNT(*) FROM manual_sections').fetchone()[0]
+    rows = conn.execute(f'''
+        SELECT {', '.join(TEXT_COLUMNS)} FROM manual_sections WHERE id % ? = 0 ORDER BY id
+    ''', (max(1, total // limit),)).fetchall()
+    return [value for row in rows for value in row if value]
+
+
+def decompression_cost(conn, codec, sample=1000, k=10):
+    """Microseconds to decompress one row's text columns, and to read and decode k rows."""
+    rows = conn.execute(f'SELECT {", ".join(TEXT_COLUMNS)} FROM manual_sections ORDER BY id LIMIT ?',
+                        (sample,)).fetchall()
+    if not rows:
+        return {'us_per_row': 0.0, 'top_k_ms': 0.0, 'k': k}
+    ids = [row[0] for row in conn.execute('SELECT id FROM manual_sections ORDER BY id LIMIT ?', (k,))]
+    start = time.perf_counter()
+    for row in rows:
+        for value in row:
+            codec.decode(value)
+    per_row = (time.perf_counter() - start) / len(rows)
+    start = time.perf_counter()
+    read_sections(conn, ids, codec)
+    return {'us_per_row': per_row * 1e6, 'top_k_ms': (time.perf_counter() - start) * 1e3, 'k': k}
+
+
+def compress_database(conn, codec_name='zlib', dict_size=None, vacuum=True):
+    """Compress the text columns in place; returns the size and cost report.
+
+    The FTS index must already hold the uncompressed text. Commits, and
+    vacuums so the freed pages leave the file.
+    """
+    if is_compressed(conn):
+        raise ValueError("Text columns are already compressed")
+    before_text, before_file = text_bytes(conn), live_bytes(conn)
+
+    start = time.perf_counter()
+    codec = TextCodec.train(codec_name, sample_texts(conn), dict_size)
+    with conn:
+        triggers = _fts_triggers(conn)
+        for name in ('manual_sections_ai', 'manual_sections_ad', 'manual_sections_au'):
+            conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+        conn.execute('''
+            CREATE TABLE text_dictionary (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                codec TEXT NOT NULL,
+                dictionary BLOB NOT NULL,
+                columns TEXT NOT NULL,
+                fts_triggers TEXT NOT NULL
+            )
+        ''')
+        conn.execute('INSERT INTO text_dictionary VALUES (1, ?, ?, ?, ?)',
+                     (codec.codec, codec.dictionary, json.dumps(TEXT_COLUMNS), json.dumps(triggers)))
+        assignments = ', '.join(f'{c} = ?' for c in TEXT_COLUMNS)
+        for rows in _iter_pages(conn):
+            conn.executemany(f'UPDATE manual_sections SET {assignments} WHERE id = ?', [
+                (*(None if value is None else codec.compress(value) for value in row[1:]), row[0])
+                for row in rows
+            ])
+    compress_seconds = time.perf_counter() - start
+    if vacuum:
+        conn.execute('VACUUM')
+
+    return {
+        'codec': codec.codec,
+        'dictionary_bytes': len(codec.dictionary),
+        'text_bytes_before': before_text,
+        'text_bytes_after': text_bytes(conn),
+        'file_bytes_before': before_file,
+        'file_bytes_after': live_bytes(conn),
+        'compress_seconds': compress_seconds,
+        'vacuumed': vacuum,
+        **decompression_cost(conn, codec),
+    }
+
+
+def decompress_database(conn):
+    """Restore plain text columns and the FTS sync triggers. Commits."""
+    codec = load_codec(conn)
+    if codec is None:
+        return 0
+    triggers = json.loads(conn.execute('SELECT fts_triggers FROM text_dictionary WHERE id = 1').fetchone()[0])
+    restored = 0
+    with conn:
+        assignments = ', '.join(f'{c} = ?' for c in TEXT_COLUMNS)
+        for rows in _iter_pages(conn):
+            conn.executemany(f'UPDATE manual_sections SET {assignments} WHERE id = ?',
+                             [(*(codec.decode(value) for value in row[1:]), row[0]) for row in rows])
+            restored += len(rows)
+        conn.execute('DROP TABLE text_dictionary')
+        for sql in triggers:
+            conn.execute(sql)
+    return restored
+
+
+def print_report(report):
+    print(f"Compressed text columns with {report['codec']} "
+          f"({report['dictionary_bytes'] / 1024:.1f} KB dictionary, {report['compress_seconds']:.2f}s)")
+    print(f"  Text:      {report['text_bytes_before'] / 1024:.1f} KB -> {report['text_bytes_after'] / 1024:.1f} KB "
+          f"({report['text_bytes_after'] / max(1, report['text_bytes_before']):.1%})")
+    print(f"  Database:  {report['file_bytes_before'] / 1024:.1f} KB -> {report['file_bytes_after'] / 1024:.1f} KB"
+          f"{'' if report['vacuumed'] else ' in use (not vacuumed)'}")
+    print(f"  Decompression: {report['us_per_row']:.1f} µs per row, "
+          f"{report['top_k_ms']:.2f} ms to read and decode the top {report['k']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compress or decompress the manual text columns.')
+    parser.add_argument('--db', default=DB_PATH, help='Path to cacao_manual.db')
+    parser.add_argument('--codec', choices=CODECS, default='zlib', help='Compression codec (default: zlib)')
+    parser.add_argument('--dict-size', type=int, help='Dictionary size in bytes '
+                                                      f'(default: {ZLIB_DICT_SIZE} zlib, {ZSTD_DICT_SIZE} zstd)')
+    parser.add_argument('--decompress', action='store_true', help='Restore plain text columns')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"Error: Database not found at {args.db}")
+        exit(1)
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.decompress:
+            print(f"Decompressed {decompress_database(conn)} sections")
+        else:
+            print_report(compress_database(conn, args.codec, args.dict_size))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()